@@ -1,5 +1,7 @@
 """Application configuration loaded from environment variables."""
 
+from typing import Dict
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -11,8 +13,94 @@ class Settings(BaseSettings):
     faiss_index_path: str = "./faiss_store"
     faiss_feedback_path: str = "./faiss_feedback_store"
     faiss_pedagogy_path: str = "./faiss_pedagogy_store"
+    embedding_model: str = "all-MiniLM-L6-v2"
+    # "groq", or "fake" for the offline stand-in used in load tests: it answers
+    # every prompt with canned, format-valid output at the latency and token
+    # rate below, without network calls or quota.
+    llm_provider: str = "groq"
+    fake_llm_latency_ms: float = 400.0
+    fake_llm_tokens_per_second: float = 250.0
+    fake_llm_response_tokens: int = 300
+    # Every router's chat model shares one pool of keep-alive connections.
+    llm_model: str = "llama-3.1-8b-instant"
+    llm_pool_size: int = 20
+    llm_keepalive_seconds: float = 60.0
+    llm_timeout_seconds: float = 60.0
+    llm_connect_timeout_seconds: float = 5.0
+    # Scheduler limits; the defaults are the Groq free tier for llama-3.1-8b-instant.
+    llm_requests_per_minute: int = 30
+    llm_tokens_per_minute: int = 6000
+    llm_max_concurrency: int = 8
+    llm_output_tokens_estimate: int = 600
+    # Calls not admitted within this are answered 503 with a Retry-After header.
+    llm_queue_timeout_seconds: float = 60.0
+    llm_max_retries: int = 3
+    llm_backoff_seconds: float = 1.0
+    llm_backoff_max_seconds: float = 20.0
+    query_cache_size: int = 2048
+    # Held per process, so only correct with a single uvicorn worker (see rag.response_cache).
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 2048
+    response_cache_ttl_seconds: int = 86400
+    # Cosine similarity at which a cached answer is reused for a different query
+    # in the same scope; 1.0 restricts the cache to exact (normalized) matches.
+    response_cache_similarity: float = 0.97
+    response_cache_path: str = ""
+    # Changes are written to response_cache_path at most this often, off the event loop.
+    response_cache_persist_seconds: float = 2.0
+    # Index type of the compacted content base: flat | ivf_flat | ivf_pq | hnsw.
+    # Bases below index_min_train_vectors stay flat. Convert an existing store
+    # with `python -m rag.index_types migrate`.
+    content_index_type: str = "flat"
+    index_min_train_vectors: int = 10000
+    index_nlist: int = 1024
+    index_nprobe: int = 16
+    # PQ sub-quantizers; reduced to a divisor of the embedding dimension.
+    index_pq_m: int = 48
+    index_pq_bits: int = 8
+    index_hnsw_m: int = 32
+    index_ef_construction: int = 200
+    index_ef_search: int = 64
+    # "vector" or "hybrid" (vector + BM25 merged by reciprocal rank fusion).
+    retrieval_mode: str = "vector"
+    hybrid_candidates: int = 20
+    rrf_k: int = 60
+    # Rerank over-fetched chunks before prompt assembly: off | lexical |
+    # cross_encoder. Past rerank_timeout_ms the retrieval order is kept.
+    rerank_mode: str = "off"
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_fetch_k: int = 12
+    rerank_top_k: int = 3
+    rerank_timeout_ms: int = 150
+    # Token budget of the retrieved context in each chain's prompt, with
+    # per-chain overrides (e.g. {"tts_script": 800}). Pedagogy analogies are
+    # guaranteed pedagogy_token_budget of it when any are retrieved.
+    context_token_budget: int = 1500
+    context_chain_budgets: Dict[str, int] = {}
+    pedagogy_token_budget: int = 300
+    # Precomputed chapter outputs (POST /precompute); empty keeps them in memory.
+    chapter_store_path: str = "./chapter_store.json"
+    precompute_concurrency: int = 2
     chunk_size: int = 1000
     chunk_overlap: int = 200
+    embedding_batch_size: int = 64
+    ingest_workers: int = 2
+    ingest_parse_processes: int = 4
+    compaction_interval_seconds: int = 60
+    compaction_min_segments: int = 8
+    ingest_jobs_retained: int = 200
+    precompute_jobs_retained: int = 200
+    # Ingest and precompute job records, shared so any worker can answer a
+    # status poll; empty keeps them in the accepting worker's memory.
+    job_store_path: str = "./jobs"
+    # Adds a Server-Timing header breaking each response down by pipeline stage.
+    server_timing_enabled: bool = False
+    # Per-request trace spans, appended to a rotating JSONL file (GET /traces).
+    tracing_enabled: bool = False
+    trace_path: str = "./traces.jsonl"
+    trace_max_bytes: int = 5_000_000
+    trace_backups: int = 3
+    trace_min_duration_ms: float = 0.0
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
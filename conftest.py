@@ -1,16 +1,20 @@
 """
 Root-level conftest: set env vars BEFORE any app module is imported,
-and mock out the pedagogy store build so tests do not hit the Google API
-during the FastAPI lifespan startup.
+and mock out the embedding warm-up and pedagogy store build so tests do not
+load models or hit external APIs during the FastAPI lifespan startup.
 """
 
 import os
 
 # Must be set before any import of config.py or app modules
 os.environ.setdefault("GOOGLE_API_KEY", "test-api-key")
+os.environ.setdefault("GROQ_API_KEY", "test-api-key")
 os.environ.setdefault("FAISS_INDEX_PATH", "./test_faiss_store")
 os.environ.setdefault("FAISS_FEEDBACK_PATH", "./test_faiss_feedback_store")
 os.environ.setdefault("FAISS_PEDAGOGY_PATH", "./test_faiss_pedagogy_store")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+os.environ.setdefault("CHAPTER_STORE_PATH", "")
+os.environ.setdefault("JOB_STORE_PATH", "")
 
 from unittest.mock import patch  # noqa: E402
 
@@ -19,6 +23,6 @@ import pytest  # noqa: E402
 
 @pytest.fixture(autouse=True)
 def mock_lifespan_builds():
-    """Prevent pedagogy store construction from running during test startup."""
-    with patch("main.build_pedagogy_store"):
+    """Prevent model warm-up, pedagogy store construction and compaction during test startup."""
+    with patch("main.warm_up"), patch("main.build_pedagogy_store"), patch("main.compactor"):
         yield
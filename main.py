@@ -1,25 +1,62 @@
 """FastAPI application entry point."""
 
-from contextlib import asynccontextmanager
+import asyncio
+import time
+from contextlib import asynccontextmanager, nullcontext
 from pathlib import Path
+from typing import Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 
+from config import settings
+from rag.embeddings import warm_up
+from rag.index_manager import index_manager
+from rag.llm import close_llm_clients
+from rag.metrics import (
+    CONTENT_TYPE,
+    HTTP_REQUEST_SECONDS,
+    collect_timings,
+    registry,
+    server_timing_header,
+)
 from rag.pedagogy_store import build_pedagogy_store
-from routers import adapt, auth, concept_graph, feedback, flashcard, ingest, quiz
+from rag.rerank import reranker
+from rag.response_cache import response_cache
+from rag.scheduler import llm_scheduler
+from rag.singleflight import inflight
+from rag.segments import compactor
+from rag.tracing import TracingMiddleware, trace_exporter
+from routers import adapt, auth, concept_graph, feedback, flashcard, ingest, precompute, quiz
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Build vector stores at startup if they don't already exist."""
+    """
+    Load the embedding (and any rerank) model and build vector stores at
+    startup if they don't already exist, then run the segment compactor for
+    the app's lifetime. The pooled LLM connections are closed and pending response-cache writes
+    flushed on shutdown.
+    """
+    try:
+        warm_up()
+    except Exception as exc:  # noqa: BLE001
+        print(f"[WARNING] Could not warm up embedding model at startup: {exc}")
     try:
         build_pedagogy_store()
     except Exception as exc:  # noqa: BLE001
         print(f"[WARNING] Could not build pedagogy store at startup: {exc}")
+    try:
+        reranker.warm_up()
+    except Exception as exc:  # noqa: BLE001
+        print(f"[WARNING] Could not load the rerank model at startup: {exc}")
+    compactor.start()
     yield
+    compactor.stop()
+    await close_llm_clients()
+    await asyncio.to_thread(response_cache.flush)
 
 
 app = FastAPI(
@@ -40,6 +77,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    """
+    Record each request's latency by route template, and add a Server-Timing
+    header of its pipeline stages when ``SERVER_TIMING_ENABLED`` is set.
+    Streamed responses are timed up to their first byte.
+    """
+    started = time.perf_counter()
+    with collect_timings() if settings.server_timing_enabled else nullcontext() as timings:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        elapsed,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=str(response.status_code),
+    )
+    if timings is not None:
+        stages = server_timing_header(timings + [("total", elapsed)])
+        response.headers["Server-Timing"] = stages
+    return response
+
+
+# Added last so it is outermost: each request's trace covers the middleware above.
+app.add_middleware(TracingMiddleware)
+
 app.include_router(ingest.router)
 app.include_router(adapt.router)
 app.include_router(feedback.router)
@@ -47,6 +112,7 @@ app.include_router(concept_graph.router)
 app.include_router(auth.router)
 app.include_router(quiz.router)
 app.include_router(flashcard.router)
+app.include_router(precompute.router)
 
 # Serve static assets (JS, CSS, images)
 app.mount("/static", StaticFiles(directory=Path(__file__).parent / "static"), name="static")
@@ -58,6 +124,59 @@ async def root() -> dict:
     return {"status": "ok", "service": "Inclusive Multimodal Learning API"}
 
 
+@app.get("/indexes", tags=["Health"])
+async def indexes() -> list:
+    """Report load time, vector count and memory footprint of each resident FAISS index."""
+    return index_manager.stats()
+
+
+@app.get("/rerank", tags=["Health"])
+async def rerank() -> dict:
+    """Report reranker outcomes, latency and how many fetched chunks it kept."""
+    return reranker.stats()
+
+
+@app.get("/llm", tags=["Health"])
+async def llm() -> dict:
+    """
+    Report LLM scheduler queue depth per priority, rate-limit headroom and
+    retries, plus how many requests were coalesced onto an in-flight one.
+    """
+    return {**llm_scheduler.stats(), "coalescing": inflight.stats()}
+
+
+@app.get("/metrics", tags=["Health"])
+async def metrics() -> Response:
+    """
+    Expose pipeline stage, LLM call, queue-wait and HTTP latency histograms
+    and per-chain token counts in the Prometheus text format.
+    """
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/traces", tags=["Health"])
+def traces(limit: int = 20, name: Optional[str] = None) -> list:
+    """
+    List the slowest recently exported request traces, slowest first, each
+    with its five slowest spans. Filter by root span, e.g. ``name=POST /adapt``.
+    """
+    return trace_exporter.slowest(limit, name)
+
+
+@app.get("/traces/{trace_id}", tags=["Health"])
+def trace(trace_id: str) -> dict:
+    """
+    Return every span of one exported trace in start order.
+
+    Raises:
+        HTTPException 404: No exported trace has this id (or it was rotated out).
+    """
+    found = trace_exporter.get(trace_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Unknown trace.")
+    return found
+
+
 @app.get("/ui", tags=["UI"], include_in_schema=False)
 async def serve_ui() -> FileResponse:
     return FileResponse(Path(__file__).parent / "static" / "index.html")
@@ -0,0 +1,514 @@
+"""
+Ingestion and retrieval micro-benchmarks on synthetic corpora.
+
+For each corpus size a content store of that many chunks is generated in a
+scratch directory, then the benchmark times:
+
+- building the store (embedding, segment writes, compaction);
+- ``ingest_pdf``'s stages for one new synthetic chapter PDF — parse, split,
+  dedup, embed and index write — against that store;
+- ``retrieve`` with and without the chapter filter, ``retrieve_with_feedback``
+  and ``retrieve_pedagogy``, as p50/p95/mean latency over distinct queries.
+
+Results are written as JSON so runs can be compared across commits, and
+``compare`` flags metrics that slowed down beyond a threshold. Usage::
+
+    python -m rag.bench run [--sizes 1000 10000 100000] [--out results.json] [--baseline old.json]
+    python -m rag.bench compare old.json new.json [--threshold 0.25]
+
+Each size runs in a fresh process with its own index paths, so the
+configured stores are never touched. By default chunks are embedded with a
+deterministic hash embedding of the model's dimension, which isolates index
+and search costs; ``--embeddings model`` uses the configured
+sentence-transformers model and includes its cost.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag.loadtest import percentile
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+CHUNKS_PER_CHAPTER = 200
+SUBJECTS = ("Science", "Mathematics", "Social Science", "English", "Physics", "Biology")
+
+_SYLLABLES = (
+    "ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pha", "tro",
+    "gen", "lux", "mor", "sta", "ion", "cel", "dyn", "geo", "ther", "bio",
+)
+
+
+# ── Synthetic content ──────────────────────────────────────────────────────
+class SyntheticCorpus:
+    """
+    Deterministic chapter text: a shared Zipf-distributed vocabulary plus
+    topic words that recur within each chapter, so BM25 and chapter filters
+    behave as on real textbooks.
+    """
+
+    def __init__(self, seed: int = 0, vocabulary: int = 8000, words_per_chunk: int = 150) -> None:
+        self.rng = np.random.default_rng(seed)
+        self.vocabulary = self._words(vocabulary)
+        ranks = np.arange(1, vocabulary + 1)
+        self.weights = (1.0 / ranks) / np.sum(1.0 / ranks)
+        self.words_per_chunk = words_per_chunk
+
+    def _words(self, count: int) -> List[str]:
+        words: List[str] = []
+        seen = set()
+        while len(words) < count:
+            parts = self.rng.choice(_SYLLABLES, size=self.rng.integers(2, 5))
+            word = "".join(parts)
+            if word not in seen:
+                seen.add(word)
+                words.append(word)
+        return words
+
+    def chapter(self, index: int) -> Tuple[int, str, str, List[str]]:
+        """Return (grade, subject, chapter title, topic words) of chapter ``index``."""
+        rng = np.random.default_rng(index)
+        topics = [str(w) for w in rng.choice(self.vocabulary[500:], size=8, replace=False)]
+        title = f"Chapter {index + 1}: {topics[0].title()} and {topics[1].title()}"
+        return 6 + index % 7, SUBJECTS[index % len(SUBJECTS)], title, topics
+
+    def text(self, topics: Sequence[str], words: Optional[int] = None) -> str:
+        """One chunk-sized passage mixing common vocabulary with ``topics``."""
+        count = words or self.words_per_chunk
+        picks = self.rng.choice(len(self.vocabulary), size=count, p=self.weights)
+        out = [self.vocabulary[i] for i in picks]
+        for position in self.rng.choice(count, size=max(1, count // 10), replace=False):
+            out[position] = topics[int(position) % len(topics)]
+        sentences = [" ".join(out[i : i + 12]).capitalize() + "." for i in range(0, count, 12)]
+        return " ".join(sentences)
+
+    def chunks(self, size: int) -> Tuple[List[str], List[dict]]:
+        """``size`` chunks spread over chapters of ``CHUNKS_PER_CHAPTER`` chunks."""
+        texts: List[str] = []
+        metadatas: List[dict] = []
+        for i in range(size):
+            grade, subject, title, topics = self.chapter(i // CHUNKS_PER_CHAPTER)
+            texts.append(self.text(topics))
+            metadatas.append(
+                {"source": f"synthetic-{i // CHUNKS_PER_CHAPTER}.pdf",
+                 "grade": grade, "subject": subject, "chapter": title}
+            )
+        return texts, metadatas
+
+    def query(self, topics: Sequence[str], n: int) -> str:
+        """A distinct student-style question about ``topics`` (distinct per ``n``)."""
+        extra = self.vocabulary[n % len(self.vocabulary)]
+        return f"Explain {topics[n % len(topics)]} and {extra} with an example ({n})"
+
+
+def synthetic_pdf(pages: Sequence[str], line_chars: int = 90) -> bytes:
+    """Build a minimal text PDF with one page per string (Helvetica, extractable)."""
+
+    def escape(text: str) -> str:
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for text in pages:
+        words, lines, line = text.split(), [], ""
+        for word in words:
+            if line and len(line) + 1 + len(word) > line_chars:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        if line:
+            lines.append(line)
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(
+            f"({escape(l)}) Tj T*" for l in lines
+        ) + " ET"
+        content = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 3 0 R >> >> >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids),
+        len(kids),
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    return bytes(out)
+
+
+# ── Timing helpers ─────────────────────────────────────────────────────────
+def _latency(call: Callable[[int], object], runs: int) -> Dict[str, float]:
+    """p50/p95/mean milliseconds of ``call(i)`` for ``i`` in ``range(runs)``, after one warm-up."""
+    call(runs)
+    samples = []
+    for i in range(runs):
+        started = time.perf_counter()
+        call(i)
+        samples.append(1000 * (time.perf_counter() - started))
+    return {
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "mean_ms": round(sum(samples) / len(samples), 3),
+    }
+
+
+class _StageClock:
+    """Progress callback recording when each ingestion stage starts."""
+
+    def __init__(self) -> None:
+        self.marks: List[Tuple[str, float]] = [("start", time.perf_counter())]
+
+    def __call__(self, **update: object) -> None:
+        stage = update.get("stage")
+        if stage:
+            self.marks.append((str(stage), time.perf_counter()))
+
+    def seconds(self, start: str, end: str) -> float:
+        times = dict(self.marks)
+        return round(times[end] - times[start], 4)
+
+
+# ── One corpus size (runs in a fresh process) ──────────────────────────────
+def _bench_size(size: int, workdir: str, options: dict) -> dict:
+    """Build a ``size``-chunk store under ``workdir`` and time ingestion and retrieval."""
+    # Point every store at the scratch directory before the app modules,
+    # which bind their paths at import, are loaded in this process.
+    os.environ.update(
+        {
+            "FAISS_INDEX_PATH": os.path.join(workdir, "content"),
+            "FAISS_FEEDBACK_PATH": os.path.join(workdir, "feedback"),
+            "FAISS_PEDAGOGY_PATH": os.path.join(workdir, "pedagogy"),
+            "RESPONSE_CACHE_ENABLED": "false",
+            "CHAPTER_STORE_PATH": "",
+        }
+    )
+    os.environ.setdefault("GROQ_API_KEY", "unused")
+
+    from langchain_community.vectorstores import FAISS
+
+    from config import settings
+    from rag import embeddings as embedding_registry
+    from rag.dedup import file_digest
+    from rag.index_manager import index_manager
+    from rag.ingestor import PdfUpload, _index_new_chunks, _parse, _split
+    from rag.pedagogy_store import build_pedagogy_store, retrieve_pedagogy
+    from rag.retriever import retrieve, retrieve_with_feedback
+    from rag.segments import append_segment, compact
+
+    if options["embeddings"] == "hash":
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        # Registered under the configured model name, so every caller gets it.
+        embedding_registry._models[settings.embedding_model] = DeterministicFakeEmbedding(
+            size=options["dimension"]
+        )
+    model = embedding_registry.get_embeddings()
+    corpus = SyntheticCorpus(seed=options["seed"])
+
+    # Build the store in bounded batches, as bulk ingestion would.
+    embed_s = write_s = 0.0
+    texts, metadatas = corpus.chunks(size)
+    batch = options["build_batch"]
+    for start in range(0, size, batch):
+        began = time.perf_counter()
+        vectors = model.embed_documents(texts[start : start + batch])
+        embed_s += time.perf_counter() - began
+        began = time.perf_counter()
+        segment = FAISS.from_embeddings(
+            zip(texts[start : start + batch], vectors),
+            model,
+            metadatas=metadatas[start : start + batch],
+        )
+        append_segment(settings.faiss_index_path, segment)
+        write_s += time.perf_counter() - began
+    began = time.perf_counter()
+    compact(settings.faiss_index_path, model, min_segments=1)
+    compact_s = time.perf_counter() - began
+    del texts, metadatas
+
+    began = time.perf_counter()
+    content = index_manager.get("content")
+    load_s = time.perf_counter() - began
+
+    # Ingest one new chapter through the same steps as ingest_pdf.
+    chapters = max(1, -(-size // CHUNKS_PER_CHAPTER))
+    grade, subject, title, topics = corpus.chapter(chapters)
+    pdf = synthetic_pdf([corpus.text(topics, words=400) for _ in range(options["pdf_pages"])])
+    upload = PdfUpload(pdf, "bench-new-chapter.pdf", grade=grade, subject=subject, chapter=title)
+    clock = _StageClock()
+    pages = _parse(upload)
+    clock(stage="split")
+    chunks = _split(pages)
+    clock(stage="dedup")
+    _index_new_chunks(
+        chunks,
+        {file_digest(pdf, grade, subject, title): upload.filename},
+        clock,
+    )
+    ingest = {
+        "pages": len(pages),
+        "chunks": len(chunks),
+        "parse_s": clock.seconds("start", "split"),
+        "split_s": clock.seconds("split", "dedup"),
+        "dedup_s": clock.seconds("dedup", "embedding"),
+        "embed_s": clock.seconds("embedding", "indexing"),
+        "index_write_s": clock.seconds("indexing", "done"),
+        "total_s": clock.seconds("start", "done"),
+    }
+
+    # A feedback store and the pedagogy store, as a deployed app has.
+    feedback_texts = [
+        f"Query: {corpus.query(corpus.chapter(i % chapters)[3], i)}\nAdapted Content: "
+        + corpus.text(corpus.chapter(i % chapters)[3], words=60)
+        for i in range(options["feedback"])
+    ]
+    append_segment(
+        settings.faiss_feedback_path,
+        FAISS.from_embeddings(
+            zip(feedback_texts, model.embed_documents(feedback_texts)),
+            model,
+            metadatas=[{"type": "feedback"}] * len(feedback_texts),
+        ),
+    )
+    build_pedagogy_store()
+
+    runs = options["queries"]
+    sample = [corpus.chapter(i % chapters) for i in range(runs + 1)]
+
+    def question(op: int, i: int) -> str:
+        # Distinct per operation and run, so no query vector comes from the cache.
+        return corpus.query(sample[i][3], op * (runs + 1) + i)
+
+    retrieval = {
+        "retrieve": _latency(lambda i: retrieve(question(0, i)), runs),
+        "retrieve_chapter": _latency(
+            lambda i: retrieve(question(1, i), chapter=sample[i][2]), runs
+        ),
+        "retrieve_with_feedback": _latency(
+            lambda i: retrieve_with_feedback(question(2, i), chapter=sample[i][2]), runs
+        ),
+        "retrieve_pedagogy": _latency(lambda i: retrieve_pedagogy(question(3, i)), runs),
+    }
+    return {
+        "chunks": size,
+        "chapters": chapters,
+        "build": {
+            "embed_s": round(embed_s, 4),
+            "segment_write_s": round(write_s, 4),
+            "compact_s": round(compact_s, 4),
+            "load_s": round(load_s, 4),
+            "vectors": content.ntotal if content is not None else 0,
+        },
+        "ingest": ingest,
+        "retrieval": retrieval,
+        "settings": {
+            "content_index_type": settings.content_index_type,
+            "retrieval_mode": settings.retrieval_mode,
+            "embedding_model": settings.embedding_model,
+        },
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        head = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{head}-dirty" if dirty else head
+
+
+def run(sizes: Sequence[int], options: dict) -> dict:
+    """Benchmark every size, each in a fresh process, and return the results document."""
+    results: Dict[str, dict] = {}
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{size}-") as workdir:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results[str(size)] = pool.submit(_bench_size, size, workdir, options).result()
+        print(f"[bench] {size} chunks done", file=sys.stderr)
+    return {
+        "meta": {
+            "commit": _commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} cpus)",
+            **options,
+        },
+        "results": results,
+    }
+
+
+# ── Comparing runs ─────────────────────────────────────────────────────────
+def _timed_metrics(result: dict, prefix: str = "") -> Dict[str, float]:
+    """Flatten one size's ``*_s`` and ``*_ms`` leaves to ``section.metric_ms`` milliseconds."""
+    metrics: Dict[str, float] = {}
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(_timed_metrics(value, f"{name}."))
+        elif isinstance(value, (int, float)) and key.endswith("_s"):
+            metrics[f"{name[:-2]}_ms"] = 1000 * value
+        elif isinstance(value, (int, float)) and key.endswith("_ms"):
+            metrics[name] = value
+    return metrics
+
+
+def compare(
+    baseline: dict, current: dict, threshold: float = 0.25, min_delta_ms: float = 1.0
+) -> List[dict]:
+    """
+    Compare the timed metrics of two results documents, size by size.
+
+    A metric is a regression when it grew by more than ``threshold`` (a
+    fraction) and by more than ``min_delta_ms``, so sub-millisecond jitter is
+    not flagged; an improvement is the mirror image.
+
+    Returns:
+        One row per metric present in both runs, with ``status`` set to
+        "regression", "improvement" or "ok".
+    """
+    rows = []
+    for size, result in current["results"].items():
+        before = baseline["results"].get(size)
+        if before is None:
+            continue
+        old_metrics = _timed_metrics(before)
+        for metric, new in _timed_metrics(result).items():
+            old = old_metrics.get(metric)
+            if old is None:
+                continue
+            delta = new - old
+            change = delta / old if old > 0 else 0.0
+            status = "ok"
+            if abs(delta) > min_delta_ms and abs(change) > threshold:
+                status = "regression" if delta > 0 else "improvement"
+            rows.append(
+                {
+                    "size": int(size),
+                    "metric": metric,
+                    "baseline_ms": round(old, 3),
+                    "current_ms": round(new, 3),
+                    "change": round(change, 3),
+                    "status": status,
+                }
+            )
+    return rows
+
+
+_COMPARABLE = ("embeddings", "dimension", "queries", "pdf_pages", "feedback", "seed")
+
+
+def format_comparison(baseline: dict, current: dict, rows: List[dict]) -> str:
+    """Render ``compare`` rows as a table, noting options that differ between the runs."""
+    lines = [
+        f"baseline {baseline['meta'].get('commit')} -> current {current['meta'].get('commit')}"
+    ]
+    differing = [
+        key for key in _COMPARABLE if baseline["meta"].get(key) != current["meta"].get(key)
+    ]
+    if differing:
+        lines.append(f"warning: runs differ in {', '.join(differing)}; timings may not compare")
+    lines.append(f"{'size':>7}  {'metric':<40}{'baseline':>11}{'current':>11}{'change':>9}  status")
+    for row in rows:
+        lines.append(
+            f"{row['size']:>7}  {row['metric']:<40}{row['baseline_ms']:>11}"
+            f"{row['current_ms']:>11}{row['change']:>+9.0%}  {row['status']}"
+        )
+    regressions = sum(row["status"] == "regression" for row in rows)
+    lines.append(f"{regressions} regression(s) across {len(rows)} metrics")
+    return "\n".join(lines)
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _report_comparison(baseline: dict, current: dict, threshold: float) -> int:
+    rows = compare(baseline, current, threshold)
+    print(format_comparison(baseline, current, rows))
+    return 1 if any(row["status"] == "regression" for row in rows) else 0
+
+
+def _main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m rag.bench")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("run", help="Benchmark ingestion and retrieval per corpus size.")
+    bench.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    bench.add_argument("--queries", type=int, default=200, help="Timed queries per operation.")
+    bench.add_argument("--embeddings", choices=("hash", "model"), default="hash")
+    bench.add_argument("--dimension", type=int, default=384, help="Hash embedding dimension.")
+    bench.add_argument("--pdf-pages", type=int, default=40)
+    bench.add_argument("--feedback", type=int, default=200, help="Feedback store entries.")
+    bench.add_argument("--build-batch", type=int, default=10000)
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--out", help="Results file; defaults to bench_results/<commit>.json.")
+    bench.add_argument("--baseline", help="Compare against this earlier results file.")
+    bench.add_argument("--threshold", type=float, default=0.25)
+    diff = sub.add_parser("compare", help="Flag regressions between two results files.")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        sys.exit(_report_comparison(_load(args.baseline), _load(args.current), args.threshold))
+
+    options = {
+        "embeddings": args.embeddings,
+        "dimension": args.dimension,
+        "queries": args.queries,
+        "pdf_pages": args.pdf_pages,
+        "feedback": args.feedback,
+        "build_batch": args.build_batch,
+        "seed": args.seed,
+    }
+    document = run(args.sizes, options)
+    out = args.out or os.path.join("bench_results", f"{document['meta']['commit'] or 'run'}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(document, fh, indent=2)
+    print(json.dumps(document["results"], indent=2))
+    print(f"Results written to {out}", file=sys.stderr)
+    if args.baseline:
+        sys.exit(_report_comparison(_load(args.baseline), document, args.threshold))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,218 @@
+"""Persistent store of precomputed chapter explanations, quizzes and flashcards."""
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from rag.embeddings import normalize_query
+
+# The chapter-opening question each learn page sends to /adapt, per profile.
+# Precomputed answers are served only for these exact (normalized) queries.
+CHAPTER_QUERIES: Dict[Optional[str], str] = {
+    "adhd": 'Break "{chapter}" from {subject} Grade {grade} into 3 sections with checkpoint questions.',
+    "dyslexia": (
+        'Explain "{chapter}" from {subject} Grade {grade}. Write 6-8 SHORT paragraphs. '
+        "Each paragraph maximum 2 sentences. Use very simple words. Avoid complex vocabulary."
+    ),
+    "cognitive": (
+        'Explain "{chapter}" from {subject} Grade {grade}. Use VERY simple words. '
+        "Write 5-7 short paragraphs. Each paragraph explains ONE simple idea. "
+        "Maximum 2 sentences each. Use the simplest possible words."
+    ),
+    "hearing_impairment": (
+        'Explain "{chapter}" from {subject} Grade {grade} in 5-6 clearly labelled sections. '
+        "Use visual descriptions."
+    ),
+    "visual_impairment": (
+        'Explain the topic "{chapter}" from {subject} Grade {grade} in clear paragraphs. '
+        "Use simple language ideal for a student. Avoid bullet points."
+    ),
+    None: 'Explain "{chapter}" from {subject} Grade {grade}.',
+}
+
+ARTIFACTS = ("quiz", "flashcards")
+
+
+def chapter_query(profile: Optional[str], grade: int, subject: str, chapter: str) -> str:
+    """Return the chapter-opening query a learn page sends for ``profile``."""
+    return CHAPTER_QUERIES[profile].format(grade=grade, subject=subject, chapter=chapter)
+
+
+def _key(grade: int, subject: str, chapter: str) -> str:
+    return json.dumps([int(grade), subject, chapter], ensure_ascii=False)
+
+
+class ChapterStore:
+    """
+    Precomputed outputs per (grade, subject, chapter), mirrored to a JSON file.
+
+    Each chapter holds one ``/adapt`` response per disability profile plus a
+    quiz and a set of flashcards. Unlike the response cache, entries do not
+    expire; they are replaced by the next precompute and dropped when new
+    content is ingested for the chapter. The file is re-read whenever another
+    worker process has rewritten it.
+    """
+
+    def __init__(self, path: str = "") -> None:
+        self.path = path
+        self._chapters: Dict[str, dict] = {}
+        self._signature: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def get_adapt(
+        self,
+        grade: Optional[int],
+        subject: Optional[str],
+        chapter: Optional[str],
+        profile: Optional[str],
+        query: str,
+    ) -> Optional[dict]:
+        """Return the stored AdaptResponse fields if ``query`` is the chapter-opening query."""
+        if grade is None or not subject or not chapter:
+            return None
+        with self._lock:
+            self._refresh()
+            entry = self._chapters.get(_key(grade, subject, chapter), {})
+            stored = entry.get("adapt", {}).get(profile or "")
+            if stored is None or stored["query"] != normalize_query(query):
+                return None
+            self.hits += 1
+            return stored["response"]
+
+    def get_artifact(
+        self, kind: str, grade: Optional[int], subject: Optional[str], chapter: Optional[str]
+    ) -> Optional[dict]:
+        """Return the stored quiz or flashcards of a chapter."""
+        if grade is None or not subject or not chapter:
+            return None
+        with self._lock:
+            self._refresh()
+            data = self._chapters.get(_key(grade, subject, chapter), {}).get(kind)
+            if data is not None:
+                self.hits += 1
+            return data
+
+    def put_adapt(
+        self,
+        grade: int,
+        subject: str,
+        chapter: str,
+        profile: Optional[str],
+        query: str,
+        response: dict,
+    ) -> None:
+        """Store the AdaptResponse fields answering ``query`` for one profile."""
+        with self._lock:
+            self._refresh()
+            entry = self._entry(grade, subject, chapter)
+            entry["adapt"][profile or ""] = {"query": normalize_query(query), "response": response}
+            self._persist()
+
+    def put_artifact(self, kind: str, grade: int, subject: str, chapter: str, data: dict) -> None:
+        """Store a chapter's quiz or flashcards."""
+        with self._lock:
+            self._refresh()
+            self._entry(grade, subject, chapter)[kind] = data
+            self._persist()
+
+    def invalidate(
+        self,
+        grade: Optional[int] = None,
+        subject: Optional[str] = None,
+        chapter: Optional[str] = None,
+    ) -> int:
+        """Drop every chapter matching all of the given fields; return how many."""
+        with self._lock:
+            self._refresh()
+            stale = [
+                key
+                for key, entry in self._chapters.items()
+                if (grade is None or entry["grade"] == grade)
+                and (subject is None or entry["subject"] == subject)
+                and (chapter is None or entry["chapter"] == chapter)
+            ]
+            for key in stale:
+                del self._chapters[key]
+            if stale:
+                self._persist()
+        return len(stale)
+
+    def invalidate_answer(self, query: str) -> int:
+        """
+        Drop every stored answer to ``query``, in any chapter or profile.
+
+        Called after a low rating, so the precomputed answer is regenerated
+        live; the chapter's quiz and flashcards are kept. Returns how many.
+        """
+        normalized = normalize_query(query)
+        with self._lock:
+            self._refresh()
+            dropped = 0
+            for entry in self._chapters.values():
+                for profile, stored in list(entry["adapt"].items()):
+                    if stored["query"] == normalized:
+                        del entry["adapt"][profile]
+                        dropped += 1
+            if dropped:
+                self._persist()
+        return dropped
+
+    def chapters(self) -> List[dict]:
+        """Summarise what is stored per chapter."""
+        with self._lock:
+            self._refresh()
+            return [
+                {
+                    "grade": entry["grade"],
+                    "subject": entry["subject"],
+                    "chapter": entry["chapter"],
+                    "profiles": sorted(p or "default" for p in entry["adapt"]),
+                    "quiz": "quiz" in entry,
+                    "flashcards": "flashcards" in entry,
+                    "updated_at": entry["updated_at"],
+                }
+                for entry in self._chapters.values()
+            ]
+
+    def _entry(self, grade: int, subject: str, chapter: str) -> dict:
+        entry = self._chapters.setdefault(
+            _key(grade, subject, chapter),
+            {"grade": int(grade), "subject": subject, "chapter": chapter, "adapt": {}},
+        )
+        entry["updated_at"] = time.time()
+        return entry
+
+    def _refresh(self) -> None:
+        if not self.path:
+            return
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == self._signature:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                self._chapters = json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return
+        self._signature = signature
+
+    def _persist(self) -> None:
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(self._chapters, fh, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        st = os.stat(self.path)
+        self._signature = (st.st_mtime_ns, st.st_size)
+
+
+chapter_store = ChapterStore(settings.chapter_store_path)
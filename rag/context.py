@@ -0,0 +1,149 @@
+"""Token-budgeted assembly of retrieved chunks into LLM prompt context."""
+
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+from config import settings
+
+# Llama-family BPE tokenizers average about four characters per token on
+# English prose; every punctuation mark is usually a token of its own.
+CHARS_PER_TOKEN = 4
+
+# A chunk that does not fit whole is cut to the remaining budget only if at
+# least this many tokens of it would survive; otherwise it is skipped.
+MIN_PARTIAL_TOKENS = 48
+
+# Shorter shared prefixes/suffixes are coincidence, not splitter overlap.
+MIN_OVERLAP_CHARS = 20
+
+SEPARATOR = "\n\n"
+SEPARATOR_TOKENS = 1
+
+_PIECE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_END = re.compile(r"[.!?।](?=\s)")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens in ``text``.
+
+    No tokenizer for the Groq-hosted models ships with the app, so words are
+    counted as ``ceil(len / CHARS_PER_TOKEN)`` tokens and punctuation as one.
+    """
+    return sum(math.ceil(len(piece) / CHARS_PER_TOKEN) for piece in _PIECE.findall(text))
+
+
+@dataclass
+class PackedContext:
+    """Context text for one prompt variable plus what it cost."""
+
+    text: str
+    budget: int
+    tokens: int = 0
+    chunks_used: int = 0
+    chunks_retrieved: int = 0
+    overlap_trimmed: int = 0
+
+
+def _overlap(before: str, after: str, limit: int) -> int:
+    """Length of the longest suffix of ``before`` that is a prefix of ``after``."""
+    for n in range(min(len(before), len(after), limit), MIN_OVERLAP_CHARS - 1, -1):
+        if before.endswith(after[:n]):
+            return n
+    return 0
+
+
+def _trim_overlap(text: str, packed: Sequence[str], limit: int) -> str:
+    """
+    Remove from ``text`` what adjacent chunks already in ``packed`` repeat.
+
+    The ingestion splitter repeats up to ``chunk_overlap`` characters between
+    neighbouring chunks of a page; whichever neighbour was packed first keeps
+    the shared text.
+    """
+    for other in packed:
+        if text in other:
+            return ""
+        head = _overlap(other, text, limit)
+        if head:
+            text = text[head:].lstrip()
+        tail = _overlap(text, other, limit)
+        if tail:
+            text = text[:-tail].rstrip()
+    return text
+
+
+def _truncate(text: str, budget: int) -> str:
+    """Cut ``text`` to at most ``budget`` tokens, at a sentence end where possible."""
+    pieces = list(_PIECE.finditer(text))
+    used = 0
+    end = 0
+    for match in pieces:
+        used += math.ceil(len(match.group()) / CHARS_PER_TOKEN)
+        if used > budget:
+            break
+        end = match.end()
+    cut = text[:end]
+    sentences = list(_SENTENCE_END.finditer(cut + " "))
+    if sentences and sentences[-1].end() > len(cut) // 2:
+        cut = cut[: sentences[-1].end()]
+    return cut.rstrip()
+
+
+def pack_context(
+    docs: Sequence[Document], budget: int, overlap_limit: Optional[int] = None
+) -> PackedContext:
+    """
+    Join the most relevant chunks of ``docs`` into at most ``budget`` tokens.
+
+    ``docs`` are taken in retrieval order, which is their order of value.
+    Text a chunk shares with an already packed neighbour from the same source
+    page is trimmed first; a chunk that still does not fit is cut at a
+    sentence end if enough of it survives, or skipped so a shorter, less
+    relevant chunk can use the space.
+
+    Args:
+        docs: Retrieved chunks, best first.
+        budget: Maximum tokens of the joined text, separators included.
+        overlap_limit: Longest overlap looked for, in characters; defaults to
+            ``settings.chunk_overlap``.
+
+    Returns:
+        The packed text and its token accounting.
+    """
+    limit = settings.chunk_overlap if overlap_limit is None else overlap_limit
+    packed = PackedContext(text="", budget=budget, chunks_retrieved=len(docs))
+    texts: List[str] = []
+    by_page: Dict[tuple, List[str]] = {}
+
+    for doc in docs:
+        remaining = budget - packed.tokens - (SEPARATOR_TOKENS if texts else 0)
+        if remaining < 1:
+            break
+        neighbours = by_page.setdefault((doc.metadata.get("source"), doc.metadata.get("page")), [])
+        original = doc.page_content.strip()
+        text = _trim_overlap(original, neighbours, limit)
+        trimmed = count_tokens(original) - count_tokens(text)
+        if not text:
+            packed.overlap_trimmed += trimmed
+            continue
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            if remaining < MIN_PARTIAL_TOKENS:
+                continue
+            text = _truncate(text, remaining)
+            if not text:
+                continue
+            tokens = count_tokens(text)
+        neighbours.append(text)
+        packed.tokens += tokens + (SEPARATOR_TOKENS if texts else 0)
+        texts.append(text)
+        packed.chunks_used += 1
+        packed.overlap_trimmed += trimmed
+
+    packed.text = SEPARATOR.join(texts)
+    return packed
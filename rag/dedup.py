@@ -0,0 +1,178 @@
+"""Persistent content-hash registry that keeps duplicate PDFs and chunks out of the index."""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+from config import settings
+from rag.docstore import documents_at
+from rag.filelock import file_lock
+from rag.index_manager import index_manager
+
+REGISTRY_FILE = "ingest_hashes.json"
+
+_CURRICULUM_FIELDS = ("grade", "subject", "chapter")
+
+
+def _digest(*parts: object) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def file_digest(
+    file_bytes: bytes,
+    grade: Optional[int] = None,
+    subject: Optional[str] = None,
+    chapter: Optional[str] = None,
+) -> str:
+    """
+    Return the digest identifying one upload of a PDF.
+
+    The curriculum metadata is part of the key: the same PDF uploaded for a
+    different chapter is not an exact re-upload, and its chunks must remain
+    retrievable under that chapter's filter.
+    """
+    return _digest(hashlib.sha256(file_bytes).hexdigest(), grade, subject, chapter)
+
+
+def chunk_digest(chunk: Document) -> str:
+    """Return the digest of a chunk's whitespace-normalized text within its curriculum scope."""
+    scope = [chunk.metadata.get(field) for field in _CURRICULUM_FIELDS]
+    return _digest(" ".join(chunk.page_content.split()), *scope)
+
+
+def _indexed_documents() -> Iterable[Document]:
+    """Yield every chunk already in the content index."""
+    index = index_manager.get("content")
+    for part in index.parts if index is not None else []:
+        yield from documents_at(part.store, range(part.store.index.ntotal))
+
+
+class HashRegistry:
+    """
+    Digests of every ingested PDF upload and chunk, mirrored to a JSON file.
+
+    Chunk digests are reserved before embedding so two concurrent ingestions
+    in this process do not both embed the same content; a reservation becomes
+    permanent on ``commit`` and is dropped on ``release`` if the index write
+    fails. Reservations are not shared between worker processes, so two
+    workers may both embed a PDF; the ingestor checks ``committed`` and
+    commits under the index write lock, so it is still indexed only once.
+
+    The file is re-read whenever another process has changed it. When no file
+    exists yet the registry is seeded from the chunks already indexed, so
+    content ingested before deduplication existed is recognised too.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        seed: Optional[Callable[[], Iterable[Document]]] = None,
+    ) -> None:
+        self.path = path
+        self._seed = seed
+        self._files: Dict[str, dict] = {}
+        self._chunks: Set[str] = set()
+        self._pending: Set[str] = set()
+        self._signature: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def has_file(self, digest: str) -> bool:
+        """Return True if a PDF upload with this digest has already been indexed."""
+        with self._lock:
+            self._refresh()
+            return digest in self._files
+
+    def reserve(self, chunks: List[Document]) -> Tuple[List[Document], List[str]]:
+        """
+        Claim the chunks not yet indexed or being indexed by another ingestion.
+
+        Duplicates within ``chunks`` itself are dropped as well.
+
+        Returns:
+            The new chunks and their digests, in input order.
+        """
+        fresh: List[Document] = []
+        digests: List[str] = []
+        with self._lock:
+            self._refresh()
+            for chunk in chunks:
+                digest = chunk_digest(chunk)
+                if digest in self._chunks or digest in self._pending:
+                    continue
+                self._pending.add(digest)
+                fresh.append(chunk)
+                digests.append(digest)
+        return fresh, digests
+
+    def committed(self, digests: List[str]) -> Set[str]:
+        """Return those of ``digests`` already indexed, including by other processes."""
+        with self._lock:
+            self._refresh()
+            return self._chunks.intersection(digests)
+
+    def release(self, digests: List[str]) -> None:
+        """Drop reservations whose chunks were not indexed."""
+        with self._lock:
+            self._pending.difference_update(digests)
+
+    def commit(self, digests: List[str], files: Optional[Dict[str, dict]] = None) -> None:
+        """
+        Record reserved chunks (and the uploads they came from) as indexed.
+
+        Args:
+            digests: Chunk digests returned by ``reserve``.
+            files: File digest -> ``{"filename", "chunks"}`` for each upload.
+        """
+        # The file lock makes the re-read + write atomic across worker processes.
+        with self._lock, file_lock(f"{self.path}.lock"):
+            self._refresh()
+            self._pending.difference_update(digests)
+            self._chunks.update(digests)
+            self._files.update(files or {})
+            self._persist()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of registered uploads and chunks."""
+        with self._lock:
+            self._refresh()
+            return {"files": len(self._files), "chunks": len(self._chunks)}
+
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._signature is None and self._seed is not None and not self._chunks:
+                self._chunks = {chunk_digest(doc) for doc in self._seed()}
+            return
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == self._signature:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return
+        self._files = data.get("files", {})
+        self._chunks = set(data.get("chunks", []))
+        self._signature = signature
+
+    def _persist(self) -> None:
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{os.path.basename(self.path)}.{uuid.uuid4().hex}")
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump({"files": self._files, "chunks": sorted(self._chunks)}, fh)
+        os.replace(tmp_path, self.path)
+        st = os.stat(self.path)
+        self._signature = (st.st_mtime_ns, st.st_size)
+
+
+ingest_registry = HashRegistry(
+    os.path.join(settings.faiss_index_path, REGISTRY_FILE),
+    seed=_indexed_documents,
+)
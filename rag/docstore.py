@@ -0,0 +1,275 @@
+"""
+SQLite docstore for saved FAISS segments, addressed by vector position.
+
+Usage::
+
+    python -m rag.docstore migrate    # rewrite index.pkl stores as docs.sqlite
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from rag.lexical import Posting, tokenize
+
+DOCS_FILE = "docs.sqlite"
+
+_SCHEMA = """
+CREATE TABLE docs (
+    position     INTEGER PRIMARY KEY,
+    id           TEXT NOT NULL,
+    page_content TEXT NOT NULL,
+    metadata     TEXT NOT NULL,
+    grade        INTEGER,
+    subject      TEXT,
+    chapter      TEXT,
+    length       INTEGER NOT NULL
+);
+CREATE INDEX docs_curriculum ON docs (grade, subject, chapter);
+CREATE TABLE postings (
+    term     TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    tf       INTEGER NOT NULL
+);
+CREATE INDEX postings_term ON postings (term);
+"""
+
+# Filters on these columns are applied in SQL; see rag.partitions.PARTITION_FIELDS.
+_CURRICULUM_COLUMNS = ("grade", "subject", "chapter")
+
+# (grade, subject, chapter)
+Curriculum = Tuple[Optional[int], Optional[str], Optional[str]]
+
+
+def save_docstore(directory: str, store: FAISS) -> None:
+    """
+    Write the documents of ``store`` to ``docs.sqlite``, one row per vector position.
+
+    The segment's BM25 inverted index (term -> position, term frequency) is
+    written to the same file, so keyword search grows with each segment.
+    """
+    conn = sqlite3.connect(os.path.join(directory, DOCS_FILE))
+    try:
+        conn.executescript(_SCHEMA)
+        for position in range(store.index.ntotal):
+            key = store.index_to_docstore_id[position]
+            doc = store.docstore.search(key)
+            meta = doc.metadata
+            terms = tokenize(doc.page_content)
+            conn.execute(
+                "INSERT INTO docs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    position,
+                    doc.id or str(key),
+                    doc.page_content,
+                    json.dumps(meta, ensure_ascii=False),
+                    meta.get("grade"),
+                    meta.get("subject"),
+                    meta.get("chapter"),
+                    len(terms),
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                [(term, position, tf) for term, tf in Counter(terms).items()],
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def has_docstore(directory: str) -> bool:
+    """Return True if ``directory`` was saved with a SQLite docstore."""
+    return os.path.exists(os.path.join(directory, DOCS_FILE))
+
+
+class PositionIds(Mapping[int, int]):
+    """``index_to_docstore_id`` for a ``SqliteDocstore``: vector position ``i`` maps to row ``i``."""
+
+    def __init__(self, size: int) -> None:
+        self._size = size
+
+    def __getitem__(self, position: int) -> int:
+        if not 0 <= position < self._size:
+            raise KeyError(position)
+        return position
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._size))
+
+    def __len__(self) -> int:
+        return self._size
+
+
+def _document(row: tuple) -> Document:
+    return Document(id=row[0], page_content=row[1], metadata=json.loads(row[2]))
+
+
+class SqliteDocstore(Docstore):
+    """
+    Read-only docstore over a segment's ``docs.sqlite``.
+
+    Nothing is decoded at load time: a search reads only the rows it returns,
+    through a memory-mapped read-only connection whose pages are shared by
+    every worker process via the OS page cache.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self._conn = sqlite3.connect(
+            f"file:{os.path.join(directory, DOCS_FILE)}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA mmap_size = 1073741824")
+        self._lock = threading.Lock()
+        with self._lock:
+            self._size = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            self.has_postings = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'postings'"
+            ).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def search(self, search: int) -> Union[str, Document]:
+        """Return the document at vector position ``search``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, page_content, metadata FROM docs WHERE position = ?", (int(search),)
+            ).fetchone()
+        return _document(row) if row is not None else f"ID {search} not found."
+
+    def fetch(self, positions: Sequence[int]) -> List[Document]:
+        """Return the documents at ``positions``, in order, with one query."""
+        wanted = [int(p) for p in positions]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, id, page_content, metadata FROM docs "
+                f"WHERE position IN ({','.join('?' * len(wanted))})",
+                wanted,
+            ).fetchall()
+        by_position = {row[0]: _document(row[1:]) for row in rows}
+        return [by_position[p] for p in wanted]
+
+    def curriculum(
+        self, grade: Optional[int] = None, subject: Optional[str] = None
+    ) -> "Counter[Curriculum]":
+        """Count chunks per (grade, subject, chapter), optionally within a grade/subject."""
+        query = "SELECT grade, subject, chapter, COUNT(*) FROM docs"
+        clauses, args = [], []
+        for column, value in (("grade", grade), ("subject", subject)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " GROUP BY grade, subject, chapter"
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return Counter({(g, s, c): n for g, s, c, n in rows})
+
+    def lexicon_stats(self) -> Tuple[int, int]:
+        """Return the number of documents and their total length in tokens."""
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(length), 0) FROM docs").fetchone()[0]
+        return self._size, total
+
+    def document_frequencies(self, terms: Sequence[str]) -> Dict[str, int]:
+        """Return the number of documents containing each term."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT term, COUNT(*) FROM postings "
+                f"WHERE term IN ({','.join('?' * len(terms))}) GROUP BY term",
+                list(terms),
+            ).fetchall()
+        return {term: dict(rows).get(term, 0) for term in terms}
+
+    def postings(self, terms: Sequence[str], filter: Optional[dict] = None) -> List[Posting]:
+        """
+        Return (position, term, tf, length) for each document containing a term.
+
+        Curriculum keys of ``filter`` are applied in SQL, any others to the
+        JSON metadata of the matching rows.
+        """
+        query = (
+            "SELECT p.position, p.term, p.tf, d.length, d.metadata FROM postings p "
+            f"JOIN docs d ON d.position = p.position WHERE p.term IN ({','.join('?' * len(terms))})"
+        )
+        args: list = list(terms)
+        rest = dict(filter or {})
+        for column in _CURRICULUM_COLUMNS:
+            if column in rest:
+                query += f" AND d.{column} = ?"
+                args.append(rest.pop(column))
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [
+            (position, term, tf, length)
+            for position, term, tf, length, metadata in rows
+            if not rest or all(json.loads(metadata).get(k) == v for k, v in rest.items())
+        ]
+
+
+def documents_at(store: FAISS, positions: Sequence[int]) -> List[Document]:
+    """Return the documents of ``store`` at vector ``positions``, batching where supported."""
+    if isinstance(store.docstore, SqliteDocstore):
+        return store.docstore.fetch(positions)
+    return [store.docstore.search(store.index_to_docstore_id[p]) for p in positions]
+
+
+def curriculum_counts(
+    store: FAISS, grade: Optional[int] = None, subject: Optional[str] = None
+) -> "Counter[Curriculum]":
+    """Count the chunks of ``store`` per (grade, subject, chapter)."""
+    if isinstance(store.docstore, SqliteDocstore):
+        return store.docstore.curriculum(grade, subject)
+    # Pickled stores have no query support; scan their documents.
+    counts: "Counter[Curriculum]" = Counter()
+    for doc in documents_at(store, range(store.index.ntotal)):
+        meta = doc.metadata
+        if grade is not None and meta.get("grade") != grade:
+            continue
+        if subject is not None and meta.get("subject") != subject:
+            continue
+        counts[(meta.get("grade"), meta.get("subject"), meta.get("chapter"))] += 1
+    return counts
+
+
+def _main(argv: Optional[List[str]] = None) -> None:
+    from config import settings
+    from rag.embeddings import get_embeddings
+    from rag.segments import compact, read_manifest
+
+    parser = argparse.ArgumentParser(prog="python -m rag.docstore")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Rewrite pickled stores with a SQLite docstore.")
+    migrate.add_argument(
+        "paths",
+        nargs="*",
+        default=[settings.faiss_index_path, settings.faiss_feedback_path, settings.faiss_pedagogy_path],
+    )
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        manifest = read_manifest(path)
+        names = ([manifest["base"]] if manifest and manifest["base"] else []) + (
+            manifest["segments"] if manifest else []
+        )
+        if all(has_docstore(os.path.join(path, name)) for name in names):
+            print(f"{path}: nothing to migrate")
+            continue
+        # Compaction writes the new base (with every segment folded in) as SQLite.
+        compact(path, get_embeddings(), min_segments=0)
+        print(f"{path}: migrated to {read_manifest(path)['base']}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,121 @@
+"""Process-wide embedding model registry shared by every FAISS index."""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+from config import settings
+from rag.metrics import stage
+
+_models: Dict[str, HuggingFaceEmbeddings] = {}
+_lock = threading.Lock()
+
+
+def get_embeddings(model_name: str = "") -> HuggingFaceEmbeddings:
+    """
+    Return the shared local sentence-transformers embeddings (no API quota used).
+
+    The model is constructed once per process and the same instance is handed
+    to every caller — ingestion, retrieval and the pedagogy store all share it.
+
+    Args:
+        model_name: Sentence-transformers model name; defaults to
+            ``settings.embedding_model``.
+
+    Returns:
+        The cached HuggingFaceEmbeddings instance for that model.
+    """
+    name = model_name or settings.embedding_model
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        # Re-check under the lock so concurrent first calls build only one copy.
+        model = _models.get(name)
+        if model is None:
+            with stage("embedding_model_load"):
+                model = HuggingFaceEmbeddings(model_name=name)
+            _models[name] = model
+    return model
+
+
+def normalize_query(text: str) -> str:
+    """Collapse whitespace and case, for cache keys; the raw text is what gets embedded."""
+    return " ".join(text.lower().split())
+
+
+class QueryVectorCache:
+    """Size-bounded LRU cache of query embeddings keyed by normalized query text."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._vectors: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._vectors.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: tuple, vector: List[float]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._vectors[key] = vector
+            self._vectors.move_to_end(key)
+            while len(self._vectors) > self.max_size:
+                self._vectors.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Return current size and hit/miss counters."""
+        return {
+            "size": len(self._vectors),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+query_cache = QueryVectorCache(settings.query_cache_size)
+
+
+def embed_query(text: str) -> List[float]:
+    """
+    Embed a query string, reusing the vector for repeated (normalized) queries.
+
+    ``/adapt`` embeds its query once and passes the vector to the content,
+    feedback and pedagogy searches; templated learn-page queries also hit
+    this cache across requests. The text is embedded as given, but the cache
+    key is the normalized query, so queries differing only in case or
+    whitespace share the vector of whichever arrived first. That is exact for
+    uncased models such as the default all-MiniLM-L6-v2; with a cased model,
+    a case variant gets the vector of its first-seen casing.
+
+    Args:
+        text: The raw query string.
+
+    Returns:
+        The query embedding.
+    """
+    key = (settings.embedding_model, normalize_query(text))
+    vector = query_cache.get(key)
+    if vector is None:
+        model = get_embeddings()
+        with stage("query_embedding"):
+            vector = model.embed_query(text)
+        query_cache.put(key, vector)
+    return vector
+
+
+def warm_up() -> None:
+    """Load the default model and run one dummy embedding so weights are resident."""
+    get_embeddings().embed_query("warm-up")
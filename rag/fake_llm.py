@@ -0,0 +1,179 @@
+"""
+Offline stand-in chat model for load tests (``LLM_PROVIDER=fake``).
+
+Answers every prompt with canned output in the format its router parses —
+quiz and flashcard JSON, a concept graph, or prose for the adapt chains —
+after a fixed first-token latency, then streams it at a fixed token rate.
+No network calls are made, so endpoints can be driven at classroom scale
+without spending provider quota.
+"""
+
+import asyncio
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from rag.context import count_tokens
+
+_WORD = re.compile(r"[A-Za-z]{4,}")
+
+
+def _topic_words(prompt: str, limit: int = 40) -> List[str]:
+    """Distinct content words of the prompt, in order, to keep answers on-topic."""
+    seen: List[str] = []
+    for word in _WORD.findall(prompt):
+        lowered = word.lower()
+        if lowered not in seen:
+            seen.append(lowered)
+        if len(seen) >= limit:
+            break
+    return seen or ["topic"]
+
+
+def _prose(prompt: str, tokens: int) -> str:
+    words = _topic_words(prompt)
+    sentences: List[str] = []
+    used = 0
+    i = 0
+    while used < tokens:
+        a, b, c = (words[(i + k) % len(words)] for k in range(3))
+        sentence = f"The idea of {a} connects {b} with {c} in a simple way."
+        sentences.append(sentence)
+        used += count_tokens(sentence)
+        i += 3
+    paragraphs = [" ".join(sentences[j : j + 2]) for j in range(0, len(sentences), 2)]
+    return "\n\n".join(paragraphs)
+
+
+def _quiz(words: List[str]) -> dict:
+    return {
+        "questions": [
+            {
+                "question": f"Which statement about {words[i % len(words)]} is correct?",
+                "options": [f"{letter}. Option {letter} about {words[(i + n) % len(words)]}"
+                            for n, letter in enumerate("ABCD")],
+                "answer": "ABCD"[i % 4],
+            }
+            for i in range(5)
+        ]
+    }
+
+
+def _flashcards(words: List[str]) -> dict:
+    return {
+        "flashcards": [
+            {
+                "question": f"What is {words[i % len(words)]}?",
+                "answer": f"It is how {words[(i + 1) % len(words)]} relates to "
+                          f"{words[(i + 2) % len(words)]}.",
+            }
+            for i in range(8)
+        ]
+    }
+
+
+def _concept_graph(words: List[str]) -> dict:
+    nodes = [{"id": word, "label": word.title()} for word in words[:6]]
+    edges = [
+        {"from": nodes[i]["id"], "to": nodes[i + 1]["id"], "relation": "requires"}
+        for i in range(len(nodes) - 1)
+    ]
+    return {"nodes": nodes, "edges": edges}
+
+
+def canned_response(prompt: str, tokens: int = 300) -> str:
+    """Return output in the format ``prompt`` asks for, built from its own words."""
+    content = prompt.split("Content:", 1)[-1]
+    words = _topic_words(content)
+    if '"questions"' in prompt:
+        return json.dumps(_quiz(words))
+    if '"flashcards"' in prompt:
+        return json.dumps(_flashcards(words))
+    if '"nodes"' in prompt and '"edges"' in prompt:
+        return json.dumps(_concept_graph(words))
+    return _prose(prompt, tokens)
+
+
+def _pieces(text: str) -> List[str]:
+    """Split ``text`` into word-sized stream chunks that join back to it exactly."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model answering with ``canned_response`` at a simulated speed."""
+
+    latency_ms: float = 400.0
+    tokens_per_second: float = 250.0
+    response_tokens: int = 300
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _answer(self, messages: List[BaseMessage]) -> tuple:
+        prompt = "\n".join(str(m.content) for m in messages)
+        text = canned_response(prompt, self.response_tokens)
+        usage = {
+            "input_tokens": count_tokens(prompt),
+            "output_tokens": count_tokens(text),
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return text, usage
+
+    def _seconds(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text, usage = self._answer(messages)
+        time.sleep(self.latency_ms / 1000 + self._seconds(usage["output_tokens"]))
+        message = AIMessage(content=text, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text, usage = self._answer(messages)
+        await asyncio.sleep(self.latency_ms / 1000 + self._seconds(usage["output_tokens"]))
+        message = AIMessage(content=text, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        text, _ = self._answer(messages)
+        time.sleep(self.latency_ms / 1000)
+        for piece in _pieces(text):
+            time.sleep(self._seconds(count_tokens(piece)))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        text, _ = self._answer(messages)
+        await asyncio.sleep(self.latency_ms / 1000)
+        for piece in _pieces(text):
+            await asyncio.sleep(self._seconds(count_tokens(piece)))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
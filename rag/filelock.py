@@ -0,0 +1,59 @@
+"""Cross-process advisory file locks coordinating writers across uvicorn workers."""
+
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _acquire(fh, blocking: bool) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        if blocking:
+            raise
+        return False
+    return True
+
+
+def _release(fh) -> None:
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    """
+    Hold an exclusive lock on ``path`` (created if missing) for the ``with`` block.
+
+    Each call opens its own file handle, so the lock excludes other threads of
+    this process as well as other processes. The OS drops the lock if the
+    holder dies.
+
+    Args:
+        path: Lock file path.
+        blocking: Wait for the lock; otherwise yield False at once if it is held.
+
+    Yields:
+        True if the lock is held.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a+b") as fh:
+        acquired = _acquire(fh, blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                _release(fh)
@@ -0,0 +1,177 @@
+"""Resident, hot-reloadable FAISS indexes shared by every request in the process."""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from rag.docstore import DOCS_FILE
+from rag.embeddings import get_embeddings
+from rag.metrics import stage
+from rag.segments import MANIFEST, SegmentedIndex, read_manifest
+
+# stat() fingerprint of manifest.json, or of index.faiss + index.pkl for a
+# directory still in the single-index layout.
+Signature = Tuple[int, ...]
+
+
+@dataclass
+class _ResidentIndex:
+    """A loaded segmented store plus the bookkeeping needed to detect staleness."""
+
+    store: SegmentedIndex
+    signature: Signature
+    load_seconds: float
+    loaded_at: float
+
+
+def _signature(path: str) -> Optional[Signature]:
+    """Return the on-disk signature of a saved store, or None if nothing is saved."""
+    files = [MANIFEST]
+    if not os.path.exists(os.path.join(path, MANIFEST)):
+        files = ["index.faiss", "index.pkl"]
+    signature: Tuple[int, ...] = ()
+    for filename in files:
+        try:
+            st = os.stat(os.path.join(path, filename))
+        except FileNotFoundError:
+            return None
+        signature += (st.st_ino, st.st_mtime_ns, st.st_size)
+    return signature
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+class IndexManager:
+    """
+    Keep the content, feedback and pedagogy stores resident in memory.
+
+    Every ``get`` compares the store's manifest on disk against the signature
+    of the resident copy. When a writer (this process or another worker) has
+    appended a segment or compacted the store, the new view is built off to
+    the side — reusing every segment already in memory and reading only the
+    new ones — and swapped in with a single assignment, so concurrent readers
+    keep searching the old view until the new one is complete. A view that
+    fails to load is ignored until the next call.
+    """
+
+    def __init__(self, paths: Dict[str, str]) -> None:
+        self._paths = dict(paths)
+        self._entries: Dict[str, _ResidentIndex] = {}
+        self._locks = {name: threading.Lock() for name in self._paths}
+
+    def path(self, name: str) -> str:
+        """Return the on-disk directory of a registered index."""
+        return self._paths[name]
+
+    def get(self, name: str) -> Optional[SegmentedIndex]:
+        """
+        Return the resident store for ``name``, reloading it if the disk copy changed.
+
+        Args:
+            name: Registered index name ("content", "feedback" or "pedagogy").
+
+        Returns:
+            The segmented store, or None if the index has never been saved.
+        """
+        path = self._paths[name]
+        signature = _signature(path)
+        if signature is None:
+            self._entries.pop(name, None)
+            return None
+        entry = self._entries.get(name)
+        if entry is not None and entry.signature == signature:
+            return entry.store
+
+        with self._locks[name]:
+            entry = self._entries.get(name)
+            if entry is not None and entry.signature == signature:
+                return entry.store
+            started = time.perf_counter()
+            try:
+                embeddings = get_embeddings()
+                with stage("index_load"):
+                    store = SegmentedIndex.load(
+                        path,
+                        read_manifest(path),
+                        embeddings,
+                        previous=entry.store if entry is not None else None,
+                    )
+            except Exception:  # noqa: BLE001
+                # Most likely a directory removed by a concurrent compaction;
+                # keep serving the previous view.
+                return entry.store if entry is not None else None
+            self._entries[name] = _ResidentIndex(
+                store=store,
+                signature=signature,
+                load_seconds=time.perf_counter() - started,
+                loaded_at=time.time(),
+            )
+        return store
+
+    def stats(self) -> List[dict]:
+        """
+        Return load time, vector count and approximate memory footprint per index.
+
+        ``mapped_bytes`` is memory-mapped (vector codes and SQLite docstores)
+        and shared between worker processes through the page cache;
+        ``memory_bytes`` is private to this process (pickled docstores of
+        directories saved before the mapped layout, and partition maps).
+        """
+        report = []
+        for name, path in self._paths.items():
+            entry = self._entries.get(name)
+            if entry is None:
+                report.append({"name": name, "path": path, "loaded": False})
+                continue
+            memory_bytes = mapped_bytes = 0
+            for part in entry.store.parts:
+                directory = os.path.join(path, part.name)
+                index = part.store.index
+                try:
+                    # Flat and IVF indexes hold one code per vector.
+                    mapped_bytes += index.ntotal * index.sa_code_size()
+                except RuntimeError:
+                    mapped_bytes += os.path.getsize(os.path.join(directory, "index.faiss"))
+                if os.path.exists(os.path.join(directory, DOCS_FILE)):
+                    mapped_bytes += os.path.getsize(os.path.join(directory, DOCS_FILE))
+                # A pickled docstore is approximated by its size on disk.
+                pkl_path = os.path.join(directory, "index.pkl")
+                if os.path.exists(pkl_path):
+                    memory_bytes += os.path.getsize(pkl_path)
+                memory_bytes += sum(
+                    ids.nbytes for values in part.partitions.values() for ids in values.values()
+                )
+            report.append(
+                {
+                    "name": name,
+                    "path": path,
+                    "loaded": True,
+                    "generation": entry.store.generation,
+                    "segments": len(entry.store.parts),
+                    "vectors": entry.store.ntotal,
+                    "dimension": entry.store.dimension,
+                    "memory_bytes": memory_bytes,
+                    "mapped_bytes": mapped_bytes,
+                    "disk_bytes": _dir_bytes(path),
+                    "load_seconds": round(entry.load_seconds, 4),
+                    "loaded_at": entry.loaded_at,
+                }
+            )
+        return report
+
+
+index_manager = IndexManager(
+    {
+        "content": settings.faiss_index_path,
+        "feedback": settings.faiss_feedback_path,
+        "pedagogy": settings.faiss_pedagogy_path,
+    }
+)
@@ -0,0 +1,246 @@
+"""
+Configurable FAISS index types for the content store, plus migration and tuning tools.
+
+Delta segments are always small flat indexes; the configured type applies to
+the compacted base. Usage::
+
+    python -m rag.index_types migrate [--type ivf_pq] [--path ./faiss_store]
+    python -m rag.index_types report [--queries 200] [--k 10]
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from config import settings
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def index_type_of(index: faiss.Index) -> str:
+    """Return the ``INDEX_TYPES`` name of a FAISS index."""
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return "hnsw"
+    return "flat"
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    """Largest divisor of ``dimension`` not above ``settings.index_pq_m``."""
+    return next(m for m in range(min(settings.index_pq_m, dimension), 0, -1) if dimension % m == 0)
+
+
+def build_index(vectors: np.ndarray, index_type: str) -> faiss.Index:
+    """
+    Train an index of ``index_type`` on ``vectors`` and add them.
+
+    Corpora smaller than ``settings.index_min_train_vectors`` get a flat
+    index: clustering needs enough points per list, and exact search is
+    cheap at that size anyway.
+
+    Raises:
+        ValueError: Unknown index type.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+    count, dimension = vectors.shape
+    if index_type != "flat" and count < max(1, settings.index_min_train_vectors):
+        index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, settings.index_hnsw_m)
+        index.hnsw.efConstruction = settings.index_ef_construction
+    else:
+        # FAISS wants roughly 39+ training points per inverted list.
+        nlist = max(1, min(settings.index_nlist, count // 39))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer, dimension, nlist, _pq_subquantizers(dimension), settings.index_pq_bits
+            )
+        index.train(vectors)
+    index.add(vectors)
+    configure(index)
+    return index
+
+
+def configure(index: faiss.Index) -> faiss.Index:
+    """
+    Apply the search-time tunables (nprobe, efSearch) to a loaded index.
+
+    IVF indexes also get a direct map so partitioned search can reconstruct
+    individual vectors.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = settings.index_nprobe
+        if index.direct_map.type == faiss.DirectMap.NoMap:
+            index.make_direct_map()
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = settings.index_ef_search
+    return index
+
+
+def search_parameters(
+    index: faiss.Index, selector: Optional[faiss.IDSelector] = None
+) -> faiss.SearchParameters:
+    """Return search parameters of the right subclass for ``index``."""
+    if isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(nprobe=settings.index_nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(efSearch=settings.index_ef_search)
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def vectors_of(store: FAISS) -> np.ndarray:
+    """Return every vector of ``store`` in position order (decoded, so approximate, for PQ)."""
+    configure(store.index)
+    return store.index.reconstruct_n(0, store.index.ntotal)
+
+
+def merge_stores(
+    stores: Sequence[FAISS], index_type: Optional[str] = None, retrain: bool = False
+) -> FAISS:
+    """
+    Merge ``stores`` into one store whose index is of ``index_type``.
+
+    ``index_type`` defaults to the type of the first store's index.
+
+    If the first store already has that type (and ``retrain`` is False) the
+    others are added to its trained index; otherwise a new index is trained
+    over all vectors, which is how a flat store is converted.
+    """
+    first = stores[0]
+    index_type = index_type or index_type_of(first.index)
+    counts = [store.index.ntotal for store in stores]
+    if not retrain and index_type_of(first.index) == index_type:
+        index = first.index
+        for store in stores[1:]:
+            index.add(vectors_of(store))
+    else:
+        index = build_index(np.vstack([vectors_of(store) for store in stores]), index_type)
+
+    docs: Dict[str, object] = {}
+    index_to_docstore_id: Dict[int, str] = {}
+    for store, count in zip(stores, counts):
+        for position in range(count):
+            key = store.index_to_docstore_id[position]
+            doc = store.docstore.search(key)
+            # SQLite docstores are addressed by position; the real id is on the Document.
+            doc_id = doc.id or str(key)
+            index_to_docstore_id[len(index_to_docstore_id)] = doc_id
+            docs[doc_id] = doc
+    return FAISS(
+        embedding_function=first.embedding_function,
+        index=index,
+        docstore=InMemoryDocstore(docs),
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+def _memory_bytes(index: faiss.Index) -> int:
+    return faiss.serialize_index(index).size
+
+
+def recall_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    index_types: Sequence[str] = INDEX_TYPES,
+    sweep: Sequence[int] = (1, 4, 16, 64, 256),
+) -> List[dict]:
+    """
+    Compare each index type against exact search on the same vectors.
+
+    Every approximate type is built once and searched with each ``sweep``
+    value as nprobe (IVF) or efSearch (HNSW).
+
+    Returns:
+        One row per index type and setting: recall@k against the flat index,
+        mean query latency in milliseconds and serialized index size in bytes.
+    """
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for index_type in index_types:
+        index = exact if index_type == "flat" else build_index(vectors, index_type)
+        if index_type_of(index) != index_type:
+            continue  # too few vectors to train this type
+        settings_to_try: Sequence[Optional[int]] = [None] if index_type == "flat" else sweep
+        for value in settings_to_try:
+            params = search_parameters(index)
+            if isinstance(params, faiss.SearchParametersIVF):
+                params.nprobe = value
+            elif isinstance(params, faiss.SearchParametersHNSW):
+                params.efSearch = value
+            started = time.perf_counter()
+            _, found = index.search(queries, k, params=params)
+            elapsed = time.perf_counter() - started
+            hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+            row = {"index_type": index_type}
+            if value is not None:
+                row["nprobe" if index_type.startswith("ivf") else "ef_search"] = value
+            row.update(
+                recall_at_k=round(hits / truth.size, 4),
+                latency_ms=round(1000 * elapsed / len(queries), 4),
+                memory_bytes=_memory_bytes(index),
+            )
+            rows.append(row)
+    return rows
+
+
+def _main(argv: Optional[List[str]] = None) -> None:
+    from rag.embeddings import get_embeddings
+    from rag.segments import SegmentedIndex, compact, read_manifest
+
+    parser = argparse.ArgumentParser(prog="python -m rag.index_types")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Rebuild the store's base with a new index type.")
+    migrate.add_argument("--path", default=settings.faiss_index_path)
+    migrate.add_argument("--type", choices=INDEX_TYPES, default=settings.content_index_type)
+    report = sub.add_parser("report", help="Recall@k and latency of each index type.")
+    report.add_argument("--path", default=settings.faiss_index_path)
+    report.add_argument("--queries", type=int, default=200)
+    report.add_argument("--k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    embeddings = get_embeddings()
+    if args.command == "migrate":
+        if not compact(args.path, embeddings, min_segments=0, index_type=args.type, retrain=True):
+            parser.error(f"No index found at {args.path}")
+        print(f"Rebuilt {args.path} as {args.type}: {read_manifest(args.path)}")
+        return
+
+    manifest = read_manifest(args.path)
+    if manifest is None:
+        parser.error(f"No index found at {args.path}")
+    store = SegmentedIndex.load(args.path, manifest, embeddings)
+    vectors = np.vstack([vectors_of(part.store) for part in store.parts]).astype(np.float32)
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    # Perturb sampled corpus vectors so queries are near, not on, stored points.
+    noise = rng.normal(scale=vectors.std() * 0.1, size=(len(sample), vectors.shape[1]))
+    queries = (vectors[sample] + noise).astype(np.float32)
+    print(json.dumps(recall_report(vectors, queries, k=args.k), indent=2))
+
+
+if __name__ == "__main__":
+    _main()
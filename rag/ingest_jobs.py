@@ -0,0 +1,128 @@
+"""Background ingestion jobs processed by a bounded worker pool off the event loop."""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional, Tuple
+
+from config import settings
+from rag.jobs import JobStore
+
+
+@dataclass
+class IngestJob:
+    """Progress record for one queued ingestion."""
+
+    job_id: str
+    filename: str
+    status: str = "queued"  # queued | running | succeeded | failed
+    stage: str = "queued"  # queued | parsing | embedding | indexing | done
+    files_total: int = 1
+    files_parsed: int = 0
+    files_skipped: int = 0
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    chunks_indexed: int = 0
+    chunks_skipped: int = 0
+    error: Optional[str] = None
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+# A job body receives a progress callback and returns the number of chunks indexed.
+JobFunc = Callable[[Callable[..., None]], int]
+
+
+class IngestJobQueue:
+    """
+    Run ingestion jobs on a fixed-size thread pool and track their progress.
+
+    PDF parsing, splitting, embedding and the index write all block, so they
+    never run on the event loop. Finished jobs are retained (oldest dropped
+    first) so clients can poll for the outcome after completion. Every change
+    is also written to ``store``, so a poll answered by another worker
+    process sees the job too.
+    """
+
+    def __init__(
+        self, max_workers: int, max_retained: int, store: Optional[JobStore] = None
+    ) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="ingest"
+        )
+        self._max_retained = max_retained
+        self._store = store or JobStore("", "ingest", max_retained)
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self, filename: str, func: JobFunc, files_total: int = 1
+    ) -> Tuple[IngestJob, Future]:
+        """
+        Queue ``func`` for execution and return its job record and future.
+
+        Args:
+            filename: Name shown in the job record.
+            func: Blocking job body; called with a progress callback.
+            files_total: Number of PDFs the job covers.
+
+        Returns:
+            The new job and a future resolving to the number of chunks indexed.
+        """
+        job = IngestJob(
+            job_id=uuid.uuid4().hex,
+            filename=filename,
+            files_total=files_total,
+            created_at=time.time(),
+        )
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune()
+        self._store.save(job.to_dict())
+        self._store.prune()
+        future = self._executor.submit(self._run, job, func)
+        return job, future
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        """Return the job with ``job_id``, or None if unknown or pruned."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            record = self._store.load(job_id)
+            job = IngestJob(**record) if record else None
+        return job
+
+    def _run(self, job: IngestJob, func: JobFunc) -> int:
+        def progress(**updates: object) -> None:
+            with self._lock:
+                for key, value in updates.items():
+                    setattr(job, key, value)
+                record = job.to_dict()
+            self._store.save(record)
+
+        progress(status="running")
+        try:
+            indexed = func(progress)
+        except Exception as exc:  # noqa: BLE001
+            progress(status="failed", error=str(exc), finished_at=time.time())
+            raise
+        progress(status="succeeded", stage="done", chunks_indexed=indexed, finished_at=time.time())
+        return indexed
+
+    def _prune(self) -> None:
+        finished = [jid for jid, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[: max(0, len(self._jobs) - self._max_retained)]:
+            del self._jobs[job_id]
+
+
+ingest_jobs = IngestJobQueue(
+    max_workers=settings.ingest_workers,
+    max_retained=settings.ingest_jobs_retained,
+    store=JobStore(settings.job_store_path, "ingest", settings.ingest_jobs_retained),
+)
@@ -1,20 +1,89 @@
 """PDF ingestion and FAISS index building."""
 
+import multiprocessing
 import os
 import tempfile
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from config import settings
+from rag import metrics
+from rag.dedup import file_digest, ingest_registry
+from rag.embeddings import get_embeddings
+from rag.segments import append_segment, write_lock
 
+# Called with keyword updates such as stage="embedding", chunks_embedded=64.
+ProgressCallback = Callable[..., None]
 
-def _get_embeddings() -> HuggingFaceEmbeddings:
-    """Return local sentence-transformers embeddings (no API quota used)."""
-    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+
+def _noop_progress(**_: object) -> None:
+    pass
+
+
+@dataclass
+class PdfUpload:
+    """One PDF plus its curriculum metadata, as queued for (bulk) ingestion."""
+
+    file_bytes: bytes
+    filename: str
+    grade: Optional[int] = None
+    subject: Optional[str] = None
+    chapter: Optional[str] = None
+
+
+def _parse(upload: PdfUpload) -> List[Document]:
+    """Parse a PDF into one metadata-tagged document per page."""
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(upload.file_bytes)
+        tmp_path = tmp.name
+
+    try:
+        loader = PyPDFLoader(tmp_path)
+        documents = loader.load()
+    finally:
+        os.unlink(tmp_path)
+
+    for doc in documents:
+        doc.metadata["source"] = upload.filename
+        if upload.grade is not None:
+            doc.metadata["grade"] = upload.grade
+        if upload.subject:
+            doc.metadata["subject"] = upload.subject
+        if upload.chapter:
+            doc.metadata["chapter"] = upload.chapter
+    return documents
+
+
+def _split(documents: List[Document]) -> List[Document]:
+    """Split parsed pages into overlapping chunks, keeping their metadata."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.chunk_size,
+        chunk_overlap=settings.chunk_overlap,
+    )
+    return splitter.split_documents(documents)
+
+
+def _parse_and_split(upload: PdfUpload) -> Tuple[int, List[Document]]:
+    """
+    Parse a PDF and split it into metadata-tagged chunks.
+
+    Module-level (and free of shared state) so it can run in a worker process;
+    stage timings recorded there are not reported.
+
+    Returns:
+        The number of pages parsed and the resulting chunks.
+    """
+    with metrics.stage("ingest_parse"):
+        documents = _parse(upload)
+    with metrics.stage("ingest_split"):
+        chunks = _split(documents)
+    return len(documents), chunks
 
 
 def ingest_pdf(
@@ -23,12 +92,15 @@ def ingest_pdf(
     grade: Optional[int] = None,
     subject: Optional[str] = None,
     chapter: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
 ) -> int:
     """
     Ingest a PDF into the local FAISS vector store.
 
     Curriculum metadata (grade, subject, chapter) is attached to every chunk
-    so that retrieval can be filtered to a specific chapter later.
+    so that retrieval can be filtered to a specific chapter later. An exact
+    re-upload (same bytes and metadata) is skipped without parsing, and chunks
+    already in the index are dropped before embedding.
 
     Args:
         file_bytes: Raw PDF bytes.
@@ -36,48 +108,172 @@ def ingest_pdf(
         grade: NCERT grade number (1-12), optional.
         subject: Subject name (e.g. "Science"), optional.
         chapter: Chapter title for exact-match filtering, optional.
+        progress: Optional callback receiving stage and counter updates
+            (``stage``, ``pages_parsed``, ``chunks_total``, ``chunks_embedded``,
+            ``files_skipped``, ``chunks_skipped``).
 
     Returns:
         Number of chunks indexed.
     """
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-        tmp.write(file_bytes)
-        tmp_path = tmp.name
+    report = progress or _noop_progress
+
+    digest = file_digest(file_bytes, grade, subject, chapter)
+    if ingest_registry.has_file(digest):
+        report(stage="done", files_skipped=1)
+        return 0
+
+    report(stage="parsing")
+    pages, chunks = _parse_and_split(
+        PdfUpload(file_bytes, filename, grade=grade, subject=subject, chapter=chapter)
+    )
+    report(pages_parsed=pages)
+    return _index_new_chunks(chunks, {digest: filename}, report)[filename]
+
+
+def ingest_pdfs(
+    uploads: List[PdfUpload],
+    progress: Optional[ProgressCallback] = None,
+) -> Dict[str, int]:
+    """
+    Ingest many PDFs with one index write.
 
+    PDFs are parsed and split in a process pool, all chunks are embedded in
+    batches, and everything is written as a single index segment at the end
+    rather than once per file. Exact re-uploads and duplicate chunks are
+    skipped as in ``ingest_pdf``.
+
+    Args:
+        uploads: PDFs with their curriculum metadata.
+        progress: Optional callback receiving stage and counter updates
+            (``stage``, ``files_parsed``, ``pages_parsed``, ``chunks_total``,
+            ``chunks_embedded``, ``files_skipped``, ``chunks_skipped``).
+
+    Returns:
+        Number of chunks indexed per filename; 0 for skipped re-uploads.
+    """
+    report = progress or _noop_progress
+    report(stage="parsing")
+
+    counts: Dict[str, int] = {upload.filename: 0 for upload in uploads}
+    files: Dict[str, str] = {}
+    pending: List[PdfUpload] = []
+    for upload in uploads:
+        digest = file_digest(upload.file_bytes, upload.grade, upload.subject, upload.chapter)
+        if digest not in files and not ingest_registry.has_file(digest):
+            files[digest] = upload.filename
+            pending.append(upload)
+    if len(pending) < len(uploads):
+        report(files_skipped=len(uploads) - len(pending))
+    if not pending:
+        report(stage="done")
+        return counts
+    uploads = pending
+
+    chunks: List[Document] = []
+    pages = 0
+    workers = max(1, min(settings.ingest_parse_processes, len(uploads)))
+    # spawn, not fork: the parent holds the embedding model and worker threads.
+    # Parsing and splitting run in the workers, so they are timed together here.
+    with metrics.stage("ingest_bulk_parse"), ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        for done, (upload, (page_count, file_chunks)) in enumerate(
+            zip(uploads, pool.map(_parse_and_split, uploads)), start=1
+        ):
+            pages += page_count
+            chunks.extend(file_chunks)
+            report(files_parsed=done, pages_parsed=pages)
+
+    counts.update(_index_new_chunks(chunks, files, report))
+    return counts
+
+
+def _index_new_chunks(
+    chunks: List[Document], files: Dict[str, str], report: ProgressCallback
+) -> Dict[str, int]:
+    """
+    Drop chunks already in the index, index the rest and register their hashes.
+
+    Args:
+        chunks: Parsed chunks of the uploads in ``files``.
+        files: File digest -> filename of every upload the chunks came from.
+        report: Progress callback.
+
+    Returns:
+        Number of chunks indexed per filename.
+    """
+    with metrics.stage("ingest_dedup"):
+        fresh, digests = ingest_registry.reserve(chunks)
+    report(stage="embedding", chunks_total=len(fresh), chunks_skipped=len(chunks) - len(fresh))
     try:
-        loader = PyPDFLoader(tmp_path)
-        documents = loader.load()
+        indexed = _index_chunks(fresh, digests, report)
+    except Exception:
+        ingest_registry.release(digests)
+        raise
+    if len(indexed) < len(fresh):
+        report(chunks_skipped=len(chunks) - len(indexed))
+    report(stage="done")
+
+    per_file = {filename: 0 for filename in files.values()}
+    for chunk in indexed:
+        per_file[chunk.metadata["source"]] += 1
+    ingest_registry.commit(
+        digests,
+        {digest: {"filename": name, "chunks": per_file[name]} for digest, name in files.items()},
+    )
+    return per_file
+
 
-        for doc in documents:
-            doc.metadata["source"] = filename
-            if grade is not None:
-                doc.metadata["grade"] = grade
-            if subject:
-                doc.metadata["subject"] = subject
-            if chapter:
-                doc.metadata["chapter"] = chapter
-
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap,
-        )
-        chunks = splitter.split_documents(documents)
-
-        embeddings = _get_embeddings()
-        index_path = settings.faiss_index_path
-
-        if os.path.exists(index_path):
-            existing = FAISS.load_local(
-                index_path,
-                embeddings,
-                allow_dangerous_deserialization=True,
+def _index_chunks(
+    chunks: List[Document], digests: List[str], report: ProgressCallback
+) -> List[Document]:
+    """
+    Embed chunks in batches and append them to the content index.
+
+    Another worker process may have indexed the same content while this one
+    embedded it, so chunks it has committed are dropped under the index write
+    lock, and the digests are committed before the lock is released.
+
+    Returns:
+        The chunks actually appended.
+    """
+    if not chunks:
+        return []
+    with metrics.stage("ingest_embed"):
+        vectors = _embed_in_batches([chunk.page_content for chunk in chunks], report)
+
+    report(stage="indexing")
+    with metrics.stage("ingest_index_write"), write_lock(settings.faiss_index_path):
+        committed = ingest_registry.committed(digests)
+        rows = [
+            (chunk, vector)
+            for chunk, vector, digest in zip(chunks, vectors, digests)
+            if digest not in committed
+        ]
+        if rows:
+            _add_to_content_index(
+                [chunk.page_content for chunk, _ in rows],
+                [vector for _, vector in rows],
+                [chunk.metadata for chunk, _ in rows],
             )
-            existing.add_documents(chunks)
-            existing.save_local(index_path)
-        else:
-            new_index = FAISS.from_documents(chunks, embeddings)
-            new_index.save_local(index_path)
+        ingest_registry.commit(digests)
+    return [chunk for chunk, _ in rows]
 
-        return len(chunks)
-    finally:
-        os.unlink(tmp_path)
+
+def _embed_in_batches(texts: List[str], report: ProgressCallback) -> List[List[float]]:
+    """Embed chunk texts in batches of ``settings.embedding_batch_size``, reporting progress."""
+    embeddings = get_embeddings()
+    batch_size = max(1, settings.embedding_batch_size)
+    vectors: List[List[float]] = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+        report(chunks_embedded=len(vectors))
+    return vectors
+
+
+def _add_to_content_index(
+    texts: List[str], vectors: List[List[float]], metadatas: List[dict]
+) -> None:
+    """Write pre-embedded chunks as a new delta segment; the caller holds ``write_lock``."""
+    segment = FAISS.from_embeddings(zip(texts, vectors), get_embeddings(), metadatas=metadatas)
+    append_segment(settings.faiss_index_path, segment, hold_lock=False)
@@ -0,0 +1,86 @@
+"""Background job records shared by every worker process, one JSON file per job."""
+
+import json
+import os
+import re
+import uuid
+from contextlib import nullcontext
+from typing import ContextManager, Iterator, List, Optional
+
+from rag.filelock import file_lock
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class JobStore:
+    """
+    Progress records of background jobs, readable from any worker process.
+
+    A job runs in the worker that accepted it, but with ``uvicorn --workers N``
+    its status poll may land on another one. Each record is written to
+    ``<root>/<kind>/<job_id>.json`` (replaced atomically) whenever it changes,
+    and finished records beyond ``max_retained`` are deleted, oldest first.
+    With an empty ``root`` nothing is written and callers keep jobs in memory.
+    """
+
+    def __init__(self, root: str, kind: str, max_retained: int) -> None:
+        self.path = os.path.join(root, kind) if root else ""
+        self.max_retained = max_retained
+
+    def save(self, record: dict) -> None:
+        """Write ``record`` (a job's fields, including ``job_id``) over its previous version."""
+        if not self.path:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        target = os.path.join(self.path, f"{record['job_id']}.json")
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(record, fh, ensure_ascii=False)
+        os.replace(tmp_path, target)
+
+    def load(self, job_id: str) -> Optional[dict]:
+        """Return the record of ``job_id``, or None if unknown or pruned."""
+        if not self.path or not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(os.path.join(self.path, f"{job_id}.json"), encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def records(self) -> List[dict]:
+        """Return every stored record, oldest first."""
+        rows = [self.load(job_id) for job_id in self._job_ids()]
+        return sorted((row for row in rows if row), key=lambda row: row.get("created_at", 0))
+
+    def prune(self) -> None:
+        """Delete the oldest finished records beyond ``max_retained``."""
+        rows = self.records()
+        finished = [row for row in rows if row.get("finished_at") is not None]
+        for row in finished[: max(0, len(rows) - self.max_retained)]:
+            try:
+                os.remove(os.path.join(self.path, f"{row['job_id']}.json"))
+            except FileNotFoundError:
+                pass  # pruned by another worker
+
+    def claim(self, name: str) -> ContextManager[bool]:
+        """
+        Try to take the exclusive lock ``name`` without waiting.
+
+        Held for the ``with`` block by this process only; the OS releases it if
+        the holder dies, so a crashed job never blocks the next one. Always
+        succeeds when records are not shared.
+        """
+        if not self.path:
+            return nullcontext(True)
+        return file_lock(os.path.join(self.path, f"{name}.lock"), blocking=False)
+
+    def _job_ids(self) -> Iterator[str]:
+        try:
+            names = os.listdir(self.path) if self.path else []
+        except FileNotFoundError:
+            return
+        for name in names:
+            job_id, ext = os.path.splitext(name)
+            if ext == ".json" and _JOB_ID.fullmatch(job_id):
+                yield job_id
@@ -0,0 +1,117 @@
+"""BM25 keyword search over segment inverted indexes, and reciprocal rank fusion."""
+
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# BM25 term-frequency saturation and document-length normalisation.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the to was were "
+    "what which who why how with this these those do does".split()
+)
+
+# (position, term, term frequency, document length)
+Posting = Tuple[int, str, int, int]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens without common English stopwords."""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class MemoryLexicon:
+    """
+    In-memory inverted index over a list of documents, addressed by position.
+
+    Used for segments saved without an on-disk inverted index; SQLite
+    docstores answer the same three calls from their ``postings`` table.
+    """
+
+    def __init__(self, documents: Iterable[Document]) -> None:
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._lengths: List[int] = []
+        self._metadata: List[dict] = []
+        for position, doc in enumerate(documents):
+            terms = tokenize(doc.page_content)
+            for term, tf in Counter(terms).items():
+                self._postings[term].append((position, tf))
+            self._lengths.append(len(terms))
+            self._metadata.append(doc.metadata)
+
+    def lexicon_stats(self) -> Tuple[int, int]:
+        """Return the number of documents and their total length in tokens."""
+        return len(self._lengths), sum(self._lengths)
+
+    def document_frequencies(self, terms: Sequence[str]) -> Dict[str, int]:
+        return {term: len(self._postings.get(term, ())) for term in terms}
+
+    def postings(self, terms: Sequence[str], filter: Optional[dict] = None) -> List[Posting]:
+        return [
+            (position, term, tf, self._lengths[position])
+            for term in terms
+            for position, tf in self._postings.get(term, ())
+            if not filter or all(self._metadata[position].get(k) == v for k, v in filter.items())
+        ]
+
+
+def bm25_scores(
+    lexicons: Sequence[object], query: str, filter: Optional[dict] = None
+) -> List[Dict[int, float]]:
+    """
+    Score every document matching a query term with BM25.
+
+    Collection statistics (document count, average length, document
+    frequencies) are summed over all ``lexicons`` so scores are comparable
+    across segments.
+
+    Returns:
+        Per lexicon, a mapping of position -> score.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or not lexicons:
+        return [{} for _ in lexicons]
+    count = total = 0
+    frequencies: Counter = Counter()
+    for lexicon in lexicons:
+        n, length = lexicon.lexicon_stats()
+        count, total = count + n, total + length
+        frequencies.update(lexicon.document_frequencies(terms))
+    if not count:
+        return [{} for _ in lexicons]
+    average = total / count
+    idf = {
+        term: math.log(1 + (count - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+        for term in terms
+    }
+
+    results = []
+    for lexicon in lexicons:
+        scores: Dict[int, float] = defaultdict(float)
+        for position, term, tf, length in lexicon.postings(terms, filter):
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+            scores[position] += idf[term] * tf * (BM25_K1 + 1) / norm
+        results.append(scores)
+    return results
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]], k: int = 60
+) -> List[Hashable]:
+    """
+    Merge ranked lists by reciprocal rank fusion: score(d) = sum(1 / (k + rank)).
+
+    Returns:
+        Every key that appears in any ranking, best first.
+    """
+    scores: Dict[Hashable, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] += 1.0 / (k + rank)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
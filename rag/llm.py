@@ -0,0 +1,99 @@
+"""Process-wide registry of chat models sharing pooled keep-alive HTTP clients."""
+
+import threading
+from typing import Dict, Tuple
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_groq import ChatGroq
+
+from config import settings
+
+_llms: Dict[Tuple[str, float], BaseChatModel] = {}
+_clients: Dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.llm_pool_size,
+        max_keepalive_connections=settings.llm_pool_size,
+        keepalive_expiry=settings.llm_keepalive_seconds,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.llm_timeout_seconds, connect=settings.llm_connect_timeout_seconds)
+
+
+def _http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Return the shared sync and async HTTP clients, creating them on first use."""
+    if not _clients:
+        _clients["sync"] = httpx.Client(limits=_limits(), timeout=_timeout())
+        _clients["async"] = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+    return _clients["sync"], _clients["async"]
+
+
+def _build(model: str, temperature: float) -> BaseChatModel:
+    """Create the chat model of ``settings.llm_provider``. Caller holds the lock."""
+    if settings.llm_provider == "fake":
+        from rag.fake_llm import FakeChatModel
+
+        return FakeChatModel(
+            latency_ms=settings.fake_llm_latency_ms,
+            tokens_per_second=settings.fake_llm_tokens_per_second,
+            response_tokens=settings.fake_llm_response_tokens,
+        )
+    if settings.llm_provider != "groq":
+        raise ValueError(f"Unknown LLM_PROVIDER {settings.llm_provider!r}; use 'groq' or 'fake'.")
+    http_client, http_async_client = _http_clients()
+    return ChatGroq(
+        model=model,
+        api_key=settings.groq_api_key,
+        temperature=temperature,
+        # Retries are paced by rag.scheduler, not the client.
+        max_retries=0,
+        timeout=settings.llm_timeout_seconds,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+
+def get_llm(temperature: float, model: str = "") -> BaseChatModel:
+    """
+    Return the shared chat model for ``model`` at ``temperature``.
+
+    One instance is built per (model, temperature) and every instance sends
+    its requests through the same pooled HTTP clients, so chain calls reuse
+    open TLS connections to the API instead of handshaking each time.
+
+    Args:
+        temperature: Sampling temperature.
+        model: Groq model name; defaults to ``settings.llm_model``.
+
+    Returns:
+        The cached ChatGroq instance, or a ``FakeChatModel`` when
+        ``settings.llm_provider`` is ``"fake"``.
+    """
+    key = (model or settings.llm_model, float(temperature))
+    llm = _llms.get(key)
+    if llm is not None:
+        return llm
+    with _lock:
+        # Re-check under the lock so concurrent first calls build only one copy.
+        llm = _llms.get(key)
+        if llm is None:
+            llm = _llms[key] = _build(*key)
+    return llm
+
+
+async def close_llm_clients() -> None:
+    """Close the pooled HTTP clients and forget every cached model (app shutdown)."""
+    with _lock:
+        http_client = _clients.pop("sync", None)
+        http_async_client = _clients.pop("async", None)
+        _llms.clear()
+    if http_client is not None:
+        http_client.close()
+    if http_async_client is not None:
+        await http_async_client.aclose()
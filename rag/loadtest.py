@@ -0,0 +1,333 @@
+"""
+Load generator replaying the learn-page flow with concurrent simulated students.
+
+Each student opens a chapter with its profile's chapter-opening ``/adapt``
+query, then generates a quiz from the answer, submits a score and generates
+flashcards — the requests a learn page makes — optionally followed by
+``/concept-graph``. Latency percentiles and throughput are reported per
+endpoint. Usage::
+
+    python -m rag.loadtest --students 50 --iterations 3 [--base-url http://localhost:8000]
+    python -m rag.loadtest --in-process --students 200 --json results.json
+
+``--in-process`` drives the app through ASGI in this process with the
+offline fake LLM (``LLM_PROVIDER=fake``) unless another provider is set,
+so no quota is spent. The scheduler's ``LLM_REQUESTS_PER_MINUTE`` and
+``LLM_TOKENS_PER_MINUTE`` still apply; set them to the tier being sized.
+Scores are submitted as students named ``<prefix><n>`` (default
+``loadtest-``), so they can be told apart in ``/quiz/results``; in-process
+runs write them, and any cached answers and traces, to a temporary
+directory instead of the app's own files.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+PROFILES = ("adhd", "dyslexia", "cognitive", "hearing_impairment", "visual_impairment")
+
+Chapter = Tuple[int, str, str]
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Nearest-rank ``q``-th percentile (0-100) of ``values``; None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+@dataclass
+class EndpointStats:
+    """Latencies (seconds) and failures recorded for one endpoint."""
+
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    statuses: Dict[int, int] = field(default_factory=dict)
+
+    def record(self, seconds: float, status: int) -> None:
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if 200 <= status < 300:
+            self.latencies.append(seconds)
+        else:
+            self.errors += 1
+
+    def summary(self, wall_seconds: float) -> dict:
+        ms = [1000 * s for s in self.latencies]
+
+        def rounded(value: Optional[float]) -> Optional[float]:
+            return round(value, 1) if value is not None else None
+
+        return {
+            "requests": len(self.latencies) + self.errors,
+            "errors": self.errors,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            "p50_ms": rounded(percentile(ms, 50)),
+            "p95_ms": rounded(percentile(ms, 95)),
+            "p99_ms": rounded(percentile(ms, 99)),
+            "mean_ms": rounded(sum(ms) / len(ms)) if ms else None,
+            "throughput_rps": round(len(self.latencies) / wall_seconds, 3)
+            if wall_seconds > 0
+            else 0.0,
+        }
+
+
+class LoadTest:
+    """Runs ``students`` concurrent learn-page flows against ``client``."""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        chapters: List[Chapter],
+        students: int,
+        iterations: int = 1,
+        ramp_seconds: float = 0.0,
+        think_seconds: float = 0.0,
+        concept_graph: bool = False,
+        student_prefix: str = "loadtest-",
+        seed: int = 0,
+    ) -> None:
+        self.client = client
+        self.chapters = chapters
+        self.students = students
+        self.iterations = iterations
+        self.ramp_seconds = ramp_seconds
+        self.think_seconds = think_seconds
+        self.concept_graph = concept_graph
+        self.student_prefix = student_prefix
+        self.seed = seed
+        self.stats: Dict[str, EndpointStats] = {}
+        self.flows_completed = 0
+        self.flows_failed = 0
+
+    async def _call(self, endpoint: str, body: dict) -> Optional[dict]:
+        stats = self.stats.setdefault(endpoint, EndpointStats())
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(endpoint, json=body)
+        except httpx.HTTPError:
+            stats.record(time.perf_counter() - started, 0)
+            return None
+        stats.record(time.perf_counter() - started, response.status_code)
+        return response.json() if response.is_success else None
+
+    async def _flow(self, student: int, rng: random.Random) -> bool:
+        from rag.chapter_store import chapter_query
+
+        profile = rng.choice(PROFILES)
+        grade, subject, chapter = rng.choice(self.chapters)
+        where = {"grade": grade, "subject": subject, "chapter": chapter}
+        adapted = await self._call(
+            "/adapt",
+            {
+                **where,
+                "query": chapter_query(profile, grade, subject, chapter),
+                "disability_profile": profile,
+            },
+        )
+        if adapted is None:
+            return False
+        content = (
+            adapted.get("simplified")
+            or adapted.get("visual_description")
+            or adapted.get("tts_script")
+            or ""
+        )
+        quiz = await self._call("/quiz/generate", {**where, "content": content})
+        if quiz is None:
+            return False
+        questions = quiz.get("questions", [])
+        submitted = await self._call(
+            "/quiz/submit",
+            {
+                **where,
+                "student": f"{self.student_prefix}{student}",
+                "score": rng.randint(0, len(questions)),
+                "total": len(questions),
+            },
+        )
+        cards = await self._call("/flashcard/generate", {**where, "content": content})
+        graph = (
+            await self._call("/concept-graph", {"content": content})
+            if self.concept_graph
+            else {}
+        )
+        return None not in (submitted, cards, graph)
+
+    async def _student(self, student: int) -> None:
+        rng = random.Random(self.seed * 100003 + student)
+        if self.students > 1:
+            await asyncio.sleep(self.ramp_seconds * student / (self.students - 1))
+        for iteration in range(self.iterations):
+            if iteration and self.think_seconds:
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * self.think_seconds)
+            if await self._flow(student, rng):
+                self.flows_completed += 1
+            else:
+                self.flows_failed += 1
+
+    async def run(self) -> dict:
+        """Run every student to completion and return the report."""
+        started = time.perf_counter()
+        await asyncio.gather(*(self._student(n) for n in range(self.students)))
+        wall = time.perf_counter() - started
+        return {
+            "students": self.students,
+            "iterations": self.iterations,
+            "wall_seconds": round(wall, 3),
+            "flows_completed": self.flows_completed,
+            "flows_failed": self.flows_failed,
+            "flows_per_second": round(self.flows_completed / wall, 3) if wall > 0 else 0.0,
+            "endpoints": {
+                endpoint: stats.summary(wall) for endpoint, stats in sorted(self.stats.items())
+            },
+        }
+
+
+def format_report(report: dict) -> str:
+    """Render ``report`` as a fixed-width table."""
+
+    def cell(value: object) -> str:
+        return "-" if value is None else str(value)
+
+    header = (
+        f"{'endpoint':<20}{'reqs':>7}{'errs':>6}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}"
+    )
+    lines = [header, "-" * len(header)]
+    for endpoint, row in report["endpoints"].items():
+        lines.append(
+            f"{endpoint:<20}{row['requests']:>7}{row['errors']:>6}"
+            f"{cell(row['p50_ms']):>10}{cell(row['p95_ms']):>10}{cell(row['p99_ms']):>10}"
+            f"{row['throughput_rps']:>9}"
+        )
+    lines.append(
+        f"{report['flows_completed']} flows completed, {report['flows_failed']} failed "
+        f"in {report['wall_seconds']}s ({report['flows_per_second']} flows/s) "
+        f"with {report['students']} students"
+    )
+    return "\n".join(lines)
+
+
+def _parse_chapter(value: str) -> Chapter:
+    try:
+        grade, subject, chapter = value.split(":", 2)
+        return int(grade), subject, chapter
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected GRADE:SUBJECT:CHAPTER") from None
+
+
+async def _discover_chapters(client: httpx.AsyncClient) -> List[Chapter]:
+    response = await client.get("/ingest/chapters")
+    response.raise_for_status()
+    return [
+        (row["grade"], row["subject"], row["chapter"])
+        for row in response.json()
+        if row.get("grade") is not None and row.get("subject") and row.get("chapter")
+    ]
+
+
+def _redirect(stack: AsyncExitStack, obj: object, attr: str, value: object) -> None:
+    """Set ``obj.attr`` to ``value`` until ``stack`` closes."""
+    stack.callback(setattr, obj, attr, getattr(obj, attr))
+    setattr(obj, attr, value)
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    async with AsyncExitStack() as stack:
+        if args.in_process:
+            from config import settings
+            from main import app
+            from rag.chapter_store import chapter_store
+            from rag.response_cache import response_cache
+            from routers import quiz
+
+            # Keep simulated scores, fake answers and traces out of the app's files.
+            scratch = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+            _redirect(stack, quiz, "RESULTS_FILE", scratch / "quiz_results.json")
+            _redirect(stack, response_cache, "path", str(scratch / "response_cache.json"))
+            _redirect(stack, chapter_store, "path", str(scratch / "chapter_store.json"))
+            _redirect(stack, settings, "trace_path", str(scratch / "traces.jsonl"))
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            base_url = "http://loadtest"
+        else:
+            transport, base_url = None, args.base_url
+        client = await stack.enter_async_context(
+            httpx.AsyncClient(
+                transport=transport,
+                base_url=base_url,
+                timeout=args.timeout,
+                limits=httpx.Limits(max_connections=args.students),
+            )
+        )
+        chapters = args.chapter or await _discover_chapters(client)
+        if not chapters:
+            raise SystemExit(
+                "No chapters to load test: ingest a chapter or pass --chapter GRADE:SUBJECT:CHAPTER."
+            )
+        return await LoadTest(
+            client,
+            chapters,
+            students=args.students,
+            iterations=args.iterations,
+            ramp_seconds=args.ramp_seconds,
+            think_seconds=args.think_seconds,
+            concept_graph=args.concept_graph,
+            student_prefix=args.student_prefix,
+            seed=args.seed,
+        ).run()
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m rag.loadtest")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Drive the app in this process (fake LLM unless LLM_PROVIDER is set).",
+    )
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=1, help="Flows per student.")
+    parser.add_argument("--ramp-seconds", type=float, default=0.0)
+    parser.add_argument("--think-seconds", type=float, default=0.0)
+    parser.add_argument(
+        "--chapter",
+        type=_parse_chapter,
+        action="append",
+        help="GRADE:SUBJECT:CHAPTER (repeatable); defaults to every ingested chapter.",
+    )
+    parser.add_argument("--concept-graph", action="store_true")
+    parser.add_argument("--student-prefix", default="loadtest-")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the report to this file.")
+    return parser
+
+
+def _main(argv: Optional[List[str]] = None) -> None:
+    args = _build_parser().parse_args(argv)
+
+    if args.in_process:
+        os.environ.setdefault("LLM_PROVIDER", "fake")
+    report = asyncio.run(_run(args))
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    _main()
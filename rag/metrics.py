@@ -0,0 +1,262 @@
+"""
+Prometheus metrics for the RAG pipeline, plus per-request Server-Timing.
+
+Pipeline stages are timed with ``stage("name")`` and LLM calls with
+``record_llm``; both feed histograms served in the Prometheus text format
+by ``GET /metrics``. While a request is being handled with Server-Timing
+enabled, the same durations are also collected for its response header,
+so a slow ``/adapt`` shows in the browser's network panel where its time
+went.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from rag.tracing import span
+
+# Seconds; spans a sub-millisecond cache hit to a queued LLM call.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        header = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            return header + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic total per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of observed values per label set."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: per-bucket (non-cumulative) counts, sum, count.
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total[0])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics exposed by ``/metrics``, rendered in registration order."""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(
+    Histogram(
+        "eureka_stage_seconds",
+        "Time spent in each RAG pipeline stage (model and index loads, searches, ingestion).",
+        ("stage",),
+    )
+)
+LLM_CALL_SECONDS = registry.register(
+    Histogram(
+        "eureka_llm_call_seconds",
+        "Latency of successful LLM calls per chain, from admission to the last token.",
+        ("chain",),
+    )
+)
+LLM_QUEUE_SECONDS = registry.register(
+    Histogram(
+        "eureka_llm_queue_seconds",
+        "Time LLM calls waited in the scheduler queue before admission.",
+        ("priority",),
+    )
+)
+LLM_TOKENS = registry.register(
+    Counter(
+        "eureka_llm_tokens_total",
+        "Tokens reported by the LLM provider per chain and direction (input, output).",
+        ("chain", "direction"),
+    )
+)
+HTTP_REQUEST_SECONDS = registry.register(
+    Histogram(
+        "eureka_http_request_seconds",
+        "Latency of HTTP requests by route template and status code.",
+        ("method", "route", "status"),
+    )
+)
+
+# Durations collected for the current request's Server-Timing header, or
+# None when the header is disabled or no request is being handled.
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar(
+    "server_timing", default=None
+)
+
+
+def record_timing(name: str, seconds: float) -> None:
+    """Add a duration to the current request's Server-Timing header, if collected."""
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the ``with`` block as pipeline stage ``name``, also recorded as a trace span."""
+    started = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        record_timing(name, elapsed)
+
+
+def record_llm(chain: str, seconds: float, result: object = None) -> None:
+    """Record one LLM call's latency and, when the response reports them, its tokens."""
+    LLM_CALL_SECONDS.observe(seconds, chain=chain)
+    record_timing(f"llm_{chain}", seconds)
+    usage = getattr(result, "usage_metadata", None)
+    if isinstance(usage, dict):
+        for direction in ("input", "output"):
+            tokens = usage.get(f"{direction}_tokens")
+            if tokens:
+                LLM_TOKENS.inc(tokens, chain=chain, direction=direction)
+
+
+@contextmanager
+def collect_timings() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the stage durations recorded while handling one request."""
+    timings: List[Tuple[str, float]] = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    """
+    Format collected durations as a ``Server-Timing`` header value.
+
+    Repeated stages (e.g. two concurrent chains' queue waits) are summed,
+    with the count in the description.
+    """
+    totals: Dict[str, List[float]] = {}
+    for name, seconds in timings:
+        totals.setdefault(name, []).append(seconds)
+    entries = []
+    for name, values in totals.items():
+        entry = f"{name};dur={1000 * sum(values):.1f}"
+        if len(values) > 1:
+            entry += f';desc="x{len(values)}"'
+        entries.append(entry)
+    return ", ".join(entries)
@@ -0,0 +1,113 @@
+"""Curriculum partitions of a FAISS segment for exact chapter-scoped search."""
+
+import json
+import os
+from typing import Dict, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from rag.docstore import documents_at
+from rag.index_types import search_parameters
+
+PARTITIONS_FILE = "partitions.json"
+
+# Metadata fields that get a partition; filters on other fields fall back to
+# LangChain's post-filtering.
+PARTITION_FIELDS = ("grade", "subject", "chapter")
+
+# Partitions up to this size are scored exactly from reconstructed vectors even
+# on approximate indexes; larger ones use the index with an ID selector.
+EXACT_SCAN_LIMIT = 50_000
+
+# field -> str(value) -> sorted vector positions in the segment's FAISS index
+# (lists when built, int64 arrays once loaded)
+Partitions = Dict[str, Dict[str, Union[List[int], np.ndarray]]]
+
+
+def build_partitions(store: FAISS) -> Partitions:
+    """Group the vector positions of ``store`` by each partitioned metadata field."""
+    partitions: Partitions = {field: {} for field in PARTITION_FIELDS}
+    for position, doc_id in sorted(store.index_to_docstore_id.items()):
+        metadata = store.docstore.search(doc_id).metadata
+        for field in PARTITION_FIELDS:
+            if metadata.get(field) is not None:
+                partitions[field].setdefault(str(metadata[field]), []).append(position)
+    return partitions
+
+
+def save_partitions(directory: str, store: FAISS) -> None:
+    """Write the partition map next to a segment's ``index.faiss``."""
+    with open(os.path.join(directory, PARTITIONS_FILE), "w", encoding="utf-8") as fh:
+        json.dump(build_partitions(store), fh)
+
+
+def load_partitions(directory: str, store: FAISS) -> Partitions:
+    """
+    Read a segment's partition map, deriving it for segments written without one.
+
+    Position lists are held as int64 arrays, a fraction of the size of Python lists.
+    """
+    try:
+        with open(os.path.join(directory, PARTITIONS_FILE), encoding="utf-8") as fh:
+            partitions = json.load(fh)
+    except FileNotFoundError:
+        partitions = build_partitions(store)
+    return {
+        field: {value: np.asarray(ids, dtype=np.int64) for value, ids in values.items()}
+        for field, values in partitions.items()
+    }
+
+
+def is_partitioned(filter: Optional[dict]) -> bool:
+    """Return True if every key of ``filter`` is a partitioned field."""
+    return bool(filter) and all(key in PARTITION_FIELDS for key in filter)
+
+
+def _positions(partitions: Partitions, filter: dict) -> np.ndarray:
+    selected: Optional[np.ndarray] = None
+    for field, value in filter.items():
+        ids = np.asarray(partitions.get(field, {}).get(str(value), []), dtype=np.int64)
+        selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+        if not selected.size:
+            break
+    return selected if selected is not None else np.empty(0, dtype=np.int64)
+
+
+def partitioned_search(
+    store: FAISS,
+    partitions: Partitions,
+    embedding: List[float],
+    k: int,
+    filter: dict,
+) -> List[Tuple[Document, float]]:
+    """
+    Return the exact top-``k`` hits of ``store`` among vectors matching ``filter``.
+
+    Only the matching vectors are scored: they are reconstructed and compared
+    directly (decoded codes for PQ), or for very large partitions of an
+    approximate index searched with an ID selector. Unlike post-filtering a
+    global ``fetch_k``, this always returns ``min(k, matches)`` hits.
+
+    Scores are squared L2 distances, matching ``similarity_search_with_score``.
+    """
+    positions = _positions(partitions, filter)
+    if not positions.size:
+        return []
+
+    query = np.asarray([embedding], dtype=np.float32)
+    index = store.index
+    if isinstance(index, faiss.IndexFlat) or positions.size <= EXACT_SCAN_LIMIT:
+        vectors = index.reconstruct_batch(positions)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        found = [(int(positions[i]), float(distances[i])) for i in order]
+    else:
+        params = search_parameters(index, faiss.IDSelectorBatch(positions))
+        scores, ids = index.search(query, min(k, positions.size), params=params)
+        found = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+
+    docs = documents_at(store, [position for position, _ in found])
+    return [(doc, score) for doc, (_, score) in zip(docs, found)]
@@ -1,13 +1,16 @@
 """Pre-populated pedagogy FAISS store with teaching analogies and ELI5 explanations."""
 
 import os
-from typing import List
+from typing import List, Optional
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 
 from config import settings
+from rag.embeddings import embed_query, get_embeddings
+from rag.index_manager import index_manager
+from rag.metrics import stage
+from rag.segments import append_segment
 
 PEDAGOGY_ENTRIES: List[dict] = [
     {
@@ -104,11 +107,6 @@ PEDAGOGY_ENTRIES: List[dict] = [
 ]
 
 
-def _get_embeddings() -> HuggingFaceEmbeddings:
-    """Return local sentence-transformers embeddings (no API quota used)."""
-    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-
 def build_pedagogy_store() -> None:
     """
     Build the pedagogy FAISS store from hardcoded entries.
@@ -126,11 +124,12 @@ def build_pedagogy_store() -> None:
         )
         for entry in PEDAGOGY_ENTRIES
     ]
-    index = FAISS.from_documents(docs, _get_embeddings())
-    index.save_local(index_path)
+    append_segment(index_path, FAISS.from_documents(docs, get_embeddings()))
 
 
-def retrieve_pedagogy(query: str, k: int = 3) -> List[Document]:
+def retrieve_pedagogy(
+    query: str, k: int = 3, embedding: Optional[List[float]] = None
+) -> List[Document]:
     """
     Retrieve the most relevant teaching analogies for a given query.
 
@@ -139,17 +138,19 @@ def retrieve_pedagogy(query: str, k: int = 3) -> List[Document]:
     Args:
         query: The student question or topic phrase.
         k: Number of pedagogy chunks to retrieve.
+        embedding: Precomputed query vector; computed via ``embed_query`` if omitted.
 
     Returns:
-        List of relevant pedagogy Document objects.
+        List of relevant pedagogy Document objects, empty if the store
+        directory exists but holds no index.
     """
-    index_path = settings.faiss_pedagogy_path
-    if not os.path.exists(index_path):
+    index = index_manager.get("pedagogy")
+    if index is None:
         build_pedagogy_store()
-
-    index = FAISS.load_local(
-        index_path,
-        _get_embeddings(),
-        allow_dangerous_deserialization=True,
-    )
-    return index.similarity_search(query, k=k)
+        index = index_manager.get("pedagogy")
+    if index is None:
+        return []
+    if embedding is None:
+        embedding = embed_query(query)
+    with stage("pedagogy_search"):
+        return index.similarity_search_by_vector(embedding, k=k)
@@ -0,0 +1,194 @@
+"""Optional reranking of retrieved chunks under a hard latency budget."""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+from config import settings
+from rag.lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+RERANK_MODES = ("off", "lexical", "cross_encoder")
+
+# (query, documents) -> one relevance score per document, higher is better.
+Scorer = Callable[[str, Sequence[Document]], List[float]]
+
+
+def lexical_scores(query: str, docs: Sequence[Document]) -> List[float]:
+    """
+    Score documents by the IDF-weighted share of query terms they contain.
+
+    IDF is taken over the candidates themselves, so a term every candidate
+    shares (usually the chapter topic) counts for little and the rarer terms
+    of the question decide the order.
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return [0.0] * len(docs)
+    doc_terms = [set(tokenize(doc.page_content)) for doc in docs]
+    idf = {
+        term: math.log(1 + len(docs) / (1 + sum(term in words for words in doc_terms)))
+        for term in terms
+    }
+    total = sum(idf.values()) or 1.0
+    return [sum(idf[t] for t in terms & words) / total for words in doc_terms]
+
+
+_cross_encoders: Dict[str, object] = {}
+_cross_encoder_lock = threading.Lock()
+
+
+def _cross_encoder():
+    name = settings.rerank_model
+    with _cross_encoder_lock:
+        model = _cross_encoders.get(name)
+        if model is None:
+            from sentence_transformers import CrossEncoder
+
+            model = _cross_encoders[name] = CrossEncoder(name, device="cpu")
+    return model
+
+
+def cross_encoder_scores(query: str, docs: Sequence[Document]) -> List[float]:
+    """Score (query, chunk) pairs in one batch with the local CPU cross-encoder."""
+    scores = _cross_encoder().predict([(query, doc.page_content) for doc in docs])
+    return [float(score) for score in scores]
+
+
+_SCORERS: Dict[str, Scorer] = {
+    "lexical": lexical_scores,
+    "cross_encoder": cross_encoder_scores,
+}
+
+
+class Reranker:
+    """
+    Reorders over-fetched candidates and keeps the best ``top_k``.
+
+    Scoring runs on a worker thread and is awaited; if it has not finished
+    within ``timeout_ms`` the candidates are passed through in retrieval
+    order (still cut to ``top_k``) and the late result is discarded. While
+    a late call still holds the worker, later requests skip reranking
+    ("busy") instead of queueing behind it. Counters of chunks fetched
+    versus kept, skips and latency are reported by ``stats``.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        fetch_k: int,
+        top_k: int,
+        timeout_ms: float,
+        scorers: Optional[Dict[str, Scorer]] = None,
+    ) -> None:
+        if mode not in RERANK_MODES:
+            logger.warning(
+                "Unknown RERANK_MODE %r (expected one of %s); reranking is off", mode, RERANK_MODES
+            )
+            mode = "off"
+        self.mode = mode
+        self.fetch_k = fetch_k
+        self.top_k = top_k
+        self.timeout_ms = timeout_ms
+        self._scorers = scorers or _SCORERS
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._lock = threading.Lock()
+        # A call that overran its budget and may still hold the worker.
+        self._late: Optional[Future] = None
+        self.requests = 0
+        self.reranked = 0
+        self.timeouts = 0
+        self.busy = 0
+        self.errors = 0
+        self.chunks_fetched = 0
+        self.chunks_kept = 0
+        self._latency_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def warm_up(self) -> None:
+        """Load the cross-encoder at startup so no request pays for it in its budget."""
+        if self.mode == "cross_encoder" and self._scorers.get(self.mode) is cross_encoder_scores:
+            _cross_encoder()
+
+    async def rerank(self, query: str, docs: List[Document]) -> List[Document]:
+        """
+        Return the ``top_k`` most relevant of ``docs``, best first.
+
+        Falls back to the first ``top_k`` in retrieval order when reranking
+        is off, times out, fails or the worker is still busy with a late call.
+        """
+        if not self.enabled or len(docs) <= 1:
+            return docs[: self.top_k] if self.enabled else docs
+
+        started = time.perf_counter()
+        kept = docs[: self.top_k]
+        if self._late is not None and not self._late.done():
+            outcome = "busy"
+        else:
+            outcome = "reranked"
+            future = self._executor.submit(self._scorers[self.mode], query, docs)
+            try:
+                # Cancels the call if it has not started; a running one is left to finish.
+                scores = await asyncio.wait_for(
+                    asyncio.wrap_future(future), self.timeout_ms / 1000
+                )
+            except asyncio.TimeoutError:
+                self._late = future
+                outcome = "timeouts"
+            except Exception:  # noqa: BLE001 — a broken scorer must not fail the request
+                logger.exception("Reranking with %s failed", self.mode)
+                outcome = "errors"
+            else:
+                # sorted() is stable: equal scores keep their retrieval order.
+                order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+                kept = [docs[i] for i in order[: self.top_k]]
+        elapsed = 1000 * (time.perf_counter() - started)
+
+        with self._lock:
+            self.requests += 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.chunks_fetched += len(docs)
+            self.chunks_kept += len(kept)
+            self._latency_ms += elapsed
+        return kept
+
+    def stats(self) -> Dict[str, object]:
+        """Return configuration, outcome counters and the kept/fetched chunk ratio."""
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "fetch_k": self.fetch_k,
+                "top_k": self.top_k,
+                "timeout_ms": self.timeout_ms,
+                "requests": self.requests,
+                "reranked": self.reranked,
+                "timeouts": self.timeouts,
+                "busy": self.busy,
+                "errors": self.errors,
+                "chunks_fetched": self.chunks_fetched,
+                "chunks_kept": self.chunks_kept,
+                "kept_ratio": round(self.chunks_kept / self.chunks_fetched, 4)
+                if self.chunks_fetched
+                else None,
+                "mean_latency_ms": round(self._latency_ms / self.requests, 3)
+                if self.requests
+                else None,
+            }
+
+
+reranker = Reranker(
+    mode=settings.rerank_mode,
+    fetch_k=settings.rerank_fetch_k,
+    top_k=settings.rerank_top_k,
+    timeout_ms=settings.rerank_timeout_ms,
+)
@@ -0,0 +1,275 @@
+"""Semantic cache of adapted LLM responses, shared by every /adapt request."""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from rag.embeddings import embed_query, normalize_query
+
+# (disability_profile, grade, subject, chapter, chain)
+Scope = Tuple[Optional[str], Optional[int], Optional[str], Optional[str], str]
+
+
+@dataclass
+class CachedResponse:
+    """One chain output plus the sources and context usage it was generated from."""
+
+    text: str
+    sources: List[str] = field(default_factory=list)
+    context: Optional[dict] = None
+
+
+@dataclass
+class _Entry:
+    scope: Scope
+    query: str
+    text: str
+    sources: List[str]
+    created: float
+    vector: Optional[List[float]] = None
+    context: Optional[dict] = None
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of chain outputs keyed by curriculum scope and query.
+
+    A lookup first tries the exact normalized query within the scope. On a miss
+    it compares the query embedding against every cached query in the same
+    scope and returns the closest one whose cosine similarity reaches
+    ``similarity``; a threshold of 1.0 disables near-duplicate matching.
+    Entries are optionally mirrored to a JSON file so they survive restarts.
+    Changes are batched: the file is rewritten in a worker thread at most
+    once per ``persist_seconds``, and on ``flush()`` at shutdown.
+
+    The cache lives in each process's memory and the file is only read at
+    startup, so it is only correct with a single worker: an invalidation
+    clears the cache of the worker that handled it, and another worker keeps
+    serving its stale entries and writes them back to the file. Leave
+    ``RESPONSE_CACHE_ENABLED`` off when running ``uvicorn --workers N``.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_entries: int,
+        ttl_seconds: float,
+        similarity: float,
+        path: str = "",
+        embed: Callable[[str], List[float]] = embed_query,
+        persist_seconds: float = 2.0,
+    ) -> None:
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.path = path
+        self.persist_seconds = persist_seconds
+        self.hits = 0
+        self.misses = 0
+        self._embed = embed
+        self._entries: "OrderedDict[Tuple[Scope, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes file writes so an older snapshot never replaces a newer one.
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._persist_scheduled = False
+        if enabled and path:
+            self._load()
+
+    def lookup(self, scope: Scope, query: str) -> Optional[CachedResponse]:
+        """
+        Return a cached response for ``query`` within ``scope``, or None on a miss.
+
+        Args:
+            scope: (disability_profile, grade, subject, chapter, chain).
+            query: The raw student query.
+
+        Returns:
+            The cached text and sources, or None.
+        """
+        if not self.enabled:
+            return None
+        normalized = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get((scope, normalized))
+            candidates = [] if entry is not None else [
+                e for e in self._entries.values() if e.scope == scope
+            ]
+        if entry is None and candidates and self.similarity < 1.0:
+            entry = self._nearest(normalized, candidates)
+        with self._lock:
+            if entry is None or (entry.scope, entry.query) not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((entry.scope, entry.query))
+            self.hits += 1
+        return CachedResponse(text=entry.text, sources=list(entry.sources), context=entry.context)
+
+    def _nearest(self, query: str, candidates: List[_Entry]) -> Optional[_Entry]:
+        target = np.asarray(self._embed(query), dtype=np.float32)
+        best, best_score = None, self.similarity
+        for entry in candidates:
+            if entry.vector is None:
+                entry.vector = self._embed(entry.query)
+            vector = np.asarray(entry.vector, dtype=np.float32)
+            denom = float(np.linalg.norm(target) * np.linalg.norm(vector)) or 1.0
+            score = float(np.dot(target, vector)) / denom
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def store(
+        self,
+        scope: Scope,
+        query: str,
+        text: str,
+        sources: List[str],
+        context: Optional[dict] = None,
+    ) -> None:
+        """Cache one chain output, evicting the least recently used entries past the limit."""
+        if not self.enabled:
+            return
+        normalized = normalize_query(query)
+        with self._lock:
+            self._entries[(scope, normalized)] = _Entry(
+                scope=scope,
+                query=normalized,
+                text=text,
+                sources=list(sources),
+                created=time.time(),
+                context=context,
+            )
+            self._entries.move_to_end((scope, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._schedule_persist()
+
+    def invalidate(
+        self,
+        grade: Optional[int] = None,
+        subject: Optional[str] = None,
+        chapter: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> int:
+        """
+        Drop every entry matching all of the given fields.
+
+        Called after new content is ingested for a chapter, and after a low
+        rating for a query. Entries whose scope leaves a field unset (e.g. an
+        ``/adapt`` request with no chapter filter, which retrieves across every
+        chapter) match any value of it, so they are dropped too. With no
+        arguments the whole cache is cleared.
+
+        Returns:
+            Number of entries removed.
+        """
+        normalized = normalize_query(query) if query else None
+        with self._lock:
+            stale = [
+                key
+                for key, entry in self._entries.items()
+                if all(
+                    value is None or entry.scope[field] in (None, value)
+                    for field, value in ((1, grade), (2, subject), (3, chapter))
+                )
+                and (normalized is None or entry.query == normalized)
+            ]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            self._schedule_persist()
+        return len(stale)
+
+    def stats(self) -> Dict[str, object]:
+        """Return current size, configuration and hit/miss counters."""
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.ttl_seconds
+        for key in [k for k, e in self._entries.items() if e.created < cutoff]:
+            del self._entries[key]
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                rows = json.load(fh)
+        except (OSError, json.JSONDecodeError):
+            return
+        for row in rows:
+            entry = _Entry(**{**row, "scope": tuple(row["scope"])})
+            self._entries[(entry.scope, entry.query)] = entry
+        self._expire(time.time())
+
+    def _schedule_persist(self) -> None:
+        """
+        Mark the cache changed and arrange one write for this batch of changes.
+
+        On the event loop the write runs in a thread after ``persist_seconds``;
+        callers without a running loop (CLI tools, tests) write immediately.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            self._dirty = True
+            if self._persist_scheduled:
+                return
+            self._persist_scheduled = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        loop.call_later(
+            self.persist_seconds, lambda: loop.create_task(asyncio.to_thread(self.flush))
+        )
+
+    def flush(self) -> None:
+        """Write the cache to its file now if it changed since the last write."""
+        if not self.path:
+            return
+        with self._write_lock:
+            with self._lock:
+                self._persist_scheduled = False
+                if not self._dirty:
+                    return
+                self._dirty = False
+                rows = [{**asdict(e), "vector": None} for e in self._entries.values()]
+            # Unique per writer, so concurrent workers never move each other's file.
+            tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    json.dump(rows, fh)
+                os.replace(tmp_path, self.path)
+            except OSError as exc:
+                self._dirty = True  # retried with the next change or flush
+                print(f"[WARNING] Could not persist response cache: {exc}")
+
+
+response_cache = ResponseCache(
+    enabled=settings.response_cache_enabled,
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    similarity=settings.response_cache_similarity,
+    path=settings.response_cache_path,
+    persist_seconds=settings.response_cache_persist_seconds,
+)
@@ -1,57 +1,103 @@
 """FAISS retrieval with dual-index (content + feedback) support."""
 
-import os
 from typing import List, Optional
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 
 from config import settings
+from rag.embeddings import embed_query, get_embeddings
+from rag.index_manager import index_manager
+from rag.lexical import reciprocal_rank_fusion
+from rag.metrics import stage
+from rag.segments import SegmentedIndex, append_segment
+
+RETRIEVAL_MODES = ("vector", "hybrid")
+
+
+def _search(
+    index: SegmentedIndex,
+    query: str,
+    embedding: List[float],
+    k: int,
+    filter: Optional[dict],
+    mode: str,
+) -> List[Document]:
+    """
+    Run a vector or hybrid search against one segmented index.
 
-
-def _get_embeddings() -> HuggingFaceEmbeddings:
-    """Return local sentence-transformers embeddings (no API quota used)."""
-    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-
-def _load_index(path: str) -> Optional[FAISS]:
-    """Load a FAISS index from disk; return None if the path does not exist."""
-    if not os.path.exists(path):
-        return None
-    return FAISS.load_local(
-        path,
-        _get_embeddings(),
-        allow_dangerous_deserialization=True,
+    Hybrid mode takes ``settings.hybrid_candidates`` hits from both the vector
+    index and the BM25 keyword index and merges them by reciprocal rank
+    fusion, so exact terms ("Hooke's law") rank well without a large ``k``.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}; expected one of {RETRIEVAL_MODES}")
+    if mode == "vector":
+        return index.similarity_search_by_vector(embedding, k=k, filter=filter)
+
+    candidates = max(k, settings.hybrid_candidates)
+    vector_docs = index.similarity_search_by_vector(embedding, k=candidates, filter=filter)
+    keyword_docs = [doc for doc, _ in index.bm25_search(query, k=candidates, filter=filter)]
+    by_key = {doc.id or doc.page_content: doc for doc in keyword_docs + vector_docs}
+    fused = reciprocal_rank_fusion(
+        [
+            [doc.id or doc.page_content for doc in vector_docs],
+            [doc.id or doc.page_content for doc in keyword_docs],
+        ],
+        k=settings.rrf_k,
     )
+    return [by_key[key] for key in fused[:k]]
 
 
-def retrieve(query: str, k: int = 5, chapter: Optional[str] = None) -> List[Document]:
+def retrieve(
+    query: str,
+    k: int = 5,
+    chapter: Optional[str] = None,
+    embedding: Optional[List[float]] = None,
+    grade: Optional[int] = None,
+    subject: Optional[str] = None,
+    mode: Optional[str] = None,
+) -> List[Document]:
     """
     Search the main content FAISS index.
 
     If ``chapter`` is provided, returns only chunks tagged with that chapter.
     Does NOT fall back to unfiltered search when chapter is specified — returning
     unrelated chunks produces worse output than letting the LLM use its own knowledge.
+    Curriculum filters are answered exactly from the index partitions, so a
+    chapter always yields its own top-``k`` chunks however large the corpus.
 
     Args:
         query: The search query string.
         k: Maximum number of results to return.
         chapter: Optional chapter title to filter results.
+        embedding: Precomputed query vector; computed via ``embed_query`` if omitted.
+        grade: Optional grade to filter results.
+        subject: Optional subject to filter results.
+        mode: "vector" or "hybrid" (vector + BM25 with rank fusion);
+            defaults to ``settings.retrieval_mode``.
 
     Returns:
         List of relevant Document objects, empty if index does not exist or no
         matching chunks found for the given chapter filter.
     """
-    index = _load_index(settings.faiss_index_path)
+    index = index_manager.get("content")
     if index is None:
         return []
-    if chapter:
-        # Only return chunks that actually belong to this chapter.
-        # If none are found (PDF not ingested), return [] so the caller can
-        # fall back to LLM parametric knowledge instead of wrong content.
-        return index.similarity_search(query, k=k, filter={"chapter": chapter})
-    return index.similarity_search(query, k=k)
+    if embedding is None:
+        embedding = embed_query(query)
+    filter = {
+        field: value
+        for field, value in (("grade", grade), ("subject", subject), ("chapter", chapter))
+        if value
+    }
+    # With a filter, only chunks that actually belong to this chapter are
+    # returned. If none are found (PDF not ingested), return [] so the caller
+    # can fall back to LLM parametric knowledge instead of wrong content.
+    with stage("content_search"):
+        return _search(
+            index, query, embedding, k, filter or None, mode or settings.retrieval_mode
+        )
 
 
 def upsert_feedback(query: str, adapted_content: str) -> None:
@@ -62,51 +108,54 @@ def upsert_feedback(query: str, adapted_content: str) -> None:
         query: The original student query.
         adapted_content: The adapted response that received a low rating.
     """
-    embeddings = _get_embeddings()
-    doc = Document(
-        page_content=f"Query: {query}\nAdapted Content: {adapted_content}",
-        metadata={"type": "feedback"},
+    text = f"Query: {query}\nAdapted Content: {adapted_content}"
+    embeddings = get_embeddings()
+    segment = FAISS.from_embeddings(
+        [(text, embeddings.embed_documents([text])[0])],
+        embeddings,
+        metadatas=[{"type": "feedback"}],
     )
-    index_path = settings.faiss_feedback_path
-
-    if os.path.exists(index_path):
-        existing = FAISS.load_local(
-            index_path,
-            embeddings,
-            allow_dangerous_deserialization=True,
-        )
-        existing.add_documents([doc])
-        existing.save_local(index_path)
-    else:
-        new_index = FAISS.from_documents([doc], embeddings)
-        new_index.save_local(index_path)
+    append_segment(settings.faiss_feedback_path, segment)
 
 
 def retrieve_with_feedback(
-    query: str, k: int = 5, chapter: Optional[str] = None
+    query: str,
+    k: int = 5,
+    chapter: Optional[str] = None,
+    embedding: Optional[List[float]] = None,
+    mode: Optional[str] = None,
 ) -> List[Document]:
     """
     Search both the content index and the feedback index, then merge results.
 
     Deduplicates by page_content so the LLM never receives duplicate chunks.
-    Passes the chapter filter to the content index search.
+    Passes the chapter filter to the content index search. The query is
+    embedded once and the same vector is used for both searches.
 
     Args:
         query: The search query string.
         k: Number of results requested from each index.
         chapter: Optional chapter title to filter content index results.
+        embedding: Precomputed query vector; computed via ``embed_query`` if omitted.
+        mode: "vector" or "hybrid", applied to both indexes; defaults to
+            ``settings.retrieval_mode``.
 
     Returns:
         Deduplicated list of relevant Document objects.
     """
-    content_docs = retrieve(query, k=k, chapter=chapter)
+    content_index = index_manager.get("content")
+    feedback_index = index_manager.get("feedback")
+    if content_index is None and feedback_index is None:
+        return []
+    if embedding is None:
+        embedding = embed_query(query)
 
-    feedback_index = _load_index(settings.faiss_feedback_path)
-    feedback_docs = (
-        feedback_index.similarity_search(query, k=k)
-        if feedback_index is not None
-        else []
-    )
+    mode = mode or settings.retrieval_mode
+    content_docs = retrieve(query, k=k, chapter=chapter, embedding=embedding, mode=mode)
+    feedback_docs: List[Document] = []
+    if feedback_index is not None:
+        with stage("feedback_search"):
+            feedback_docs = _search(feedback_index, query, embedding, k, None, mode)
 
     seen: set = set()
     merged: List[Document] = []
@@ -116,3 +165,30 @@ def retrieve_with_feedback(
             merged.append(doc)
 
     return merged
+
+
+def list_chapters(grade: Optional[int] = None, subject: Optional[str] = None) -> List[dict]:
+    """
+    List the chapters ingested into the content index with their chunk counts.
+
+    Answered from the docstore's curriculum columns without loading any chunk text.
+
+    Args:
+        grade: Optional grade to restrict the listing to.
+        subject: Optional subject to restrict the listing to.
+
+    Returns:
+        ``{"grade", "subject", "chapter", "chunks"}`` dicts sorted by grade,
+        subject and chapter; chunks ingested without a chapter are omitted.
+    """
+    index = index_manager.get("content")
+    if index is None:
+        return []
+    counts = index.curriculum(grade=grade, subject=subject)
+    return [
+        {"grade": g, "subject": s, "chapter": c, "chunks": n}
+        for (g, s, c), n in sorted(
+            counts.items(), key=lambda item: (item[0][0] or 0, item[0][1] or "", item[0][2] or "")
+        )
+        if c is not None
+    ]
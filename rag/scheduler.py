@@ -0,0 +1,398 @@
+"""
+In-process LLM scheduler: rate-limit buckets, priority admission and retries.
+
+Every router submits its LLM calls here instead of calling the model
+directly, so a classroom burst is queued under the provider's quota rather
+than answered with 429s. Interactive calls are admitted ahead of bulk ones.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import groq
+import httpx
+
+from config import settings
+from rag.context import count_tokens
+from rag.metrics import LLM_QUEUE_SECONDS, record_llm, record_timing
+from rag.tracing import record_span, span
+
+T = TypeVar("T")
+
+# Lower value = admitted first.
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+# Priority of calls that do not name one; background pipelines set "bulk".
+current_priority: ContextVar[str] = ContextVar("llm_priority", default="interactive")
+
+_PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class QueueTimeout(Exception):
+    """An LLM call waited longer than ``llm_queue_timeout_seconds`` for admission."""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Refills at ``per_minute / 60`` units per second up to ``per_minute``.
+
+    Not thread-safe on its own; the scheduler holds its lock around every call.
+    """
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._clock = clock
+        self._level = self.capacity
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def level(self) -> float:
+        self._refill()
+        return self._level
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available (0 if they are now)."""
+        missing = min(amount, self.capacity) - self.level()
+        return max(0.0, missing / self.rate) if self.rate > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self._level -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        """Return (or, if negative, charge) ``amount`` units after the real cost is known."""
+        self._refill()
+        self._level = min(self.capacity, self._level + amount)
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Tokens a call is charged up front: the prompt plus the expected completion."""
+    return count_tokens(prompt) + settings.llm_output_tokens_estimate
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """True for rate limits, server errors and connection failures."""
+    if isinstance(exc, (groq.APIConnectionError, httpx.TransportError)):
+        return True
+    return getattr(exc, "status_code", None) in _RETRYABLE_STATUS
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def retry_after(exc: BaseException) -> Optional[int]:
+    """
+    Whole seconds a client should wait before trying again, if ``exc`` means
+    the LLM quota is saturated: a ``QueueTimeout``, or a 429 still failing
+    after the scheduler's retries. None for any other failure.
+    """
+    if isinstance(exc, QueueTimeout):
+        wait = exc.retry_after
+    elif getattr(exc, "status_code", None) == 429:
+        wait = _retry_after(exc) or settings.llm_backoff_max_seconds
+    else:
+        return None
+    return max(1, math.ceil(wait))
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    loop: asyncio.AbstractEventLoop = field(compare=False)
+    wake: asyncio.Future = field(compare=False)
+    enqueued: float = field(compare=False)
+
+
+class LLMScheduler:
+    """
+    Admits LLM calls in priority order within request and token rate limits.
+
+    Calls wait in a priority queue (FIFO within a priority). The head of the
+    queue is admitted once a concurrency slot is free and both the
+    requests-per-minute and tokens-per-minute buckets can pay for it; token
+    charges are corrected from the response's usage metadata when available.
+    Calls failing with 429, 5xx or a connection error are retried with
+    jittered exponential backoff (or the server's ``Retry-After``), queueing
+    again for each attempt.
+
+    Waiters are woken through futures of their own event loop, so one
+    scheduler serves every thread and loop of the process.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        max_concurrency: int,
+        max_retries: int,
+        backoff_seconds: float,
+        backoff_max_seconds: float,
+        queue_timeout_seconds: float,
+    ) -> None:
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.queue_timeouts = 0
+        self._wait_seconds = 0.0
+
+    # ── Admission ──────────────────────────────────────────────────────────
+    def _wake_head(self) -> None:
+        """Wake the head waiter so it re-checks admission. Caller holds the lock."""
+        if self._queue:
+            head = self._queue[0]
+            if not head.wake.done():
+                head.loop.call_soon_threadsafe(
+                    lambda fut=head.wake: fut.done() or fut.set_result(None)
+                )
+
+    def _try_admit(self, waiter: _Waiter) -> Optional[float]:
+        """
+        Admit ``waiter`` if it can run now. Caller holds the lock.
+
+        Returns:
+            0 if admitted; seconds until the buckets can pay for it; or None
+            to wait until woken (not at the head, or no free slot).
+        """
+        if self._queue[0] is not waiter or self.in_flight >= self.max_concurrency:
+            return None
+        delay = max(self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+        if delay > 0:
+            return delay
+        self.requests.take(1)
+        self.tokens.take(waiter.tokens)
+        heapq.heappop(self._queue)
+        self.in_flight += 1
+        self.admitted += 1
+        waited = time.monotonic() - waiter.enqueued
+        self._wait_seconds += waited
+        LLM_QUEUE_SECONDS.observe(waited, priority=_PRIORITY_NAMES[waiter.priority])
+        self._wake_head()
+        return 0.0
+
+    async def _acquire(self, priority: str, tokens: int) -> None:
+        started = time.perf_counter()
+        with span("llm_queue", priority=priority, tokens=tokens):
+            await self._wait_for_admission(priority, tokens)
+        record_timing("llm_queue", time.perf_counter() - started)
+
+    async def _wait_for_admission(self, priority: str, tokens: int) -> None:
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        deadline = now + self.queue_timeout_seconds
+        with self._lock:
+            waiter = _Waiter(
+                PRIORITIES[priority], next(self._seq), tokens, loop, loop.create_future(), now
+            )
+            heapq.heappush(self._queue, waiter)
+        try:
+            while True:
+                with self._lock:
+                    delay = self._try_admit(waiter)
+                    if delay == 0:
+                        return
+                    if waiter.wake.done():
+                        waiter.wake = loop.create_future()
+                    wake = waiter.wake
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self.queue_timeouts += 1
+                    raise QueueTimeout(
+                        f"LLM call not admitted within {self.queue_timeout_seconds:g}s",
+                        # Until the buckets refill, or a guess if it waits for a slot.
+                        retry_after=delay or self.backoff_max_seconds,
+                    )
+                await asyncio.wait([wake], timeout=min(remaining, delay or remaining))
+        except BaseException:
+            with self._lock:
+                if waiter in self._queue:
+                    self._queue.remove(waiter)
+                    heapq.heapify(self._queue)
+                self._wake_head()
+            raise
+
+    def _release(self, charged: int, used: Optional[int]) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if used is not None:
+                self.tokens.refund(charged - used)
+            self._wake_head()
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[str] = None, tokens: int = 0) -> AsyncIterator[dict]:
+        """
+        Hold one admitted call for the ``with`` block.
+
+        Set ``usage["tokens"]`` inside the block to correct the token charge.
+        """
+        await self._acquire(priority or current_priority.get(), tokens)
+        usage: dict = {"tokens": None}
+        try:
+            yield usage
+        finally:
+            self._release(tokens, usage["tokens"])
+
+    # ── Retries ────────────────────────────────────────────────────────────
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_seconds * 2**attempt))
+        return max(delay, _retry_after(exc) or 0.0)
+
+    def _should_retry(self, attempt: int, exc: BaseException) -> bool:
+        with self._lock:
+            if getattr(exc, "status_code", None) == 429:
+                self.rate_limited += 1
+            if attempt >= self.max_retries or not is_retryable(exc):
+                self.failures += 1
+                return False
+            self.retries += 1
+            return True
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[T]],
+        priority: Optional[str] = None,
+        tokens: int = 0,
+        name: str = "other",
+    ) -> T:
+        """
+        Run ``call`` once admitted, retrying transient failures.
+
+        Args:
+            call: Makes a fresh LLM request each time it is called.
+            priority: A ``PRIORITIES`` key; defaults to ``current_priority``.
+            tokens: Estimated tokens of the call; see ``estimate_tokens``.
+            name: Chain name its latency and tokens are reported under in
+                ``rag.metrics``.
+
+        Raises:
+            QueueTimeout: Not admitted in time.
+            Exception: The last error of ``call`` once retries are exhausted.
+        """
+        for attempt in itertools.count():
+            try:
+                async with self.slot(priority, tokens) as usage:
+                    started = time.perf_counter()
+                    with span("llm_upstream", chain=name, attempt=attempt):
+                        result = await call()
+                    record_llm(name, time.perf_counter() - started, result)
+                    usage["tokens"] = _total_tokens(result)
+                    return result
+            except QueueTimeout:
+                raise
+            except Exception as exc:
+                if not self._should_retry(attempt, exc):
+                    raise
+                await asyncio.sleep(self._backoff(attempt, exc))
+
+    async def stream(
+        self,
+        open_stream: Callable[[], AsyncIterator[T]],
+        priority: Optional[str] = None,
+        tokens: int = 0,
+        name: str = "other",
+    ) -> AsyncIterator[T]:
+        """
+        Yield from ``open_stream()`` once admitted.
+
+        A failure before the first item is retried like ``run``; once items
+        have been yielded the error is raised, since they cannot be taken back.
+        """
+        for attempt in itertools.count():
+            started = False
+            try:
+                async with self.slot(priority, tokens) as usage:
+                    began, last = time.perf_counter(), None
+                    async for item in open_stream():
+                        started, last = True, item
+                        yield item
+                    # Providers that report usage on a stream put it on the last chunk.
+                    record_llm(name, time.perf_counter() - began, last)
+                    record_span("llm_upstream", began, chain=name, attempt=attempt)
+                    usage["tokens"] = _total_tokens(last)
+                    return
+            except QueueTimeout:
+                raise
+            except Exception as exc:
+                if started or not self._should_retry(attempt, exc):
+                    raise
+                await asyncio.sleep(self._backoff(attempt, exc))
+
+    # ── Metrics ────────────────────────────────────────────────────────────
+    def stats(self) -> Dict[str, object]:
+        """Return queue depth per priority, bucket levels and call outcome counters."""
+        with self._lock:
+            depth = {name: 0 for name in PRIORITIES}
+            for waiter in self._queue:
+                depth[_PRIORITY_NAMES[waiter.priority]] += 1
+            return {
+                "queue_depth": depth,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "requests_available": round(self.requests.level(), 2),
+                "tokens_available": round(self.tokens.level(), 2),
+                "admitted": self.admitted,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "failures": self.failures,
+                "queue_timeouts": self.queue_timeouts,
+                "mean_queue_wait_ms": round(1000 * self._wait_seconds / self.admitted, 3)
+                if self.admitted
+                else None,
+            }
+
+
+def _total_tokens(result: object) -> Optional[int]:
+    """Total tokens reported by a chat model response, if any."""
+    usage = getattr(result, "usage_metadata", None)
+    return usage.get("total_tokens") if isinstance(usage, dict) else None
+
+
+llm_scheduler = LLMScheduler(
+    requests_per_minute=settings.llm_requests_per_minute,
+    tokens_per_minute=settings.llm_tokens_per_minute,
+    max_concurrency=settings.llm_max_concurrency,
+    max_retries=settings.llm_max_retries,
+    backoff_seconds=settings.llm_backoff_seconds,
+    backoff_max_seconds=settings.llm_backoff_max_seconds,
+    queue_timeout_seconds=settings.llm_queue_timeout_seconds,
+)
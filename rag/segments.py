@@ -0,0 +1,470 @@
+"""
+Append-only segmented FAISS stores with background compaction.
+
+On-disk layout of a store directory::
+
+    manifest.json          {"generation": 7, "base": "base-00000005", "segments": ["seg-00000006", ...]}
+    base-00000005/         compacted index
+    seg-00000006/          delta segment holding one write's chunks
+    seg-00000007/
+    .write.lock            held while a writer updates the manifest
+    .compact.lock          held by the one process compacting the store
+
+Each directory holds ``index.faiss``, a SQLite docstore (``docs.sqlite``)
+and ``partitions.json``. Directories from before the SQLite docstore carry a
+pickled ``index.pkl`` instead until ``python -m rag.docstore migrate`` (or the
+next compaction) rewrites them.
+
+Every segment and base directory is written once under a temporary name and
+renamed into place; the manifest is then replaced atomically, so a reader
+always sees a complete, consistent set of directories. Manifest updates are
+serialised across threads and worker processes by an exclusive file lock, and
+the generation in the manifest only ever increases, so concurrent writers
+never overwrite each other and readers in every worker notice each new
+generation by the manifest's stat signature. A directory saved by
+the previous single-index layout (``index.faiss`` + ``index.pkl`` at the top
+level, no manifest) is read as a base with no segments.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager, nullcontext
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from config import settings
+from rag.docstore import (
+    Curriculum,
+    PositionIds,
+    SqliteDocstore,
+    curriculum_counts,
+    documents_at,
+    has_docstore,
+    save_docstore,
+)
+from rag.embeddings import get_embeddings
+from rag.filelock import file_lock
+from rag.index_types import configure, merge_stores
+from rag.lexical import MemoryLexicon, bm25_scores
+from rag.partitions import (
+    Partitions,
+    is_partitioned,
+    load_partitions,
+    partitioned_search,
+    save_partitions,
+)
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+WRITE_LOCK = ".write.lock"
+COMPACT_LOCK = ".compact.lock"
+_LEGACY_BASE = "."
+
+
+def _mmap_flags(index_file: str) -> int:
+    """
+    Return the FAISS read flags that map ``index_file`` read-only.
+
+    Inverted lists and flat code arrays are mapped by different, mutually
+    exclusive flags, so the index type is taken from the file's fourcc.
+    """
+    with open(index_file, "rb") as fh:
+        fourcc = fh.read(4)
+    # IVF indexes are written as "Iv.." / "Iw..".
+    mapping = faiss.IO_FLAG_MMAP if fourcc[:2] in (b"Iv", b"Iw") else faiss.IO_FLAG_MMAP_IFC
+    return mapping | faiss.IO_FLAG_READ_ONLY
+
+
+@contextmanager
+def write_lock(path: str) -> Iterator[None]:
+    """Serialise manifest read-modify-write cycles on a store across threads and processes."""
+    with file_lock(os.path.join(path, WRITE_LOCK)):
+        yield
+
+
+def read_manifest(path: str) -> Optional[dict]:
+    """
+    Return the manifest of a store directory, or None if nothing has been saved.
+
+    A legacy single-index directory is reported as a base with no segments.
+    """
+    try:
+        with open(os.path.join(path, MANIFEST), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        pass
+    if os.path.exists(os.path.join(path, "index.faiss")):
+        return {"generation": 0, "base": _LEGACY_BASE, "segments": []}
+    return None
+
+
+def _write_manifest(path: str, manifest: dict) -> None:
+    tmp_path = os.path.join(path, f".{MANIFEST}.{uuid.uuid4().hex}")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+
+def _save_dir(path: str, store: FAISS, name: str) -> None:
+    """Save ``store``, its docstore and partition map under a temporary name, then rename."""
+    tmp_dir = os.path.join(path, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_dir)
+    faiss.write_index(store.index, os.path.join(tmp_dir, "index.faiss"))
+    save_docstore(tmp_dir, store)
+    save_partitions(tmp_dir, store)
+    os.rename(tmp_dir, os.path.join(path, name))
+
+
+def _load_dir(path: str, name: str, embeddings: Embeddings, mmap: bool = False) -> FAISS:
+    """
+    Load one directory of a store.
+
+    With ``mmap`` the index is mapped read-only, as serving does, so every
+    worker shares one copy through the page cache; compaction loads a
+    private copy it can add vectors to.
+    """
+    directory = os.path.join(path, name)
+    flags = _mmap_flags(os.path.join(directory, "index.faiss")) if mmap else 0
+    if has_docstore(directory):
+        docstore = SqliteDocstore(directory)
+        store = FAISS(
+            embedding_function=embeddings,
+            index=faiss.read_index(os.path.join(directory, "index.faiss"), flags),
+            docstore=docstore,
+            index_to_docstore_id=PositionIds(len(docstore)),
+        )
+    else:
+        store = FAISS.load_local(
+            directory,
+            embeddings,
+            allow_dangerous_deserialization=True,
+            io_flags=flags,
+        )
+    if store.index.ntotal != len(store.index_to_docstore_id):
+        raise ValueError(f"Inconsistent segment {name}: vector and docstore counts differ")
+    configure(store.index)
+    return store
+
+
+@dataclass
+class Segment:
+    """One loaded base or delta directory plus its curriculum partitions."""
+
+    name: str
+    store: FAISS
+    partitions: Partitions
+    _lexicon: Optional[MemoryLexicon] = None
+
+    @classmethod
+    def load(cls, path: str, name: str, embeddings: Embeddings) -> "Segment":
+        store = _load_dir(path, name, embeddings, mmap=True)
+        segment = cls(name, store, load_partitions(os.path.join(path, name), store))
+        if settings.retrieval_mode == "hybrid":
+            # Legacy directories have no on-disk lexicon; build it now, not on a query.
+            segment.lexicon()
+        return segment
+
+    def lexicon(self) -> Union[SqliteDocstore, MemoryLexicon]:
+        """
+        Return the segment's BM25 inverted index.
+
+        SQLite docstores carry one on disk; for directories saved without it
+        an in-memory index is built at load when ``RETRIEVAL_MODE=hybrid``,
+        or else on the first hybrid search.
+        """
+        docstore = self.store.docstore
+        if isinstance(docstore, SqliteDocstore) and docstore.has_postings:
+            return docstore
+        if self._lexicon is None:
+            self._lexicon = MemoryLexicon(documents_at(self.store, range(self.store.index.ntotal)))
+        return self._lexicon
+
+
+def append_segment(path: str, store: FAISS, hold_lock: bool = True) -> str:
+    """
+    Persist ``store`` as a new delta segment; cost is proportional to its size only.
+
+    Args:
+        path: Store directory.
+        store: A FAISS store holding just the new chunks.
+        hold_lock: Take the store's ``write_lock``; pass False if the caller
+            already holds it.
+
+    Returns:
+        The new segment's directory name.
+    """
+    os.makedirs(path, exist_ok=True)
+    with write_lock(path) if hold_lock else nullcontext():
+        manifest = read_manifest(path) or {"generation": 0, "base": None, "segments": []}
+        generation = manifest["generation"] + 1
+        name = f"seg-{generation:08d}"
+        _save_dir(path, store, name)
+        _write_manifest(
+            path,
+            {
+                "generation": generation,
+                "base": manifest["base"],
+                "segments": manifest["segments"] + [name],
+            },
+        )
+    return name
+
+
+def compact(
+    path: str,
+    embeddings: Embeddings,
+    min_segments: int = 1,
+    index_type: Optional[str] = None,
+    retrain: bool = False,
+) -> bool:
+    """
+    Merge the base and all current segments of a store into a new base.
+
+    The merge runs without holding the write lock, so ingestion and feedback
+    writes continue; segments appended meanwhile stay in the new manifest.
+    Only one process compacts a store at a time: if another holds the
+    compaction lock this returns False at once, and a merge whose base was
+    replaced meanwhile is discarded.
+
+    Segments are added to the base's trained index when it already has
+    ``index_type``; otherwise (a flat base reaching the training threshold, or
+    ``retrain``) a new index of that type is trained over every vector.
+
+    Args:
+        path: Store directory.
+        embeddings: Embedding function attached to the loaded stores.
+        min_segments: Skip compaction when fewer segments than this exist;
+            0 rewrites the base even with no segments (used by migrations).
+        index_type: One of ``rag.index_types.INDEX_TYPES`` for the new base;
+            None keeps the current base's type.
+        retrain: Train a new index even if the base already has ``index_type``;
+            implies ``min_segments=0``.
+
+    Returns:
+        True if a new base was written.
+    """
+    if read_manifest(path) is None:
+        return False
+    with file_lock(os.path.join(path, COMPACT_LOCK), blocking=False) as acquired:
+        if not acquired:
+            return False
+        manifest = read_manifest(path)
+        if not retrain and len(manifest["segments"]) < min_segments:
+            return False
+
+        merged_names = list(manifest["segments"])
+        names = ([manifest["base"]] if manifest["base"] else []) + merged_names
+        merged = merge_stores(
+            [_load_dir(path, name, embeddings) for name in names], index_type, retrain=retrain
+        )
+
+        with write_lock(path):
+            current = read_manifest(path)
+            if current["base"] != manifest["base"]:
+                return False
+            generation = current["generation"] + 1
+            base = f"base-{generation:08d}"
+            _save_dir(path, merged, base)
+            current = {
+                "generation": generation,
+                "base": base,
+                "segments": [s for s in current["segments"] if s not in merged_names],
+            }
+            _write_manifest(path, current)
+            _remove_unreferenced(path, current)
+    return True
+
+
+def _remove_unreferenced(path: str, manifest: dict) -> None:
+    """
+    Delete directories the manifest no longer names, including leftovers of crashed writers.
+
+    Must be called under the write lock: every write happens under it, so no
+    temporary directory belongs to a write in progress.
+    """
+    keep = {manifest["base"], *manifest["segments"]}
+    for entry in os.listdir(path):
+        if entry in keep or not entry.startswith(("seg-", "base-", ".tmp-")):
+            continue
+        shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+    if manifest["base"] != _LEGACY_BASE:
+        for filename in ("index.faiss", "index.pkl"):
+            if os.path.exists(os.path.join(path, filename)):
+                os.remove(os.path.join(path, filename))
+
+
+class SegmentedIndex:
+    """
+    Read view over a base index plus its delta segments.
+
+    Exposes the subset of the LangChain FAISS search API used by the retrievers;
+    each search fans out to every part and merges the hits by distance. A
+    filter on grade, subject and/or chapter only is answered exactly from each
+    part's partitions; any other filter is post-filtered by LangChain.
+    """
+
+    def __init__(self, generation: int, parts: List[Segment]) -> None:
+        self.generation = generation
+        self.parts = parts
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        manifest: dict,
+        embeddings: Embeddings,
+        previous: Optional["SegmentedIndex"] = None,
+    ) -> "SegmentedIndex":
+        """
+        Load the directories named in ``manifest``.
+
+        Directories are immutable once written, so any already loaded by
+        ``previous`` are reused and only new segments are read from disk.
+        """
+        loaded = {part.name: part for part in previous.parts} if previous is not None else {}
+        names = ([manifest["base"]] if manifest["base"] else []) + manifest["segments"]
+        parts = [
+            loaded[name] if name in loaded else Segment.load(path, name, embeddings)
+            for name in names
+        ]
+        return cls(manifest["generation"], parts)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(part.store.index.ntotal for part in self.parts)
+
+    @property
+    def dimension(self) -> int:
+        return self.parts[0].store.index.d if self.parts else 0
+
+    def curriculum(
+        self, grade: Optional[int] = None, subject: Optional[str] = None
+    ) -> "Counter[Curriculum]":
+        """Count chunks per (grade, subject, chapter) across every part."""
+        counts: "Counter[Curriculum]" = Counter()
+        for part in self.parts:
+            counts.update(curriculum_counts(part.store, grade, subject))
+        return counts
+
+    def bm25_search(
+        self, query: str, k: int = 4, filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """Return the top-``k`` documents by BM25 score (higher is better) across every part."""
+        scores = bm25_scores([part.lexicon() for part in self.parts], query, filter)
+        ranked = sorted(
+            (
+                (score, i, position)
+                for i, part_scores in enumerate(scores)
+                for position, score in part_scores.items()
+            ),
+            reverse=True,
+        )[:k]
+        hits = []
+        for score, i, position in ranked:
+            [doc] = documents_at(self.parts[i].store, [position])
+            hits.append((doc, score))
+        return hits
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        fetch_k: int = 20,
+    ) -> List[Tuple[Document, float]]:
+        hits: List[Tuple[Document, float]] = []
+        for part in self.parts:
+            if is_partitioned(filter):
+                hits.extend(partitioned_search(part.store, part.partitions, embedding, k, filter))
+            else:
+                hits.extend(
+                    part.store.similarity_search_with_score_by_vector(
+                        embedding, k=k, filter=filter, fetch_k=fetch_k
+                    )
+                )
+        # Stores use the default Euclidean distance: smaller is closer.
+        hits.sort(key=lambda hit: hit[1])
+        return hits[:k]
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        fetch_k: int = 20,
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter, fetch_k=fetch_k
+            )
+        ]
+
+
+class Compactor:
+    """Background thread that periodically compacts stores with many segments."""
+
+    def __init__(
+        self, paths: Dict[str, str], interval_seconds: float, min_segments: int
+    ) -> None:
+        """
+        Args:
+            paths: Store directory -> index type of its compacted base.
+            interval_seconds: Time between compaction passes.
+            min_segments: Segment count at which a store is compacted.
+        """
+        self.paths = paths
+        self.interval_seconds = interval_seconds
+        self.min_segments = min_segments
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="faiss-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def run_once(self) -> None:
+        """Compact every store that has reached ``min_segments`` delta segments."""
+        for path, index_type in self.paths.items():
+            try:
+                compact(
+                    path,
+                    get_embeddings(),
+                    min_segments=max(1, self.min_segments),
+                    index_type=index_type,
+                )
+            except Exception:  # noqa: BLE001
+                logger.exception("Compaction of %s failed", path)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            self.run_once()
+
+
+compactor = Compactor(
+    {
+        settings.faiss_index_path: settings.content_index_type,
+        settings.faiss_feedback_path: "flat",
+    },
+    interval_seconds=settings.compaction_interval_seconds,
+    min_segments=settings.compaction_min_segments,
+)
@@ -0,0 +1,49 @@
+"""Single-flight coalescing: identical concurrent requests share one execution."""
+
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+def request_key(*parts: object) -> str:
+    """Digest of the JSON-encoded ``parts``, for keys built from large request fields."""
+    encoded = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; later callers await its result.
+
+    The call runs as its own task, so a caller that disconnects does not
+    cancel it for the others. Its result or exception is handed to every
+    caller that arrived while it was running; the next caller after it
+    finishes starts a fresh call.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Return the result of ``fn()``, shared with concurrent callers of the same key."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _, key=key: self._calls.pop(key, None))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        """Return calls started, callers served by another's call, and calls in flight."""
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+inflight = SingleFlight()
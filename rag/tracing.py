@@ -0,0 +1,265 @@
+"""
+Per-request traces, exported to a rotating local JSONL file.
+
+With ``TRACING_ENABLED`` set, ``TracingMiddleware`` gives each HTTP request
+a trace id (returned as ``X-Trace-Id``) and a root span. Code under it opens
+nested spans with ``span("name", **attributes)``: every ``rag.metrics.stage``
+is one, as are each adapt chain and its LLM scheduler queue wait and
+upstream call. Tasks started with ``asyncio.gather`` or ``create_task``
+inherit the span they were started under, so concurrent chains show up as
+siblings. When the response has been sent, the whole trace is appended to
+``TRACE_PATH`` as one JSON line; ``GET /traces`` lists the slowest of them.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import settings
+
+# Spans kept per trace; a long bulk ingest stops recording past this.
+_MAX_SPANS = 2000
+
+
+@dataclass
+class Span:
+    """One timed operation, relative to the start of its trace."""
+
+    name: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ms: float
+    duration_ms: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+class Trace:
+    """The spans recorded while handling one request."""
+
+    def __init__(self, name: str) -> None:
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.root = Span(name=name, span_id=uuid.uuid4().hex[:16], parent_id=None, start_ms=0.0)
+        self.spans: List[Span] = [self.root]
+        self.dropped = 0
+        self.finished = False
+
+    def offset_ms(self, perf: float) -> float:
+        """Milliseconds from the start of the trace to ``perf`` (a ``perf_counter`` value)."""
+        return 1000 * (perf - self._started)
+
+    def add(self, span: Span) -> bool:
+        if len(self.spans) >= _MAX_SPANS:
+            self.dropped += 1
+            return False
+        self.spans.append(span)
+        return True
+
+    def finish(self, **attributes: Any) -> None:
+        self.root.duration_ms = round(self.offset_ms(time.perf_counter()), 3)
+        self.root.attributes.update(attributes)
+        self.finished = True
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "started_at": self.started_at,
+            "duration_ms": self.root.duration_ms,
+            "status": self.root.attributes.get("status"),
+            "dropped_spans": self.dropped,
+            "spans": [asdict(span) for span in self.spans],
+        }
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_parent: ContextVar[Optional[str]] = ContextVar("trace_parent", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Record the ``with`` block as a child of the current span.
+
+    A no-op outside a trace, or once the request's trace has been exported
+    (e.g. in a background task the request started). Do not hold it open
+    across the ``yield`` of an async generator; see ``record_span``.
+    """
+    trace = _trace.get()
+    if trace is None or trace.finished:
+        yield None
+        return
+    started = time.perf_counter()
+    current = Span(
+        name=name,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=_parent.get(),
+        start_ms=round(trace.offset_ms(started), 3),
+        attributes=dict(attributes),
+    )
+    if not trace.add(current):
+        yield None
+        return
+    token = _parent.set(current.span_id)
+    try:
+        yield current
+    except BaseException as exc:
+        current.attributes["error"] = type(exc).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        current.duration_ms = round(1000 * (time.perf_counter() - started), 3)
+
+
+def record_span(name: str, started: float, **attributes: Any) -> None:
+    """Record a span from ``started`` (a ``perf_counter`` value) to now under the current span."""
+    trace = _trace.get()
+    if trace is None or trace.finished:
+        return
+    now = time.perf_counter()
+    trace.add(
+        Span(
+            name=name,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=_parent.get(),
+            start_ms=round(trace.offset_ms(started), 3),
+            duration_ms=round(1000 * (now - started), 3),
+            attributes=dict(attributes),
+        )
+    )
+
+
+class TraceExporter:
+    """
+    Appends finished traces to a JSONL file, rotating it like ``logging``'s
+    ``RotatingFileHandler``: ``traces.jsonl`` becomes ``traces.jsonl.1``,
+    and so on up to ``TRACE_BACKUPS`` files.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def _files(self) -> List[str]:
+        """The current file and its backups, newest first."""
+        path = settings.trace_path
+        return [path] + [f"{path}.{n}" for n in range(1, settings.trace_backups + 1)]
+
+    def _rotate(self) -> None:
+        files = self._files()
+        for older, newer in reversed(list(zip(files[1:], files))):
+            if os.path.exists(newer):
+                os.replace(newer, older)
+        if os.path.exists(files[0]):
+            os.remove(files[0])
+
+    def export(self, trace: Trace) -> None:
+        """Append ``trace`` if it is at least ``TRACE_MIN_DURATION_MS`` long."""
+        duration = trace.root.duration_ms or 0
+        if not settings.trace_path or duration < settings.trace_min_duration_ms:
+            return
+        line = json.dumps(trace.to_dict(), ensure_ascii=False) + "\n"
+        with self._lock:
+            path = settings.trace_path
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size and size + len(line) > settings.trace_max_bytes:
+                self._rotate()
+            with open(path, "a", encoding="utf-8") as fh:
+                fh.write(line)
+
+    def traces(self) -> Iterator[dict]:
+        """Yield every exported trace, newest file first."""
+        for path in self._files():
+            try:
+                with open(path, encoding="utf-8") as fh:
+                    lines = fh.readlines()
+            except FileNotFoundError:
+                continue
+            for line in reversed(lines):
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash mid-write
+
+    def slowest(self, limit: int = 20, name: Optional[str] = None) -> List[dict]:
+        """
+        Summaries of the ``limit`` slowest exported traces, optionally only
+        those whose root span is ``name`` (e.g. ``"POST /adapt"``).
+        Each lists its five slowest spans.
+        """
+        rows = [t for t in self.traces() if name is None or t["name"] == name]
+        rows.sort(key=lambda t: t["duration_ms"] or 0, reverse=True)
+        summaries = []
+        for trace in rows[:limit]:
+            children = [s for s in trace["spans"] if s["parent_id"] is not None]
+            children.sort(key=lambda s: s["duration_ms"] or 0, reverse=True)
+            summaries.append(
+                {
+                    **{k: v for k, v in trace.items() if k != "spans"},
+                    "span_count": len(trace["spans"]),
+                    "slowest_spans": [
+                        {"name": s["name"], "duration_ms": s["duration_ms"], **s["attributes"]}
+                        for s in children[:5]
+                    ],
+                }
+            )
+        return summaries
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        """Return the exported trace with ``trace_id``, spans in start order."""
+        for trace in self.traces():
+            if trace["trace_id"] == trace_id:
+                trace["spans"].sort(key=lambda s: s["start_ms"])
+                return trace
+        return None
+
+
+trace_exporter = TraceExporter()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware recording a trace per HTTP request when tracing is enabled.
+
+    Unlike ``@app.middleware("http")``, it sees the end of a streamed
+    response, so ``/adapt/stream`` traces cover every chain to the last token.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not settings.tracing_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(f"{scope['method']} {scope['path']}")
+        status = 500
+
+        async def send_with_trace_id(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.trace_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        trace_token = _trace.set(trace)
+        parent_token = _parent.set(trace.root.span_id)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _parent.reset(parent_token)
+            _trace.reset(trace_token)
+            route = scope.get("route")
+            if route is not None:
+                trace.root.name = f"{scope['method']} {route.path}"
+            trace.finish(status=status, path=scope["path"])
+            trace_exporter.export(trace)
@@ -1,13 +1,24 @@
 """Router for POST /adapt — adaptive content generation with disability profile routing."""
 
 import asyncio
-from typing import Dict, List, Optional
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from fastapi import APIRouter, HTTPException
-from langchain_groq import ChatGroq
+from fastapi.responses import StreamingResponse
+from langchain_core.language_models.chat_models import BaseChatModel
 
 from config import settings
+from rag.chapter_store import chapter_store
+from rag.context import PackedContext, count_tokens, pack_context
+from rag.embeddings import embed_query, normalize_query
+from rag.llm import get_llm
+from rag.metrics import stage
 from rag.pedagogy_store import retrieve_pedagogy
+from rag.rerank import reranker
+from rag.response_cache import CachedResponse, Scope, response_cache
+from rag.scheduler import estimate_tokens, llm_scheduler
+from rag.singleflight import inflight, request_key
 from rag.prompts import (
     ADHD_PROMPT,
     SIMPLIFIED_PROMPT,
@@ -15,7 +26,9 @@ from rag.prompts import (
     VISUAL_DESCRIPTION_PROMPT,
 )
 from rag.retriever import retrieve_with_feedback
-from schemas import AdaptRequest, AdaptResponse
+from rag.tracing import span
+from routers.errors import llm_error
+from schemas import AdaptRequest, AdaptResponse, ContextUsage
 
 router = APIRouter()
 
@@ -30,6 +43,14 @@ PROFILE_CHAINS: Dict[Optional[str], List[str]] = {
     None: ["simplified", "visual_description", "tts_script"],
 }
 
+# AdaptResponse field each chain's output is reported under.
+_CHAIN_FIELDS = {
+    "adhd_simplified": "simplified",
+    "simplified": "simplified",
+    "visual_description": "visual_description",
+    "tts_script": "tts_script",
+}
+
 _CHAIN_PROMPTS = {
     "adhd_simplified": ADHD_PROMPT,
     "simplified": SIMPLIFIED_PROMPT,
@@ -38,58 +59,77 @@ _CHAIN_PROMPTS = {
 }
 
 
-def _get_llm() -> ChatGroq:
-    """Return a configured Groq Llama instance (free tier, 14,400 req/day)."""
-    return ChatGroq(
-        model="llama-3.1-8b-instant",
-        api_key=settings.groq_api_key,
-        temperature=0.3,
-    )
+def _chain_name(prompt_template) -> str:
+    """Return the chain a prompt template belongs to, as reported in ``/metrics``."""
+    return next((key for key, p in _CHAIN_PROMPTS.items() if p is prompt_template), "other")
 
 
-async def _run_chain(prompt_template, llm, prompt_args: dict) -> str:
-    """
-    Invoke a single LangChain chain asynchronously.
+def _get_llm() -> BaseChatModel:
+    """Return the shared chat model (Groq Llama on the free tier, 14,400 req/day)."""
+    return get_llm(temperature=0.3)
 
-    Args:
-        prompt_template: A ChatPromptTemplate instance.
-        llm: The language model to invoke.
-        prompt_args: Dictionary of template variables.
 
-    Returns:
-        The text content of the model response.
-    """
-    chain = prompt_template | llm
-    result = await chain.ainvoke(prompt_args)
-    return result.content
+def _cache_scope(request: AdaptRequest, chain: str) -> Scope:
+    """Return the response-cache scope for one chain of an adapt request."""
+    return (request.disability_profile, request.grade, request.subject, request.chapter, chain)
 
 
-@router.post("/adapt", response_model=AdaptResponse, tags=["Adaptation"])
-async def adapt(request: AdaptRequest) -> AdaptResponse:
+def _build_response(
+    result_map: Dict[str, str], sources: List[str], context: Dict[str, dict]
+) -> AdaptResponse:
+    """Map chain outputs and their context usage onto the AdaptResponse fields."""
+    return AdaptResponse(
+        simplified=result_map.get("adhd_simplified") or result_map.get("simplified"),
+        visual_description=result_map.get("visual_description"),
+        tts_script=result_map.get("tts_script"),
+        sources=sources,
+        context={_CHAIN_FIELDS[key]: usage for key, usage in context.items() if usage},
+    )
+
+
+def _chain_budget(chain: str) -> int:
+    """Return the context token budget of one chain's prompt."""
+    return settings.context_chain_budgets.get(chain, settings.context_token_budget)
+
+
+async def _build_prompt_args(
+    request: AdaptRequest, chains: List[str]
+) -> Tuple[Dict[str, dict], List[str], Dict[str, dict]]:
     """
-    Generate adaptive educational content tailored to a disability profile.
+    Retrieve content, feedback and pedagogy context and pack it for each chain.
 
-    **Profile → chains mapping:**
-    - ``dyslexia`` / ``adhd`` → simplified only
-    - ``cognitive`` → simplified + TTS script
-    - ``visual_impairment`` → visual description + TTS script
-    - ``hearing_impairment`` → simplified + visual description
-    - *(none)* → all three chains
+    With reranking on, ``reranker.fetch_k`` candidates are retrieved from each
+    index and only the ``top_k`` best of them are kept.
 
-    Selected chains run **concurrently** via ``asyncio.gather`` to minimise latency.
-    Context is drawn from both the content FAISS index and the feedback index
-    (``retrieve_with_feedback``). Pedagogy chunks are appended to the prompt after
-    content chunks with a clear separator so the LLM treats them as teaching aids.
+    Content and feedback chunks fill each chain's token budget in retrieval
+    order, less the share reserved for pedagogy analogies (at most half of
+    it); the analogies then get whatever is left. See ``rag.context.pack_context``.
+
+    Returns:
+        Per chain, the prompt variables; the list of source filenames; and per
+        chain, the ``ContextUsage`` fields of its prompt.
 
     Raises:
-        HTTPException 404: No indexed documents found.
-        HTTPException 500: LLM call failed.
+        HTTPException 404: No indexed documents found and no curriculum context.
     """
-    docs = retrieve_with_feedback(request.query, chapter=request.chapter)
+    # One query vector serves the content, feedback and pedagogy searches.
+    embedding = embed_query(request.query)
+    with span("retrieval", chapter=request.chapter, rerank=reranker.enabled):
+        if reranker.enabled:
+            candidates = retrieve_with_feedback(
+                request.query, k=reranker.fetch_k, chapter=request.chapter, embedding=embedding
+            )
+            with stage("rerank"):
+                docs = await reranker.rerank(request.query, candidates)
+        else:
+            docs = retrieve_with_feedback(
+                request.query, chapter=request.chapter, embedding=embedding
+            )
 
     # ── Fallback: no PDF indexed for this chapter ──────────────────────────────
     # Instead of returning a 404 or using unrelated chunks, let the LLM generate
     # from its own NCERT knowledge when we can identify the curriculum context.
+    fallback_context: Optional[str] = None
     if not docs:
         curriculum_parts = []
         if request.grade:
@@ -100,7 +140,7 @@ async def adapt(request: AdaptRequest) -> AdaptResponse:
             curriculum_parts.append(f"chapter '{request.chapter}'")
 
         if curriculum_parts:
-            content_context = (
+            fallback_context = (
                 f"[No PDF uploaded for this chapter. "
                 f"Use your knowledge of {', '.join(curriculum_parts)} "
                 f"from the NCERT textbook to answer accurately and completely. "
@@ -116,7 +156,6 @@ async def adapt(request: AdaptRequest) -> AdaptResponse:
                 ),
             )
     else:
-        content_context = "\n\n".join(doc.page_content for doc in docs)
         sources = list({doc.metadata.get("source", "unknown") for doc in docs})
 
     # Pedagogy analogies are only useful for STEM — skip for humanities subjects
@@ -126,39 +165,302 @@ async def adapt(request: AdaptRequest) -> AdaptResponse:
         request.subject is None
         or request.subject.strip().lower() in _STEM
     )
-    pedagogy_docs = retrieve_pedagogy(request.query, k=3) if use_pedagogy else []
-    pedagogy_context = "\n\n".join(doc.page_content for doc in pedagogy_docs)
+    pedagogy_docs = (
+        retrieve_pedagogy(request.query, k=3, embedding=embedding) if use_pedagogy else []
+    )
 
-    prompt_args = {
-        "context": content_context,
-        "pedagogy": pedagogy_context,
-        "query": request.query,
-    }
+    prompt_args: Dict[str, dict] = {}
+    usage: Dict[str, dict] = {}
+    with stage("context_packing"):
+        for chain in chains:
+            budget = _chain_budget(chain)
+            reserve = min(settings.pedagogy_token_budget, budget // 2) if pedagogy_docs else 0
+            if fallback_context is not None:
+                content = PackedContext(
+                    text=fallback_context, budget=budget, tokens=count_tokens(fallback_context)
+                )
+            else:
+                content = pack_context(docs, budget - reserve)
+            pedagogy = pack_context(pedagogy_docs, max(0, budget - content.tokens))
+            prompt_args[chain] = {
+                "context": content.text,
+                "pedagogy": pedagogy.text,
+                "query": request.query,
+            }
+            usage[chain] = ContextUsage(
+                budget_tokens=budget,
+                used_tokens=content.tokens + pedagogy.tokens,
+                chunks_used=content.chunks_used + pedagogy.chunks_used,
+                chunks_retrieved=content.chunks_retrieved + pedagogy.chunks_retrieved,
+                overlap_tokens_trimmed=content.overlap_trimmed + pedagogy.overlap_trimmed,
+            ).model_dump()
+    return prompt_args, sources, usage
 
-    llm = _get_llm()
+
+async def _run_chain(prompt_template, llm, prompt_args: dict) -> str:
+    """
+    Invoke a single LangChain chain asynchronously through the LLM scheduler.
+
+    Args:
+        prompt_template: A ChatPromptTemplate instance.
+        llm: The language model to invoke.
+        prompt_args: Dictionary of template variables.
+
+    Returns:
+        The text content of the model response.
+    """
+    chain = prompt_template | llm
+    name = _chain_name(prompt_template)
+    with span("chain", chain=name):
+        result = await llm_scheduler.run(
+            lambda: chain.ainvoke(prompt_args),
+            tokens=estimate_tokens(prompt_template.format(**prompt_args)),
+            name=name,
+        )
+    return result.content
+
+
+async def _stream_chain(prompt_template, llm, prompt_args: dict) -> AsyncIterator[str]:
+    """
+    Stream a single LangChain chain token by token through the LLM scheduler.
+
+    Args:
+        prompt_template: A ChatPromptTemplate instance.
+        llm: The language model to stream from.
+        prompt_args: Dictionary of template variables.
+
+    Yields:
+        Text fragments of the model response as they arrive.
+    """
+    chain = prompt_template | llm
+    async for chunk in llm_scheduler.stream(
+        lambda: chain.astream(prompt_args),
+        tokens=estimate_tokens(prompt_template.format(**prompt_args)),
+        name=_chain_name(prompt_template),
+    ):
+        if chunk.content:
+            yield chunk.content
+
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/adapt", response_model=AdaptResponse, tags=["Adaptation"])
+async def adapt(request: AdaptRequest) -> AdaptResponse:
+    """
+    Generate adaptive educational content tailored to a disability profile.
+
+    **Profile → chains mapping:**
+    - ``dyslexia`` / ``adhd`` → simplified only
+    - ``cognitive`` → simplified + TTS script
+    - ``visual_impairment`` → visual description + TTS script
+    - ``hearing_impairment`` → simplified + visual description
+    - *(none)* → all three chains
+
+    Selected chains run **concurrently** via ``asyncio.gather`` to minimise latency.
+    Context is drawn from both the content FAISS index and the feedback index
+    (``retrieve_with_feedback``). Pedagogy chunks are appended to the prompt after
+    content chunks with a clear separator so the LLM treats them as teaching aids.
+    The query is embedded once; the content, feedback and pedagogy searches all
+    reuse that vector through the query-vector cache. The retrieved chunks are
+    packed into each chain's token budget (``context_token_budget``, overridden
+    per chain by ``context_chain_budgets``); the response's ``context`` field
+    reports the budget and the tokens actually used for each output.
+
+    Chain outputs are served from the semantic response cache when the same
+    (profile, grade, subject, chapter) has already been answered for this query
+    or a near-duplicate of it; only the missing chains are sent to the LLM.
+    Identical requests arriving while one is being answered (same normalized
+    query, profile, curriculum and image) wait for that answer instead of
+    calling the LLM again. A learn page opening a chapter precomputed with
+    ``POST /precompute`` is answered from the chapter store without any LLM call.
+
+    Raises:
+        HTTPException 404: No indexed documents found.
+        HTTPException 500: LLM call failed.
+        HTTPException 503: LLM quota saturated; retry after ``Retry-After`` seconds.
+    """
+    stored = _precomputed(request)
+    if stored is not None:
+        return AdaptResponse(**stored)
+    return await inflight.do(_flight_key(request), lambda: generate_adaptation(request))
+
+
+def _precomputed(request: AdaptRequest) -> Optional[dict]:
+    """Return the stored AdaptResponse fields if this is a precomputed chapter-opening request."""
+    if request.image_base64:
+        return None
+    return chapter_store.get_adapt(
+        request.grade, request.subject, request.chapter, request.disability_profile, request.query
+    )
+
+
+def _flight_key(request: AdaptRequest) -> tuple:
+    """Return the single-flight key of an adapt request."""
+    return (
+        "adapt",
+        normalize_query(request.query),
+        request.disability_profile,
+        request.grade,
+        request.subject,
+        request.chapter,
+        request_key(request.image_base64) if request.image_base64 else None,
+    )
+
+
+async def generate_adaptation(request: AdaptRequest) -> AdaptResponse:
+    """
+    Answer one adapt request from the response cache or the LLM chains; see ``adapt``.
+
+    Unlike the endpoint, it neither serves precomputed chapter answers nor
+    coalesces with identical in-flight requests, so the precompute pipeline
+    uses it to generate what it stores.
+    """
     chains_to_run: List[str] = PROFILE_CHAINS.get(
         request.disability_profile, PROFILE_CHAINS[None]
     )
+    cached = {
+        key: response_cache.lookup(_cache_scope(request, key), request.query)
+        for key in chains_to_run
+    }
+    if all(cached.values()):
+        return _build_response(
+            {key: hit.text for key, hit in cached.items()},
+            sources=cached[chains_to_run[0]].sources,
+            context={key: hit.context for key, hit in cached.items()},
+        )
+
+    # Build async tasks for selected chains that missed the cache
+    task_keys = [key for key in chains_to_run if cached[key] is None]
+    prompt_args, sources, usage = await _build_prompt_args(request, task_keys)
+
+    llm = _get_llm()
 
-    # Build async tasks for selected chains only
-    task_keys = list(chains_to_run)
     tasks = [
-        _run_chain(_CHAIN_PROMPTS[key], llm, prompt_args)
+        _run_chain(_CHAIN_PROMPTS[key], llm, prompt_args[key])
         for key in task_keys
     ]
 
     try:
         results = await asyncio.gather(*tasks)
     except Exception as exc:
-        raise HTTPException(
-            status_code=500, detail=f"LLM call failed: {exc}"
-        ) from exc
+        raise llm_error(exc, "LLM call failed") from exc
 
-    result_map = dict(zip(task_keys, results))
+    result_map = {key: hit.text for key, hit in cached.items() if hit is not None}
+    context = {key: hit.context for key, hit in cached.items() if hit is not None}
+    for key, text in zip(task_keys, results):
+        response_cache.store(
+            _cache_scope(request, key), request.query, text, sources, usage[key]
+        )
+        result_map[key] = text
+        context[key] = usage[key]
 
-    return AdaptResponse(
-        simplified=result_map.get("adhd_simplified") or result_map.get("simplified"),
-        visual_description=result_map.get("visual_description"),
-        tts_script=result_map.get("tts_script"),
-        sources=sources,
+    return _build_response(result_map, sources=sources, context=context)
+
+
+@router.post("/adapt/stream", tags=["Adaptation"])
+async def adapt_stream(request: AdaptRequest) -> StreamingResponse:
+    """
+    Stream adaptive content as Server-Sent Events while the chains generate.
+
+    Takes the same body as ``POST /adapt`` and runs the same chains
+    concurrently, but forwards each fragment from ``llm.astream`` as soon as it
+    arrives instead of waiting for the slowest chain. Events:
+
+    - ``token`` — ``{"chain": "simplified" | "visual_description" | "tts_script", "text": ...}``
+    - ``error`` — ``{"detail": ..., "status": 500 | 503}`` if a chain fails; the
+      stream then ends. A 503 means the LLM quota is saturated and also
+      carries ``retry_after`` (seconds), as the ``Retry-After`` of ``/adapt``
+    - ``done`` — ``{"sources": [...], "context": {...}}`` once every chain has
+      finished; ``context`` is the per-chain ``ContextUsage`` as in ``/adapt``
+
+    Cached and precomputed chains are sent as a single ``token`` event up front.
+
+    Raises:
+        HTTPException 404: No indexed documents found (before the stream starts).
+    """
+    chains_to_run: List[str] = PROFILE_CHAINS.get(
+        request.disability_profile, PROFILE_CHAINS[None]
+    )
+    stored = _precomputed(request)
+    if stored is not None:
+        cached = {
+            key: CachedResponse(
+                text=stored[_CHAIN_FIELDS[key]] or "",
+                sources=stored["sources"],
+                context=stored["context"].get(_CHAIN_FIELDS[key]),
+            )
+            for key in chains_to_run
+        }
+    else:
+        cached = {
+            key: response_cache.lookup(_cache_scope(request, key), request.query)
+            for key in chains_to_run
+        }
+    task_keys = [key for key in chains_to_run if cached[key] is None]
+    if task_keys:
+        prompt_args, sources, usage = await _build_prompt_args(request, task_keys)
+    else:
+        prompt_args, sources, usage = {}, cached[chains_to_run[0]].sources, {}
+    context = {
+        _CHAIN_FIELDS[key]: hit.context if hit is not None else usage[key]
+        for key, hit in cached.items()
+        if hit is None or hit.context
+    }
+
+    async def events() -> AsyncIterator[str]:
+        for key, hit in cached.items():
+            if hit is not None:
+                yield _sse("token", {"chain": _CHAIN_FIELDS[key], "text": hit.text})
+
+        queue: asyncio.Queue = asyncio.Queue()
+        llm = _get_llm() if task_keys else None
+
+        async def pump(key: str) -> None:
+            parts: List[str] = []
+            try:
+                with span("chain", chain=key):
+                    async for text in _stream_chain(_CHAIN_PROMPTS[key], llm, prompt_args[key]):
+                        parts.append(text)
+                        queue.put_nowait((key, text))
+            finally:
+                queue.put_nowait((key, None))
+            response_cache.store(
+                _cache_scope(request, key), request.query, "".join(parts), sources, usage[key]
+            )
+
+        tasks = [asyncio.create_task(pump(key)) for key in task_keys]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                key, text = await queue.get()
+                if text is None:
+                    remaining -= 1
+                    continue
+                yield _sse("token", {"chain": _CHAIN_FIELDS[key], "text": text})
+
+            errors = [
+                result
+                for result in await asyncio.gather(*tasks, return_exceptions=True)
+                if isinstance(result, Exception)
+            ]
+            if errors:
+                error = llm_error(errors[0], "LLM call failed")
+                payload = {"detail": error.detail, "status": error.status_code}
+                if error.headers:
+                    payload["retry_after"] = int(error.headers["Retry-After"])
+                yield _sse("error", payload)
+                return
+            yield _sse("done", {"sources": sources, "context": context})
+        finally:
+            # Client disconnected or a chain failed: stop the remaining chains.
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
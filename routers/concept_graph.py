@@ -4,9 +4,11 @@ import json
 import re
 
 from fastapi import APIRouter, HTTPException
-from langchain_groq import ChatGroq
+from langchain_core.language_models.chat_models import BaseChatModel
 
-from config import settings
+from rag.llm import get_llm
+from rag.scheduler import estimate_tokens, llm_scheduler
+from routers.errors import llm_error
 from schemas import ConceptGraphRequest, ConceptGraphResponse
 
 router = APIRouter()
@@ -35,13 +37,9 @@ Educational Content:
 """
 
 
-def _get_llm() -> ChatGroq:
-    """Return a configured Groq Llama instance (low temperature for structured output)."""
-    return ChatGroq(
-        model="llama-3.1-8b-instant",
-        api_key=settings.groq_api_key,
-        temperature=0.1,
-    )
+def _get_llm() -> BaseChatModel:
+    """Return the shared chat model (low temperature for structured output)."""
+    return get_llm(temperature=0.1)
 
 
 @router.post(
@@ -67,13 +65,16 @@ async def concept_graph(request: ConceptGraphRequest) -> ConceptGraphResponse:
 
     Raises:
         HTTPException 500: LLM call failed or returned invalid JSON.
+        HTTPException 503: LLM quota saturated; retry after ``Retry-After`` seconds.
         HTTPException 422: JSON parsed but failed Pydantic schema validation.
     """
     llm = _get_llm()
     prompt = _CONCEPT_GRAPH_PROMPT.format(content=request.content)
 
     try:
-        result = await llm.ainvoke(prompt)
+        result = await llm_scheduler.run(
+            lambda: llm.ainvoke(prompt), tokens=estimate_tokens(prompt), name="concept_graph"
+        )
         raw = result.content.strip()
         # Strip markdown code fences if the model wraps its output
         raw = re.sub(r"^```(?:json)?\s*", "", raw)
@@ -84,9 +85,7 @@ async def concept_graph(request: ConceptGraphRequest) -> ConceptGraphResponse:
             status_code=500, detail=f"LLM returned invalid JSON: {exc}"
         ) from exc
     except Exception as exc:
-        raise HTTPException(
-            status_code=500, detail=f"Concept graph generation failed: {exc}"
-        ) from exc
+        raise llm_error(exc, "Concept graph generation failed") from exc
 
     try:
         return ConceptGraphResponse(**data)
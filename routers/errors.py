@@ -0,0 +1,25 @@
+"""HTTP errors for failed LLM calls, shared by the generation routers."""
+
+from fastapi import HTTPException
+
+from rag.scheduler import retry_after
+
+
+def llm_error(exc: Exception, detail: str) -> HTTPException:
+    """
+    Map an exception from an LLM call to the response the client should get.
+
+    A saturated quota (a scheduler queue timeout, or a 429 that outlasted the
+    retries) is a 503 with ``Retry-After``, so clients back off instead of
+    treating it as a server fault. Anything else is a 500.
+
+    Args:
+        exc: What the LLM call raised.
+        detail: Message prefix, e.g. ``"LLM call failed"``.
+    """
+    wait = retry_after(exc)
+    if wait is None:
+        return HTTPException(status_code=500, detail=f"{detail}: {exc}")
+    return HTTPException(
+        status_code=503, detail=f"{detail}: {exc}", headers={"Retry-After": str(wait)}
+    )
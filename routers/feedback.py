@@ -2,6 +2,8 @@
 
 from fastapi import APIRouter, HTTPException
 
+from rag.chapter_store import chapter_store
+from rag.response_cache import response_cache
 from rag.retriever import upsert_feedback
 from schemas import FeedbackRequest, FeedbackResponse
 
@@ -19,7 +21,9 @@ async def feedback(request: FeedbackRequest) -> FeedbackResponse:
     embedded and upserted into the ``faiss_feedback_store`` index. This allows
     ``retrieve_with_feedback`` in future ``/adapt`` calls to surface previously
     poorly-rated queries as additional context, helping the LLM avoid
-    repeating the same low-quality explanation pattern.
+    repeating the same low-quality explanation pattern. Cached and
+    precomputed answers to the query are dropped so the next request
+    regenerates the answer.
 
     Args:
         request: FeedbackRequest with query, content, rating (1-5), and profile.
@@ -40,5 +44,8 @@ async def feedback(request: FeedbackRequest) -> FeedbackResponse:
                 status_code=500,
                 detail=f"Failed to index feedback: {exc}",
             ) from exc
+        # Stop serving the poorly rated answer from the caches /adapt reads first.
+        response_cache.invalidate(query=request.query)
+        chapter_store.invalidate_answer(request.query)
 
     return FeedbackResponse(status="received", indexed=should_index)
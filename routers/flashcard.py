@@ -3,15 +3,18 @@
 import json
 import re
 
-from fastapi import APIRouter, HTTPException
-from langchain_groq import ChatGroq
+from fastapi import APIRouter
 from pydantic import BaseModel
 
-from config import settings
+from rag.chapter_store import chapter_store
+from rag.llm import get_llm
+from rag.scheduler import estimate_tokens, llm_scheduler
+from rag.singleflight import inflight, request_key
+from routers.errors import llm_error
 
 router = APIRouter(prefix="/flashcard", tags=["Flashcard"])
 
-llm = ChatGroq(model="llama-3.1-8b-instant", api_key=settings.groq_api_key, temperature=0.5)
+_TEMPERATURE = 0.5
 
 
 class FlashcardRequest(BaseModel):
@@ -37,8 +40,7 @@ def _extract_json(text: str) -> dict:
     raise ValueError(f"No valid JSON found: {text[:200]}")
 
 
-@router.post("/generate")
-def generate_flashcards(req: FlashcardRequest) -> dict:
+async def build_flashcards(req: FlashcardRequest) -> dict:
     """Generate 8 Q&A flashcard pairs from chapter content."""
     prompt = f"""Generate exactly 8 flashcard question-answer pairs for {req.subject} Grade {req.grade}, chapter "{req.chapter}".
 
@@ -48,8 +50,38 @@ Content:
 Respond ONLY with JSON, no other text:
 {{"flashcards":[{{"question":"What is ...?","answer":"It is ..."}}]}}"""
     try:
-        response = llm.invoke(prompt)
+        llm = get_llm(temperature=_TEMPERATURE)
+        # A class opening the same chapter at once shares one generation.
+        key = (
+            "flashcard",
+            request_key(" ".join(req.content.split())),
+            req.grade,
+            req.subject,
+            req.chapter,
+        )
+        response = await inflight.do(
+            key,
+            lambda: llm_scheduler.run(
+                lambda: llm.ainvoke(prompt),
+                priority="bulk",
+                tokens=estimate_tokens(prompt),
+                name="flashcards",
+            ),
+        )
         data = _extract_json(response.content)
         return data
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Flashcard generation failed: {e}")
+        raise llm_error(e, "Flashcard generation failed")
+
+
+@router.post("/generate")
+async def generate_flashcards(req: FlashcardRequest) -> dict:
+    """
+    Generate 8 Q&A flashcard pairs from chapter content.
+
+    Flashcards precomputed for the chapter (``POST /precompute``) are returned instead.
+    """
+    stored = chapter_store.get_artifact("flashcards", req.grade, req.subject, req.chapter)
+    if stored is not None:
+        return stored
+    return await build_flashcards(req)
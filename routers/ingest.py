@@ -1,15 +1,77 @@
-"""Router for POST /ingest — PDF ingestion endpoint."""
+"""Router for POST /ingest — PDF ingestion endpoints and background job status."""
 
-from typing import Optional
+import asyncio
+import io
+import json
+import posixpath
+import zipfile
+from typing import Callable, Dict, List, Optional, Tuple
 
 from fastapi import APIRouter, File, Form, HTTPException, UploadFile
 
-from rag.ingestor import ingest_pdf
-from schemas import IngestResponse
+from rag.chapter_store import chapter_store
+from rag.ingest_jobs import IngestJob, ingest_jobs
+from rag.ingestor import PdfUpload, ingest_pdf, ingest_pdfs
+from rag.response_cache import response_cache
+from rag.retriever import list_chapters
+from schemas import ChapterInfo, IngestJobResponse, IngestResponse
 
 router = APIRouter()
 
 
+async def _read_pdf(file: UploadFile) -> bytes:
+    """
+    Validate an uploaded PDF and return its bytes.
+
+    Raises:
+        HTTPException 400: If the uploaded file is not a PDF or is empty.
+    """
+    if not file.filename or not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are accepted.")
+
+    file_bytes = await file.read()
+    if not file_bytes:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+    return file_bytes
+
+
+def _ingest_job(
+    file_bytes: bytes,
+    filename: str,
+    grade: Optional[int],
+    subject: Optional[str],
+    chapter: Optional[str],
+) -> Callable[..., int]:
+    """Build the blocking job body that ingests one PDF on an ingestion worker."""
+
+    def run(progress: Callable[..., None]) -> int:
+        chunks_indexed = ingest_pdf(
+            file_bytes, filename,
+            grade=grade, subject=subject, chapter=chapter,
+            progress=progress,
+        )
+        if chunks_indexed:
+            # Cached and precomputed answers for this chapter predate the new content.
+            response_cache.invalidate(grade=grade, subject=subject, chapter=chapter)
+            chapter_store.invalidate(grade=grade, subject=subject, chapter=chapter)
+        return chunks_indexed
+
+    return run
+
+
+def _submit(
+    file_bytes: bytes,
+    filename: str,
+    grade: Optional[int],
+    subject: Optional[str],
+    chapter: Optional[str],
+) -> Tuple[IngestJob, asyncio.Future]:
+    job, future = ingest_jobs.submit(
+        filename, _ingest_job(file_bytes, filename, grade, subject, chapter)
+    )
+    return job, asyncio.wrap_future(future)
+
+
 @router.post("/ingest", response_model=IngestResponse, tags=["Ingestion"])
 async def ingest(
     file: UploadFile = File(...),
@@ -22,24 +84,26 @@ async def ingest(
 
     Accepts a multipart/form-data PDF upload plus optional curriculum metadata
     (grade, subject, chapter). Metadata is attached to every chunk so retrieval
-    can later be filtered to a specific chapter.
+    can later be filtered to a specific chapter. Cached ``/adapt`` responses and
+    precomputed outputs for the chapter are invalidated once the new chunks are
+    indexed.
+
+    An exact re-upload is reported as ``duplicate`` with nothing indexed, and
+    chunks already in the index are counted in ``chunks_skipped``.
+
+    The work runs on the ingestion worker pool, so other requests keep being
+    served while this one waits. Use ``POST /ingest/jobs`` to get a job id back
+    immediately instead of waiting.
 
     Raises:
         HTTPException 400: If the uploaded file is not a PDF or is empty.
         HTTPException 500: If the ingestion pipeline fails.
     """
-    if not file.filename or not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are accepted.")
-
-    file_bytes = await file.read()
-    if not file_bytes:
-        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+    file_bytes = await _read_pdf(file)
+    job, result = _submit(file_bytes, file.filename, grade, subject, chapter)
 
     try:
-        chunks_indexed = ingest_pdf(
-            file_bytes, file.filename,
-            grade=grade, subject=subject, chapter=chapter,
-        )
+        chunks_indexed = await result
     except Exception as exc:
         raise HTTPException(
             status_code=500, detail=f"Ingestion failed: {exc}"
@@ -49,4 +113,201 @@ async def ingest(
         status="success",
         chunks_indexed=chunks_indexed,
         filename=file.filename,
+        chunks_skipped=job.chunks_skipped,
+        duplicate=job.files_skipped > 0,
     )
+
+
+@router.post(
+    "/ingest/jobs",
+    response_model=IngestJobResponse,
+    status_code=202,
+    tags=["Ingestion"],
+)
+async def create_ingest_job(
+    file: UploadFile = File(...),
+    grade: Optional[int] = Form(None),
+    subject: Optional[str] = Form(None),
+    chapter: Optional[str] = Form(None),
+) -> IngestJobResponse:
+    """
+    Queue a PDF for background ingestion and return its job id immediately.
+
+    Poll ``GET /ingest/jobs/{job_id}`` for stage and progress counters.
+
+    Raises:
+        HTTPException 400: If the uploaded file is not a PDF or is empty.
+    """
+    file_bytes = await _read_pdf(file)
+    job, _ = _submit(file_bytes, file.filename, grade, subject, chapter)
+    return IngestJobResponse(**job.to_dict())
+
+
+@router.get("/ingest/jobs/{job_id}", response_model=IngestJobResponse, tags=["Ingestion"])
+async def get_ingest_job(job_id: str) -> IngestJobResponse:
+    """
+    Report the stage, pages parsed, chunks embedded and error of an ingestion job.
+
+    Raises:
+        HTTPException 404: Unknown job id (or a finished job that has been pruned).
+    """
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown ingestion job.")
+    return IngestJobResponse(**job.to_dict())
+
+
+@router.get("/ingest/chapters", response_model=List[ChapterInfo], tags=["Ingestion"])
+async def get_ingested_chapters(
+    grade: Optional[int] = None, subject: Optional[str] = None
+) -> List[ChapterInfo]:
+    """List the chapters ingested so far, optionally for one grade and/or subject."""
+    return [ChapterInfo(**row) for row in list_chapters(grade=grade, subject=subject)]
+
+
+def _manifest(raw: object, source: str) -> Dict[str, dict]:
+    """
+    Check a decoded manifest and normalize its entries.
+
+    Each filename must map to an object whose ``grade`` is an integer (a
+    numeric string such as ``"9"`` is converted, so the retriever's grade
+    filter matches it) and whose ``subject`` and ``chapter`` are strings.
+    Any of the three may be omitted.
+
+    Raises:
+        HTTPException 400: The manifest or one of its entries is invalid.
+    """
+    if not isinstance(raw, dict) or not all(isinstance(meta, dict) for meta in raw.values()):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid manifest in {source}: expected an object of filename -> "
+            '{"grade", "subject", "chapter"} objects.',
+        )
+    entries: Dict[str, dict] = {}
+    for name, meta in raw.items():
+        entry = dict(meta)
+        if entry.get("grade") is not None:
+            try:
+                if isinstance(entry["grade"], (bool, float)):
+                    raise ValueError(entry["grade"])
+                entry["grade"] = int(entry["grade"])
+            except (TypeError, ValueError):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid manifest in {source}: grade of {name} must be an integer.",
+                ) from None
+        for key in ("subject", "chapter"):
+            if entry.get(key) is not None and not isinstance(entry[key], str):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid manifest in {source}: {key} of {name} must be a string.",
+                )
+        entries[name] = entry
+    return entries
+
+
+def _bulk_uploads(
+    files: List[Tuple[str, bytes]],
+    manifest: Dict[str, dict],
+    grade: Optional[int],
+    subject: Optional[str],
+) -> List[PdfUpload]:
+    """
+    Expand uploaded PDFs and zips into PdfUploads with curriculum metadata.
+
+    A zip may carry its own ``manifest.json``; entries in the form manifest take
+    precedence. Manifest keys match either the full path inside the zip or the
+    bare filename. Files missing from the manifest fall back to the form-level
+    grade and subject with no chapter. Zipped PDFs keep their path inside
+    the archive as their filename, so ``a/ch1.pdf`` and ``b/ch1.pdf`` stay
+    separate. Runs in a worker thread: reading large zips blocks.
+
+    Raises:
+        HTTPException 400: Unreadable zip or manifest, or no PDFs found.
+    """
+    pdfs: List[Tuple[str, bytes]] = []
+    merged: Dict[str, dict] = {}
+    for name, data in files:
+        if name.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                    for entry in archive.namelist():
+                        if entry.lower().endswith(".pdf"):
+                            pdfs.append((entry, archive.read(entry)))
+                        elif posixpath.basename(entry) == "manifest.json":
+                            merged.update(_manifest(json.loads(archive.read(entry)), name))
+            except (zipfile.BadZipFile, json.JSONDecodeError) as exc:
+                raise HTTPException(
+                    status_code=400, detail=f"Unreadable zip {name}: {exc}"
+                ) from exc
+        elif name.lower().endswith(".pdf"):
+            pdfs.append((name, data))
+        else:
+            raise HTTPException(
+                status_code=400, detail=f"Only PDF and zip files are accepted: {name}"
+            )
+    merged.update(manifest)
+
+    if not pdfs:
+        raise HTTPException(status_code=400, detail="No PDF files found in the upload.")
+
+    uploads = []
+    for name, data in pdfs:
+        meta = merged.get(name) or merged.get(posixpath.basename(name)) or {}
+        uploads.append(
+            PdfUpload(
+                file_bytes=data,
+                filename=name,
+                grade=meta.get("grade", grade),
+                subject=meta.get("subject", subject),
+                chapter=meta.get("chapter"),
+            )
+        )
+    return uploads
+
+
+@router.post(
+    "/ingest/bulk",
+    response_model=IngestJobResponse,
+    status_code=202,
+    tags=["Ingestion"],
+)
+async def create_bulk_ingest_job(
+    files: List[UploadFile] = File(...),
+    grade: Optional[int] = Form(None),
+    subject: Optional[str] = Form(None),
+    manifest: Optional[str] = Form(None),
+) -> IngestJobResponse:
+    """
+    Queue many PDFs (or zips of PDFs) for ingestion as a single background job.
+
+    ``manifest`` is an optional JSON object mapping each filename to its
+    ``{"grade", "subject", "chapter"}``; a zip may instead include a
+    ``manifest.json``. PDFs are parsed in parallel worker processes, embedded
+    in batches and written to the index once. Poll ``GET /ingest/jobs/{job_id}``.
+
+    Raises:
+        HTTPException 400: Bad manifest, non-PDF/zip file, or nothing to ingest.
+    """
+    try:
+        file_manifest = _manifest(json.loads(manifest), "the manifest field") if manifest else {}
+    except json.JSONDecodeError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid manifest: {exc}") from exc
+
+    uploads = await asyncio.to_thread(
+        _bulk_uploads,
+        [(file.filename or "", await file.read()) for file in files],
+        file_manifest,
+        grade,
+        subject,
+    )
+
+    def run(progress: Callable[..., None]) -> int:
+        counts = ingest_pdfs(uploads, progress=progress)
+        for scope in {(u.grade, u.subject, u.chapter) for u in uploads}:
+            response_cache.invalidate(grade=scope[0], subject=scope[1], chapter=scope[2])
+            chapter_store.invalidate(grade=scope[0], subject=scope[1], chapter=scope[2])
+        return sum(counts.values())
+
+    job, _ = ingest_jobs.submit(f"{len(uploads)} files", run, files_total=len(uploads))
+    return IngestJobResponse(**job.to_dict())
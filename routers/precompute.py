@@ -0,0 +1,263 @@
+"""Router for POST /precompute — background generation of a chapter's learn-page content."""
+
+import asyncio
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from fastapi import APIRouter, HTTPException
+
+from config import settings
+from rag.chapter_store import ARTIFACTS, chapter_query, chapter_store
+from rag.jobs import JobStore
+from rag.scheduler import current_priority
+from routers.adapt import PROFILE_CHAINS, generate_adaptation
+from routers.flashcard import FlashcardRequest, build_flashcards
+from routers.quiz import QuizGenRequest, build_quiz
+from schemas import (
+    AdaptRequest,
+    AdaptResponse,
+    PrecomputedChapter,
+    PrecomputeJobResponse,
+    PrecomputeRequest,
+)
+
+router = APIRouter()
+
+
+@dataclass
+class PrecomputeJob:
+    """Progress record for one chapter precompute."""
+
+    job_id: str
+    grade: int
+    subject: str
+    chapter: str
+    status: str = "queued"  # queued | running | succeeded | partial | failed
+    units_total: int = len(PROFILE_CHAINS) + len(ARTIFACTS)
+    units_done: int = 0
+    units_failed: int = 0
+    errors: List[str] = field(default_factory=list)
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+
+
+_jobs: "OrderedDict[str, PrecomputeJob]" = OrderedDict()
+# Shared with the other worker processes, which may be asked for a job's status.
+_store = JobStore(settings.job_store_path, "precompute", settings.precompute_jobs_retained)
+# Holds a reference to each running pipeline so it is not garbage-collected.
+_tasks: Set[asyncio.Task] = set()
+
+
+def _active_job(
+    grade: int, subject: str, chapter: str, jobs: Iterable[PrecomputeJob]
+) -> Optional[PrecomputeJob]:
+    for job in jobs:
+        if job.finished_at is None and (job.grade, job.subject, job.chapter) == (
+            grade, subject, chapter
+        ):
+            return job
+    return None
+
+
+def _claim_name(grade: int, subject: str, chapter: str) -> str:
+    """Name of the lock a worker holds for as long as it precomputes a chapter."""
+    return hashlib.sha256(f"{grade}|{subject}|{chapter}".encode("utf-8")).hexdigest()[:16]
+
+
+def _save(job: PrecomputeJob) -> None:
+    _store.save(asdict(job))
+
+
+def _prune() -> None:
+    finished = [jid for jid, job in _jobs.items() if job.finished_at is not None]
+    for job_id in finished[: max(0, len(_jobs) - settings.precompute_jobs_retained)]:
+        del _jobs[job_id]
+    _store.prune()
+
+
+async def _adapt_profile(job: PrecomputeJob, profile: Optional[str]) -> AdaptResponse:
+    """Generate and store one profile's chapter-opening answer."""
+    query = chapter_query(profile, job.grade, job.subject, job.chapter)
+    response = await generate_adaptation(
+        AdaptRequest(
+            query=query,
+            disability_profile=profile,
+            grade=job.grade,
+            subject=job.subject,
+            chapter=job.chapter,
+        )
+    )
+    chapter_store.put_adapt(
+        job.grade, job.subject, job.chapter, profile, query, response.model_dump()
+    )
+    return response
+
+
+async def _artifact(job: PrecomputeJob, kind: str, content: str) -> dict:
+    """Generate and store the chapter's quiz or flashcards from ``content``."""
+    fields = dict(content=content, chapter=job.chapter, subject=job.subject, grade=job.grade)
+    if kind == "quiz":
+        data = await build_quiz(QuizGenRequest(**fields))
+    else:
+        data = await build_flashcards(FlashcardRequest(**fields))
+    chapter_store.put_artifact(kind, job.grade, job.subject, job.chapter, data)
+    return data
+
+
+async def _run(job: PrecomputeJob) -> None:
+    """
+    Generate every profile's answer, then the quiz and flashcards, for a chapter.
+
+    At most ``settings.precompute_concurrency`` units run at once, and every
+    LLM call is submitted at bulk priority so students' live requests are
+    admitted first. A failed unit is recorded and the others continue.
+    """
+    current_priority.set("bulk")
+    limit = asyncio.Semaphore(max(1, settings.precompute_concurrency))
+    job.status = "running"
+    _save(job)
+
+    async def unit(name: str, make: Callable[[], Awaitable[object]]) -> object:
+        async with limit:
+            try:
+                result = await make()
+            except Exception as exc:  # noqa: BLE001 — one failed unit must not stop the rest
+                job.units_failed += 1
+                job.errors.append(f"{name}: {getattr(exc, 'detail', exc)}")
+                _save(job)
+                return None
+            job.units_done += 1
+            _save(job)
+            return result
+
+    profiles = list(PROFILE_CHAINS)
+    responses = await asyncio.gather(
+        *(
+            unit(profile or "default", lambda profile=profile: _adapt_profile(job, profile))
+            for profile in profiles
+        )
+    )
+
+    # The learn pages build quizzes and flashcards from the adapted explanation.
+    by_profile: Dict[Optional[str], AdaptResponse] = dict(zip(profiles, responses))
+    ordered = [by_profile.get(None)] + [r for p, r in by_profile.items() if p is not None]
+    content = next(
+        (r.simplified or r.visual_description or r.tts_script for r in ordered if r is not None),
+        None,
+    )
+    if content:
+        await asyncio.gather(
+            *(unit(kind, lambda kind=kind: _artifact(job, kind, content)) for kind in ARTIFACTS)
+        )
+    else:
+        job.units_failed += len(ARTIFACTS)
+        job.errors.append("quiz, flashcards: no chapter explanation to generate from")
+
+    job.status = (
+        "succeeded" if not job.units_failed else "partial" if job.units_done else "failed"
+    )
+    job.finished_at = time.time()
+    _save(job)
+
+
+async def _run_claimed(job: PrecomputeJob, claim: ExitStack) -> None:
+    """Run ``job``, then release the chapter's claim."""
+    with claim:
+        await _run(job)
+
+
+@router.post(
+    "/precompute",
+    response_model=PrecomputeJobResponse,
+    status_code=202,
+    tags=["Precompute"],
+)
+async def create_precompute_job(request: PrecomputeRequest) -> PrecomputeJobResponse:
+    """
+    Generate a chapter's learn-page content for every disability profile in the background.
+
+    Produces the chapter-opening ``/adapt`` answer for each profile in
+    ``PROFILE_CHAINS``, plus a quiz and flashcards, and keeps them in the
+    chapter store. The learn pages then open the chapter with a store read
+    instead of LLM calls; anything not precomputed is still generated live.
+    Ingesting new content for the chapter drops its stored outputs.
+
+    A precompute already running for the chapter, in this or another worker
+    process, is returned instead of starting another. Poll
+    ``GET /precompute/jobs/{job_id}`` for progress.
+
+    Raises:
+        HTTPException 409: Another worker has just started this chapter and
+            its job record is not written yet.
+    """
+    chapter = (request.grade, request.subject, request.chapter)
+    job = _active_job(*chapter, _jobs.values())
+    if job is not None:
+        return PrecomputeJobResponse(**asdict(job))
+
+    claim = ExitStack()
+    if not claim.enter_context(_store.claim(_claim_name(*chapter))):
+        claim.close()
+        # Only a live worker holds the claim, so its record is not a crashed job's.
+        job = _active_job(*chapter, (PrecomputeJob(**row) for row in _store.records()))
+        if job is None:
+            raise HTTPException(
+                status_code=409, detail="A precompute for this chapter is starting; retry shortly."
+            )
+        return PrecomputeJobResponse(**asdict(job))
+
+    # Unfinished records nobody holds the claim for were left by a stopped worker.
+    for row in _store.records():
+        stale = PrecomputeJob(**row)
+        if _active_job(*chapter, [stale]) is not None:
+            stale.status = "failed"
+            stale.errors.append("worker stopped before the precompute finished")
+            stale.finished_at = time.time()
+            _save(stale)
+
+    job = PrecomputeJob(
+        job_id=uuid.uuid4().hex,
+        grade=request.grade,
+        subject=request.subject,
+        chapter=request.chapter,
+        created_at=time.time(),
+    )
+    _jobs[job.job_id] = job
+    _save(job)
+    _prune()
+    task = asyncio.create_task(_run_claimed(job, claim))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return PrecomputeJobResponse(**asdict(job))
+
+
+@router.get(
+    "/precompute/jobs/{job_id}", response_model=PrecomputeJobResponse, tags=["Precompute"]
+)
+async def get_precompute_job(job_id: str) -> PrecomputeJobResponse:
+    """
+    Report how many of a precompute job's units are done or failed.
+
+    Raises:
+        HTTPException 404: Unknown job id (or a finished job that has been pruned).
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        record = _store.load(job_id)
+        job = PrecomputeJob(**record) if record else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown precompute job.")
+    return PrecomputeJobResponse(**asdict(job))
+
+
+@router.get(
+    "/precompute/chapters", response_model=List[PrecomputedChapter], tags=["Precompute"]
+)
+async def get_precomputed_chapters() -> List[PrecomputedChapter]:
+    """List the chapters in the precompute store and which outputs each one has."""
+    return [PrecomputedChapter(**row) for row in chapter_store.chapters()]
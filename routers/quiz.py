@@ -1,22 +1,30 @@
 """Router for quiz generation and result storage."""
 
 import json
+import os
 import re
+import threading
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException
-from langchain_groq import ChatGroq
+from fastapi import APIRouter
 from pydantic import BaseModel
 
-from config import settings
+from rag.chapter_store import chapter_store
+from rag.llm import get_llm
+from rag.scheduler import estimate_tokens, llm_scheduler
+from rag.singleflight import inflight, request_key
+from routers.errors import llm_error
 
 router = APIRouter(prefix="/quiz", tags=["Quiz"])
 
 RESULTS_FILE = Path(__file__).parent.parent / "quiz_results.json"
 
-llm = ChatGroq(model="llama-3.1-8b-instant", api_key=settings.groq_api_key, temperature=0.4)
+_TEMPERATURE = 0.4
+
+# Submissions run on the threadpool; serialise the read-modify-write of the file.
+_results_lock = threading.Lock()
 
 
 # ── Schemas ────────────────────────────────────────────────────────────────
@@ -45,7 +53,10 @@ def _load_results() -> list:
 
 
 def _save_results(results: list) -> None:
-    RESULTS_FILE.write_text(json.dumps(results, indent=2))
+    # Write then rename, so a concurrent reader never sees a half-written file.
+    tmp_path = RESULTS_FILE.with_name(RESULTS_FILE.name + ".tmp")
+    tmp_path.write_text(json.dumps(results, indent=2))
+    os.replace(tmp_path, RESULTS_FILE)
 
 
 def _extract_json(text: str) -> dict:
@@ -67,9 +78,7 @@ def _extract_json(text: str) -> dict:
     raise ValueError(f"No valid JSON found in response: {text[:200]}")
 
 
-# ── Endpoints ──────────────────────────────────────────────────────────────
-@router.post("/generate")
-def generate_quiz(req: QuizGenRequest) -> dict:
+async def build_quiz(req: QuizGenRequest) -> dict:
     """Generate 5 MCQ questions from chapter content using the LLM."""
     prompt = f"""You are a quiz generator. Generate exactly 5 multiple-choice questions for {req.subject} Grade {req.grade}, chapter "{req.chapter}".
 
@@ -79,22 +88,53 @@ Content:
 Respond ONLY with a JSON object in this exact format, no other text:
 {{"questions":[{{"question":"...?","options":["A. ...","B. ...","C. ...","D. ..."],"answer":"A"}}]}}"""
     try:
-        response = llm.invoke(prompt)
+        llm = get_llm(temperature=_TEMPERATURE)
+        # A class opening the same chapter at once shares one generation.
+        key = (
+            "quiz",
+            request_key(" ".join(req.content.split())),
+            req.grade,
+            req.subject,
+            req.chapter,
+        )
+        response = await inflight.do(
+            key,
+            lambda: llm_scheduler.run(
+                lambda: llm.ainvoke(prompt),
+                priority="bulk",
+                tokens=estimate_tokens(prompt),
+                name="quiz",
+            ),
+        )
         data = _extract_json(response.content)
         return data
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Quiz generation failed: {e}")
+        raise llm_error(e, "Quiz generation failed")
+
 
+# ── Endpoints ──────────────────────────────────────────────────────────────
+@router.post("/generate")
+async def generate_quiz(req: QuizGenRequest) -> dict:
+    """
+    Generate 5 MCQ questions from chapter content using the LLM.
+
+    A quiz precomputed for the chapter (``POST /precompute``) is returned instead.
+    """
+    stored = chapter_store.get_artifact("quiz", req.grade, req.subject, req.chapter)
+    if stored is not None:
+        return stored
+    return await build_quiz(req)
 
 
 @router.post("/submit")
 def submit_result(result: QuizResult) -> dict:
     """Store a student's quiz result."""
-    results = _load_results()
     entry = result.model_dump()
     entry["timestamp"] = datetime.now().isoformat()
-    results.append(entry)
-    _save_results(results)
+    with _results_lock:
+        results = _load_results()
+        results.append(entry)
+        _save_results(results)
     return {"status": "stored", "score": result.score, "total": result.total}
 
 
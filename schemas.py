@@ -1,6 +1,6 @@
 """Pydantic schemas for all request and response models."""
 
-from typing import List, Literal, Optional
+from typing import Dict, List, Literal, Optional
 
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -19,6 +19,73 @@ class IngestResponse(BaseModel):
     status: str
     chunks_indexed: int
     filename: str
+    chunks_skipped: int = 0
+    duplicate: bool = False
+
+
+class IngestJobResponse(BaseModel):
+    """Response model for POST /ingest/jobs and GET /ingest/jobs/{job_id}."""
+
+    job_id: str
+    filename: str
+    status: str
+    stage: str
+    files_total: int = 1
+    files_parsed: int = 0
+    files_skipped: int = 0
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    chunks_indexed: int = 0
+    chunks_skipped: int = 0
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+
+
+class ChapterInfo(BaseModel):
+    """One ingested chapter, as listed by GET /ingest/chapters."""
+
+    grade: Optional[int] = None
+    subject: Optional[str] = None
+    chapter: str
+    chunks: int
+
+
+class PrecomputeRequest(BaseModel):
+    """Request model for POST /precompute."""
+
+    grade: int
+    subject: str
+    chapter: str
+
+
+class PrecomputeJobResponse(BaseModel):
+    """Response model for POST /precompute and GET /precompute/jobs/{job_id}."""
+
+    job_id: str
+    grade: int
+    subject: str
+    chapter: str
+    status: str  # queued | running | succeeded | partial | failed
+    units_total: int
+    units_done: int = 0
+    units_failed: int = 0
+    errors: List[str] = Field(default_factory=list)
+    created_at: float
+    finished_at: Optional[float] = None
+
+
+class PrecomputedChapter(BaseModel):
+    """One chapter in the precompute store, as listed by GET /precompute/chapters."""
+
+    grade: int
+    subject: str
+    chapter: str
+    profiles: List[str]
+    quiz: bool
+    flashcards: bool
+    updated_at: float
 
 
 class AdaptRequest(BaseModel):
@@ -33,6 +100,16 @@ class AdaptRequest(BaseModel):
     chapter: Optional[str] = None
 
 
+class ContextUsage(BaseModel):
+    """Token budget and usage of the retrieved context in one chain's prompt."""
+
+    budget_tokens: int
+    used_tokens: int
+    chunks_used: int
+    chunks_retrieved: int
+    overlap_tokens_trimmed: int = 0
+
+
 class AdaptResponse(BaseModel):
     """Response model for POST /adapt."""
 
@@ -40,6 +117,8 @@ class AdaptResponse(BaseModel):
     visual_description: Optional[str] = None
     tts_script: Optional[str] = None
     sources: List[str] = Field(default_factory=list)
+    # Keyed like the output fields above.
+    context: Dict[str, ContextUsage] = Field(default_factory=dict)
 
 
 class FeedbackRequest(BaseModel):
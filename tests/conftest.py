@@ -0,0 +1,39 @@
+"""Fixtures shared by the endpoint and RAG test modules."""
+
+from unittest.mock import patch
+
+import pytest
+
+from config import settings
+from rag import llm
+from rag.scheduler import LLMScheduler
+
+
+@pytest.fixture
+def fake_llm() -> LLMScheduler:
+    """
+    Answer every router's LLM calls with the offline fake model, instantly.
+
+    The routers share one scheduler with limits far above what a test sends,
+    so calls are never queued or retried; it is returned for inspection.
+    """
+    scheduler = LLMScheduler(
+        requests_per_minute=6000,
+        tokens_per_minute=10**7,
+        max_concurrency=64,
+        max_retries=0,
+        backoff_seconds=0,
+        backoff_max_seconds=0,
+        queue_timeout_seconds=10,
+    )
+    with (
+        patch.object(settings, "llm_provider", "fake"),
+        patch.object(settings, "fake_llm_latency_ms", 0),
+        patch.object(settings, "fake_llm_tokens_per_second", 0),
+        patch.dict(llm._llms, clear=True),
+        patch("routers.adapt.llm_scheduler", scheduler),
+        patch("routers.quiz.llm_scheduler", scheduler),
+        patch("routers.flashcard.llm_scheduler", scheduler),
+        patch("routers.concept_graph.llm_scheduler", scheduler),
+    ):
+        yield scheduler
@@ -5,14 +5,29 @@ Uses pytest-asyncio + httpx.AsyncClient with ASGITransport so no live server
 is required. External calls (FAISS, LLM) are mocked throughout.
 """
 
+import asyncio
+import io
 import json
+import zipfile
+from dataclasses import asdict
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from httpx import ASGITransport, AsyncClient
 from langchain_core.documents import Document
 
+from config import settings
 from main import app
+from rag import loadtest
+from rag.chapter_store import ChapterStore, chapter_query, chapter_store
+from rag.ingest_jobs import IngestJobQueue
+from rag.jobs import JobStore
+from rag.loadtest import LoadTest
+from rag.response_cache import ResponseCache, response_cache
+from rag.scheduler import TokenBucket
+from routers import quiz as quiz_router
+from routers.ingest import _bulk_uploads
+from routers.precompute import PrecomputeJob, _claim_name
 from schemas import AdaptResponse, ConceptGraphResponse, FeedbackResponse, IngestResponse
 
 
@@ -59,6 +74,13 @@ def pedagogy_docs() -> list:
     ]
 
 
+@pytest.fixture(autouse=True)
+def query_embedding():
+    """Stand-in query vector so /adapt never loads the embedding model."""
+    with patch("routers.adapt.embed_query", return_value=[0.1] * 16) as embed:
+        yield embed
+
+
 # ---------------------------------------------------------------------------
 # POST /ingest
 # ---------------------------------------------------------------------------
@@ -82,6 +104,218 @@ async def test_ingest_pdf_success(sample_pdf_bytes):
     mock_ingest.assert_called_once()
 
 
+async def test_ingest_reupload_reported_as_duplicate(sample_pdf_bytes):
+    """An exact re-upload should index nothing and be flagged as a duplicate."""
+
+    def fake_ingest(file_bytes, filename, progress=None, **kwargs):
+        progress(stage="done", files_skipped=1)
+        return 0
+
+    with patch("routers.ingest.ingest_pdf", side_effect=fake_ingest):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/ingest",
+                files={"file": ("lesson.pdf", sample_pdf_bytes, "application/pdf")},
+            )
+
+    assert response.status_code == 200
+    data = IngestResponse(**response.json())
+    assert data.duplicate is True
+    assert data.chunks_indexed == 0
+
+
+async def test_ingest_job_reports_progress_until_done(sample_pdf_bytes):
+    """POST /ingest/jobs should return a job id that can be polled to completion."""
+
+    def fake_ingest(file_bytes, filename, progress=None, **kwargs):
+        progress(stage="embedding", pages_parsed=1, chunks_total=3)
+        progress(chunks_embedded=3)
+        return 3
+
+    with patch("routers.ingest.ingest_pdf", side_effect=fake_ingest):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            created = await client.post(
+                "/ingest/jobs",
+                files={"file": ("lesson.pdf", sample_pdf_bytes, "application/pdf")},
+            )
+            assert created.status_code == 202
+            job_id = created.json()["job_id"]
+
+            for _ in range(100):
+                job = (await client.get(f"/ingest/jobs/{job_id}")).json()
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                await asyncio.sleep(0.01)
+
+    assert job["status"] == "succeeded"
+    assert job["pages_parsed"] == 1
+    assert job["chunks_embedded"] == 3
+    assert job["chunks_indexed"] == 3
+
+
+async def test_ingest_job_status_is_answered_by_any_worker(sample_pdf_bytes, tmp_path):
+    """A job accepted by one worker process can be polled through another."""
+    accepting = IngestJobQueue(1, 10, JobStore(str(tmp_path), "ingest", 10))
+    polled = IngestJobQueue(1, 10, JobStore(str(tmp_path), "ingest", 10))
+
+    with patch("routers.ingest.ingest_pdf", return_value=3):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            with patch("routers.ingest.ingest_jobs", accepting):
+                created = await client.post(
+                    "/ingest/jobs",
+                    files={"file": ("lesson.pdf", sample_pdf_bytes, "application/pdf")},
+                )
+            job_id = created.json()["job_id"]
+            with patch("routers.ingest.ingest_jobs", polled):
+                for _ in range(100):
+                    job = (await client.get(f"/ingest/jobs/{job_id}")).json()
+                    if job["status"] in ("succeeded", "failed"):
+                        break
+                    await asyncio.sleep(0.01)
+
+    assert job["status"] == "succeeded"
+    assert job["chunks_indexed"] == 3
+
+
+async def test_ingest_job_unknown_id_returns_404():
+    """Polling a job id that was never issued should return HTTP 404."""
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        response = await client.get("/ingest/jobs/does-not-exist")
+    assert response.status_code == 404
+
+
+async def test_ingest_bulk_zip_applies_manifest_metadata(sample_pdf_bytes):
+    """POST /ingest/bulk should expand a zip and tag each PDF from its manifest."""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("science/ch1.pdf", sample_pdf_bytes)
+        zf.writestr("science/ch2.pdf", sample_pdf_bytes)
+        manifest = {"ch1.pdf": {"grade": 7, "subject": "Science", "chapter": "Nutrition in Plants"}}
+        zf.writestr("manifest.json", json.dumps(manifest))
+    captured = {}
+
+    def fake_bulk(uploads, progress=None):
+        captured["uploads"] = uploads
+        return {u.filename: 2 for u in uploads}
+
+    with patch("routers.ingest.ingest_pdfs", side_effect=fake_bulk):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            created = await client.post(
+                "/ingest/bulk",
+                data={"subject": "Science"},
+                files=[("files", ("science.zip", archive.getvalue(), "application/zip"))],
+            )
+            assert created.status_code == 202
+            job_id = created.json()["job_id"]
+            for _ in range(100):
+                job = (await client.get(f"/ingest/jobs/{job_id}")).json()
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                await asyncio.sleep(0.01)
+
+    assert job["status"] == "succeeded"
+    assert job["files_total"] == 2
+    assert job["chunks_indexed"] == 4
+    by_name = {u.filename: u for u in captured["uploads"]}
+    assert by_name["science/ch1.pdf"].chapter == "Nutrition in Plants"
+    assert by_name["science/ch1.pdf"].grade == 7
+    assert by_name["science/ch2.pdf"].chapter is None
+    assert by_name["science/ch2.pdf"].subject == "Science"
+
+
+async def test_ingest_bulk_keeps_same_named_pdfs_from_different_folders(sample_pdf_bytes):
+    """Two ch1.pdf files in different zip folders stay two uploads."""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("science/ch1.pdf", sample_pdf_bytes)
+        zf.writestr("maths/ch1.pdf", sample_pdf_bytes + b"\n")
+        zf.writestr(
+            "manifest.json",
+            json.dumps({"maths/ch1.pdf": {"subject": "Mathematics", "chapter": "Integers"}}),
+        )
+
+    uploads = _bulk_uploads(
+        [("books.zip", archive.getvalue())], {}, grade=7, subject="Science"
+    )
+
+    by_name = {u.filename: u for u in uploads}
+    assert set(by_name) == {"science/ch1.pdf", "maths/ch1.pdf"}
+    assert by_name["maths/ch1.pdf"].chapter == "Integers"
+    assert by_name["science/ch1.pdf"].subject == "Science"
+
+
+def test_ingest_bulk_manifest_string_grade_is_stored_as_int(sample_pdf_bytes):
+    """A manifest grade of "9" must match the retriever's grade=9 filter."""
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("ch1.pdf", sample_pdf_bytes)
+        zf.writestr(
+            "manifest.json",
+            json.dumps({"ch1.pdf": {"grade": "9", "subject": "Science", "chapter": "Motion"}}),
+        )
+
+    (upload,) = _bulk_uploads([("books.zip", archive.getvalue())], {}, grade=None, subject=None)
+
+    assert upload.grade == 9
+    assert (upload.subject, upload.chapter) == ("Science", "Motion")
+
+
+@pytest.mark.parametrize(
+    "manifest",
+    [
+        "5",
+        '["a.pdf"]',
+        '{"ch1.pdf": 5}',
+        '{"ch1.pdf": {"grade": "nine"}}',
+        '{"ch1.pdf": {"grade": 9.5}}',
+        '{"ch1.pdf": {"subject": 7}}',
+        '{"ch1.pdf": {"chapter": ["Motion"]}}',
+    ],
+)
+async def test_ingest_bulk_rejects_invalid_manifest(sample_pdf_bytes, manifest):
+    """A manifest that is not an object of valid metadata objects is a 400, not a 500."""
+    for in_zip in (False, True):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("ch1.pdf", sample_pdf_bytes)
+            if in_zip:
+                zf.writestr("manifest.json", manifest)
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/ingest/bulk",
+                data={} if in_zip else {"manifest": manifest},
+                files=[("files", ("books.zip", archive.getvalue(), "application/zip"))],
+            )
+        assert response.status_code == 400
+        assert "Invalid manifest" in response.json()["detail"]
+
+
+async def test_ingest_chapters_lists_ingested_chapters():
+    """GET /ingest/chapters should pass the grade filter through and list chapters."""
+    rows = [{"grade": 7, "subject": "Science", "chapter": "Nutrition in Plants", "chunks": 12}]
+    with patch("routers.ingest.list_chapters", return_value=rows) as mock_list:
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.get("/ingest/chapters", params={"grade": 7})
+
+    assert response.status_code == 200
+    assert response.json() == rows
+    mock_list.assert_called_once_with(grade=7, subject=None)
+
+
 async def test_ingest_non_pdf_rejected():
     """Non-PDF upload should return HTTP 400."""
     async with AsyncClient(
@@ -171,6 +405,259 @@ async def test_adapt_cognitive_profile_runs_two_chains(sample_docs, pedagogy_doc
     assert call_count == 2
 
 
+async def test_adapt_reports_context_budget_per_chain(pedagogy_docs):
+    """Each chain's prompt context should fit its own token budget and be reported."""
+    docs = [
+        Document(
+            page_content=" ".join(f"Current flows through circuit {i} when it is closed." for _ in range(8)),
+            metadata={"source": "physics.pdf", "page": i},
+        )
+        for i in range(4)
+    ]
+    prompts = []
+
+    async def recording_chain(prompt_template, llm, prompt_args):
+        prompts.append(prompt_args["context"])
+        return "Result"
+
+    with (
+        patch("routers.adapt.retrieve_with_feedback", return_value=docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+        patch("routers.adapt._run_chain", side_effect=recording_chain),
+        patch.object(settings, "context_token_budget", 400),
+        patch.object(settings, "context_chain_budgets", {"tts_script": 150}),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/adapt",
+                json={"query": "Explain circuits", "disability_profile": "cognitive"},
+            )
+
+    assert response.status_code == 200
+    context = response.json()["context"]
+    assert context["simplified"]["budget_tokens"] == 400
+    assert context["tts_script"]["budget_tokens"] == 150
+    for usage in context.values():
+        assert 0 < usage["used_tokens"] <= usage["budget_tokens"]
+    assert context["tts_script"]["used_tokens"] < context["simplified"]["used_tokens"]
+    assert len(prompts) == 2 and len(set(prompts)) == 2
+
+
+async def test_adapt_embeds_query_once_for_every_search(
+    sample_docs, pedagogy_docs, query_embedding
+):
+    """The content, feedback and pedagogy searches all reuse one query vector."""
+    with (
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs) as content,
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs) as pedagogy,
+        patch("routers.adapt._run_chain", new_callable=AsyncMock, return_value="OK"),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.post("/adapt", json={"query": "What is inertia?"})
+
+    assert response.status_code == 200
+    query_embedding.assert_called_once_with("What is inertia?")
+    assert content.call_args.kwargs["embedding"] == [0.1] * 16
+    assert pedagogy.call_args.kwargs["embedding"] == [0.1] * 16
+
+
+async def test_adapt_serves_repeat_request_from_response_cache(sample_docs, pedagogy_docs):
+    """A repeated request for the same chapter/profile should not call the LLM again."""
+    call_count = 0
+
+    async def counting_chain(*args, **kwargs):
+        nonlocal call_count
+        call_count += 1
+        return "Simplified text"
+
+    cache = ResponseCache(enabled=True, max_entries=8, ttl_seconds=60, similarity=1.0)
+    body = {
+        "query": "Explain gravity",
+        "disability_profile": "dyslexia",
+        "grade": 9,
+        "subject": "Science",
+        "chapter": "Gravitation",
+    }
+    with (
+        patch("routers.adapt.response_cache", cache),
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+        patch("routers.adapt._run_chain", side_effect=counting_chain),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            first = await client.post("/adapt", json=body)
+            second = await client.post("/adapt", json=body)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert call_count == 1
+
+
+async def test_adapt_coalesces_identical_concurrent_requests(sample_docs, pedagogy_docs):
+    """A burst of identical requests should share one set of LLM calls."""
+    call_count = 0
+
+    async def slow_chain(*args, **kwargs):
+        nonlocal call_count
+        call_count += 1
+        await asyncio.sleep(0.05)
+        return "Simplified text"
+
+    body = {"query": "Explain gravity", "disability_profile": "dyslexia", "chapter": "Gravitation"}
+    with (
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+        patch("routers.adapt._run_chain", side_effect=slow_chain),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            responses = await asyncio.gather(
+                *(client.post("/adapt", json={**body, "query": query})
+                  for query in ["Explain gravity", "explain  GRAVITY", "Explain gravity"])
+            )
+            different = await client.post("/adapt", json={**body, "chapter": "Motion"})
+
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert all(r.json()["simplified"] == "Simplified text" for r in responses)
+    assert different.status_code == 200
+    assert call_count == 2
+
+
+async def test_precompute_serves_chapter_for_every_profile(sample_docs, pedagogy_docs):
+    """After a precompute, the learn pages' chapter requests need no LLM call."""
+    store = ChapterStore()
+    chain_calls = 0
+
+    async def counting_chain(*args, **kwargs):
+        nonlocal chain_calls
+        chain_calls += 1
+        return "Simplified text"
+
+    quiz = {"questions": [{"question": "Q?", "options": ["A", "B"], "answer": "A"}]}
+    cards = {"flashcards": [{"front": "F", "back": "B"}]}
+    chapter = {"grade": 9, "subject": "Science", "chapter": "Gravitation"}
+    with (
+        patch("routers.adapt.chapter_store", store),
+        patch("routers.quiz.chapter_store", store),
+        patch("routers.precompute.chapter_store", store),
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+        patch("routers.adapt._run_chain", side_effect=counting_chain),
+        patch("routers.precompute.build_quiz", AsyncMock(return_value=quiz)),
+        patch("routers.precompute.build_flashcards", AsyncMock(return_value=cards)),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            started = await client.post("/precompute", json=chapter)
+            job = started.json()
+            while job["status"] in ("queued", "running"):
+                await asyncio.sleep(0.01)
+                job = (await client.get(f"/precompute/jobs/{job['job_id']}")).json()
+
+            calls_after_precompute = chain_calls
+            learn = await client.post(
+                "/adapt",
+                json={
+                    **chapter,
+                    "query": chapter_query("dyslexia", 9, "Science", "Gravitation"),
+                    "disability_profile": "dyslexia",
+                },
+            )
+            served_quiz = await client.post(
+                "/quiz/generate", json={**chapter, "content": "Simplified text"}
+            )
+            listed = await client.get("/precompute/chapters")
+
+    assert started.status_code == 202
+    assert job["status"] == "succeeded"
+    assert job["units_done"] == job["units_total"]
+    assert learn.status_code == 200
+    assert learn.json()["simplified"] == "Simplified text"
+    assert served_quiz.json() == quiz
+    assert chain_calls == calls_after_precompute
+    [row] = listed.json()
+    assert row["quiz"] and row["flashcards"] and "dyslexia" in row["profiles"]
+
+
+async def test_precompute_running_in_another_worker_is_returned(tmp_path):
+    """A chapter claimed by another worker is not precomputed twice; its job is shared."""
+    store = JobStore(str(tmp_path), "precompute", 10)
+    chapter = {"grade": 9, "subject": "Science", "chapter": "Gravitation"}
+    elsewhere = PrecomputeJob(job_id="a" * 32, status="running", created_at=1.0, **chapter)
+    store.save(asdict(elsewhere))
+    with (
+        patch("routers.precompute._store", store),
+        patch.dict("routers.precompute._jobs", clear=True),
+        patch("routers.precompute._run", AsyncMock()) as run,
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            with store.claim(_claim_name(9, "Science", "Gravitation")):
+                joined = await client.post("/precompute", json=chapter)
+                polled = await client.get(f"/precompute/jobs/{elsewhere.job_id}")
+            # The other worker stopped without finishing: its claim is gone.
+            started = await client.post("/precompute", json=chapter)
+            abandoned = await client.get(f"/precompute/jobs/{elsewhere.job_id}")
+
+    assert joined.json()["job_id"] == polled.json()["job_id"] == elsewhere.job_id
+    assert polled.json()["status"] == "running"
+    assert started.json()["job_id"] != elsewhere.job_id
+    assert abandoned.json()["status"] == "failed"
+    run.assert_awaited_once()
+
+
+async def test_precompute_unknown_job_returns_404():
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        response = await client.get("/precompute/jobs/does-not-exist")
+    assert response.status_code == 404
+
+
+async def test_adapt_stream_emits_tagged_tokens_then_sources(sample_docs, pedagogy_docs):
+    """POST /adapt/stream should emit per-chain token events and a final done event."""
+
+    async def fake_stream(prompt_template, llm, prompt_args):
+        for piece in ("Hello ", "world"):
+            yield piece
+
+    with (
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+        patch("routers.adapt._stream_chain", side_effect=fake_stream),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/adapt/stream",
+                json={"query": "Explain circuits", "disability_profile": "cognitive"},
+            )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in response.text.strip().split("\n\n")
+    ]
+    tokens = [data for name, data in events if name == "token"]
+    assert {t["chain"] for t in tokens} == {"simplified", "tts_script"}
+    assert "".join(t["text"] for t in tokens if t["chain"] == "tts_script") == "Hello world"
+    name, done = events[-1]
+    assert name == "done"
+    assert done["sources"] == ["biology.pdf"]
+    assert set(done["context"]) == {"simplified", "tts_script"}
+
+
 async def test_adapt_missing_query_returns_422():
     """POST /adapt with an empty body should return HTTP 422."""
     async with AsyncClient(
@@ -219,6 +706,40 @@ async def test_feedback_low_rating_is_indexed():
     mock_upsert.assert_called_once()
 
 
+async def test_feedback_low_rating_drops_precomputed_chapter_answer(tmp_path):
+    """A poorly rated precomputed answer is regenerated live on the next /adapt."""
+    store = ChapterStore(str(tmp_path / "chapters.json"))
+    query = chapter_query("adhd", 9, "Science", "Gravitation")
+    default_query = chapter_query(None, 9, "Science", "Gravitation")
+    store.put_adapt(9, "Science", "Gravitation", "adhd", query, {"simplified": "stored"})
+    store.put_adapt(9, "Science", "Gravitation", None, default_query, {"simplified": "kept"})
+    store.put_artifact("quiz", 9, "Science", "Gravitation", {"questions": []})
+
+    with (
+        patch("routers.feedback.upsert_feedback"),
+        patch("routers.feedback.chapter_store", store),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/feedback",
+                json={
+                    "query": query,
+                    "adapted_content": "stored",
+                    "rating": 1,
+                    "disability_profile": "adhd",
+                },
+            )
+
+    assert response.status_code == 200
+    assert store.get_adapt(9, "Science", "Gravitation", "adhd", query) is None
+    assert store.get_adapt(9, "Science", "Gravitation", None, default_query) == {
+        "simplified": "kept"
+    }
+    assert store.get_artifact("quiz", 9, "Science", "Gravitation") == {"questions": []}
+
+
 async def test_feedback_high_rating_not_indexed():
     """Rating > 3 should NOT call upsert and return indexed=False."""
     with patch("routers.feedback.upsert_feedback") as mock_upsert:
@@ -277,12 +798,10 @@ async def test_concept_graph_returns_valid_structure():
     )
     mock_result = MagicMock()
     mock_result.content = mock_json
+    mock_llm = MagicMock()
+    mock_llm.ainvoke = AsyncMock(return_value=mock_result)
 
-    with patch(
-        "routers.concept_graph.ChatGoogleGenerativeAI.ainvoke",
-        new_callable=AsyncMock,
-        return_value=mock_result,
-    ):
+    with patch("routers.concept_graph._get_llm", return_value=mock_llm):
         async with AsyncClient(
             transport=ASGITransport(app=app), base_url="http://test"
         ) as client:
@@ -304,3 +823,175 @@ async def test_concept_graph_missing_content_returns_422():
     ) as client:
         response = await client.post("/concept-graph", json={})
     assert response.status_code == 422
+
+
+# ---------------------------------------------------------------------------
+# Load testing against the offline LLM
+# ---------------------------------------------------------------------------
+
+async def test_load_test_replays_learn_flow_against_fake_llm(
+    sample_docs, pedagogy_docs, tmp_path, fake_llm
+):
+    """Simulated students run adapt -> quiz -> submit -> flashcards with no provider calls."""
+    with (
+        patch("routers.quiz.RESULTS_FILE", tmp_path / "quiz_results.json"),
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            report = await LoadTest(
+                client, [(9, "Science", "Gravitation")], students=4, iterations=2
+            ).run()
+
+    assert report["flows_completed"] == 8 and report["flows_failed"] == 0
+    endpoints = report["endpoints"]
+    assert set(endpoints) == {"/adapt", "/quiz/generate", "/quiz/submit", "/flashcard/generate"}
+    for row in endpoints.values():
+        assert row["requests"] == 8 and row["errors"] == 0
+        assert row["p50_ms"] <= row["p95_ms"] <= row["p99_ms"]
+    assert len(json.loads((tmp_path / "quiz_results.json").read_text())) == 8
+
+
+async def test_in_process_load_test_keeps_its_output_out_of_app_files(
+    sample_docs, pedagogy_docs, tmp_path, fake_llm
+):
+    """--in-process writes scores, cached fake answers and traces to a scratch directory."""
+    results = tmp_path / "quiz_results.json"
+    results.write_text("[]")
+    cache_path = str(tmp_path / "response_cache.json")
+    chapters_path = str(tmp_path / "chapter_store.json")
+    traces_path = str(tmp_path / "traces.jsonl")
+    args = ["--in-process", "--students", "2", "--chapter", "9:Science:Gravitation"]
+    with (
+        patch("routers.quiz.RESULTS_FILE", results),
+        patch.multiple(response_cache, enabled=True, similarity=1.0, path=cache_path),
+        patch.object(chapter_store, "path", chapters_path),
+        patch.object(settings, "tracing_enabled", True),
+        patch.object(settings, "trace_path", traces_path),
+        patch.dict(response_cache._entries, clear=True),
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+    ):
+        report = await loadtest._run(loadtest._build_parser().parse_args(args))
+        assert quiz_router.RESULTS_FILE == results
+        assert response_cache.path == cache_path and response_cache._entries
+        assert chapter_store.path == chapters_path
+        assert settings.trace_path == traces_path
+
+    assert report["flows_completed"] == 2 and report["flows_failed"] == 0
+    assert report["endpoints"]["/quiz/submit"]["errors"] == 0
+    assert json.loads(results.read_text()) == []
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["quiz_results.json"]
+
+
+async def test_saturated_llm_quota_returns_503_with_retry_after(
+    sample_docs, pedagogy_docs, fake_llm
+):
+    """Calls the scheduler cannot admit in time are a 503 to retry, not a 500."""
+    fake_llm.queue_timeout_seconds = 0
+    fake_llm.requests = TokenBucket(per_minute=1)
+    fake_llm.requests._level = 0  # quota spent until the next request refills in 60s
+    body = {"query": "Explain tides", "disability_profile": "adhd"}
+    with (
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            adapted = await client.post("/adapt", json=body)
+            streamed = await client.post("/adapt/stream", json=body)
+            quiz = await client.post(
+                "/quiz/generate",
+                json={"content": "Tides", "grade": 9, "subject": "Science", "chapter": "Gravitation"},
+            )
+
+    for response in (adapted, quiz):
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "60"
+    name, data = streamed.text.strip().split("\n\n")[-1].split("\n")
+    assert name == "event: error"
+    error = json.loads(data[len("data: "):])
+    assert (error["status"], error["retry_after"]) == (503, 60)
+
+
+# ---------------------------------------------------------------------------
+# GET /metrics and Server-Timing
+# ---------------------------------------------------------------------------
+
+async def test_adapt_reports_stage_timings_and_metrics(sample_docs, pedagogy_docs, fake_llm):
+    """An adapt request shows up per stage in Server-Timing and in /metrics."""
+    with (
+        patch.object(settings, "server_timing_enabled", True),
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/adapt", json={"query": "Explain gravity", "disability_profile": "dyslexia"}
+            )
+            metrics = await client.get("/metrics")
+
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    for name in ("context_packing", "llm_queue", "llm_simplified", "total"):
+        assert f"{name};dur=" in timing
+
+    assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = metrics.text
+    assert 'eureka_stage_seconds_bucket{stage="context_packing",le="+Inf"}' in body
+    assert 'eureka_llm_call_seconds_count{chain="simplified"}' in body
+    assert 'eureka_llm_tokens_total{chain="simplified",direction="output"}' in body
+    assert 'eureka_http_request_seconds_count{method="POST",route="/adapt",status="200"}' in body
+
+
+async def test_traces_follow_adapt_through_chains_and_list_slowest(
+    sample_docs, pedagogy_docs, tmp_path, fake_llm
+):
+    """Each chain's queue wait and upstream call nest under it in the exported trace."""
+    with (
+        patch.object(settings, "tracing_enabled", True),
+        patch.object(settings, "trace_path", str(tmp_path / "traces.jsonl")),
+        patch("routers.adapt.retrieve_with_feedback", return_value=sample_docs),
+        patch("routers.adapt.retrieve_pedagogy", return_value=pedagogy_docs),
+    ):
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            adapted = await client.post(
+                "/adapt", json={"query": "Explain gravity", "disability_profile": "cognitive"}
+            )
+            streamed = await client.post(
+                "/adapt/stream", json={"query": "Explain tides", "disability_profile": "adhd"}
+            )
+            slowest = (await client.get("/traces")).json()
+            trace = (await client.get(f"/traces/{adapted.headers['x-trace-id']}")).json()
+            stream_trace = (await client.get(f"/traces/{streamed.headers['x-trace-id']}")).json()
+            missing = await client.get("/traces/unknown")
+
+    assert adapted.status_code == 200 and streamed.status_code == 200
+    assert {row["name"] for row in slowest} == {"POST /adapt", "POST /adapt/stream"}
+    assert slowest[0]["duration_ms"] >= slowest[1]["duration_ms"]
+    assert missing.status_code == 404
+
+    spans = trace["spans"]
+    root = spans[0]
+    assert root["parent_id"] is None and root["attributes"]["status"] == 200
+    by_id = {s["span_id"]: s for s in spans}
+    names = [s["name"] for s in spans]
+    assert {"retrieval", "context_packing"} <= set(names)
+    chains = [s for s in spans if s["name"] == "chain"]
+    assert sorted(s["attributes"]["chain"] for s in chains) == ["simplified", "tts_script"]
+    assert all(s["parent_id"] == root["span_id"] for s in chains)
+    for name in ("llm_queue", "llm_upstream"):
+        children = [s for s in spans if s["name"] == name]
+        assert len(children) == 2
+        assert {by_id[s["parent_id"]]["name"] for s in children} == {"chain"}
+
+    # The stream's trace stays open until its last token, so the upstream call is in it.
+    upstream = [s for s in stream_trace["spans"] if s["name"] == "llm_upstream"]
+    assert [s["attributes"]["chain"] for s in upstream] == ["adhd_simplified"]
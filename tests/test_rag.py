@@ -0,0 +1,902 @@
+"""
+Unit tests for the RAG pipeline building blocks.
+
+Embedding models are replaced with deterministic fakes so no
+sentence-transformers weights are downloaded.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from config import settings
+from rag import embeddings, llm
+from rag.bench import SyntheticCorpus, compare, synthetic_pdf
+from rag.chapter_store import ChapterStore, chapter_query
+from rag.context import count_tokens, pack_context
+from rag.dedup import HashRegistry
+from rag.docstore import SqliteDocstore
+from rag.fake_llm import FakeChatModel
+from rag.filelock import file_lock
+from rag.index_manager import IndexManager
+from rag.index_types import index_type_of, recall_report
+from rag.ingestor import PdfUpload, _index_new_chunks, _parse, _split, ingest_pdf
+from rag.metrics import Counter, Histogram, collect_timings, server_timing_header, stage
+from rag.pedagogy_store import retrieve_pedagogy
+from rag.rerank import Reranker
+from rag.response_cache import ResponseCache
+from rag.retriever import retrieve
+from rag.scheduler import LLMScheduler, QueueTimeout, retry_after
+from rag.segments import COMPACT_LOCK, SegmentedIndex, append_segment, compact, read_manifest
+from rag.singleflight import SingleFlight
+from rag.tracing import Trace, TraceExporter, span
+from schemas import ConceptGraphResponse
+
+FAKE_EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+
+# ---------------------------------------------------------------------------
+# Embedding and LLM registries
+# ---------------------------------------------------------------------------
+
+def test_get_embeddings_builds_model_once():
+    """Repeated calls should hand back the same model instance."""
+    with (
+        patch.dict(embeddings._models, clear=True),
+        patch("rag.embeddings.HuggingFaceEmbeddings", return_value=MagicMock()) as mock_cls,
+    ):
+        first = embeddings.get_embeddings()
+        second = embeddings.get_embeddings()
+
+    assert first is second
+    mock_cls.assert_called_once()
+
+
+def test_get_llm_shares_models_and_http_pool():
+    """One model per (model, temperature); every model sends through the same HTTP clients."""
+    with patch.dict(llm._llms, clear=True), patch.dict(llm._clients, clear=True):
+        first = llm.get_llm(temperature=0.3)
+        second = llm.get_llm(temperature=0.3)
+        structured = llm.get_llm(temperature=0.1)
+
+        assert first is second
+        assert structured is not first
+        assert first.client._client._client is structured.client._client._client
+        assert first.async_client._client._client is llm._clients["async"]
+
+
+async def test_fake_llm_answers_each_router_format_and_streams_the_same_text():
+    """The offline model returns parseable quiz, flashcard and graph JSON, or prose."""
+    fake = FakeChatModel(latency_ms=0, tokens_per_second=0)
+    quiz = await fake.ainvoke('Content:\nGravity pulls mass.\n{"questions":[...]}')
+    cards = await fake.ainvoke('Content:\nGravity pulls mass.\n{"flashcards":[...]}')
+    graph = await fake.ainvoke('Return {"nodes": [], "edges": []}\nContent:\nGravity pulls mass.')
+    prose = await fake.ainvoke("Explain gravity to a Grade 9 student.")
+    streamed = "".join([chunk.content async for chunk in fake.astream("Explain gravity.")])
+
+    assert len(json.loads(quiz.content)["questions"]) == 5
+    assert len(json.loads(cards.content)["flashcards"]) == 8
+    assert ConceptGraphResponse(**json.loads(graph.content)).nodes
+    assert "gravity" in prose.content and prose.usage_metadata["total_tokens"] > 0
+    assert streamed == fake.invoke("Explain gravity.").content
+
+
+def test_embed_query_reuses_vector_for_normalized_query():
+    """Queries differing only in case/whitespace should be embedded once, as first given."""
+    model = MagicMock()
+    model.embed_query.return_value = [0.1, 0.2]
+    with (
+        patch.object(embeddings, "query_cache", embeddings.QueryVectorCache(8)),
+        patch("rag.embeddings.get_embeddings", return_value=model),
+    ):
+        first = embeddings.embed_query("Explain  Gravity")
+        second = embeddings.embed_query("explain gravity ")
+
+    assert first == second == [0.1, 0.2]
+    model.embed_query.assert_called_once_with("Explain  Gravity")
+
+
+def test_query_vector_cache_evicts_least_recently_used():
+    """The cache should never grow past max_size."""
+    cache = embeddings.QueryVectorCache(2)
+    cache.put(("m", "a"), [1.0])
+    cache.put(("m", "b"), [2.0])
+    cache.get(("m", "a"))
+    cache.put(("m", "c"), [3.0])
+
+    assert cache.get(("m", "b")) is None
+    assert cache.get(("m", "a")) == [1.0]
+    assert cache.stats()["size"] == 2
+
+
+# ---------------------------------------------------------------------------
+# Resident index manager
+# ---------------------------------------------------------------------------
+
+def _store(texts, **metadata):
+    return FAISS.from_texts(texts, FAKE_EMBEDDINGS, metadatas=[dict(metadata) for _ in texts])
+
+
+def test_index_manager_keeps_index_resident_until_disk_changes(tmp_path):
+    """The same view is returned until a segment is appended; old segments are reused."""
+    path = str(tmp_path / "content")
+    append_segment(path, _store(["cells", "atoms"]))
+    manager = IndexManager({"content": path})
+
+    with patch("rag.index_manager.get_embeddings", return_value=FAKE_EMBEDDINGS):
+        first = manager.get("content")
+        assert manager.get("content") is first
+
+        append_segment(path, _store(["forces"]))
+        reloaded = manager.get("content")
+
+    assert reloaded is not first
+    assert reloaded.ntotal == 3
+    assert reloaded.parts[0] is first.parts[0]
+    stats = manager.stats()[0]
+    assert stats["generation"] == 2
+    assert stats["segments"] == 2
+    assert stats["vectors"] == 3
+
+
+def test_index_manager_reads_legacy_single_index_layout(tmp_path):
+    """A store saved directly with save_local should still load as a base."""
+    path = str(tmp_path / "content")
+    _store(["cells", "atoms"]).save_local(path)
+    manager = IndexManager({"content": path})
+
+    with patch("rag.index_manager.get_embeddings", return_value=FAKE_EMBEDDINGS):
+        assert manager.get("content").ntotal == 2
+
+
+@pytest.mark.parametrize("mode, built", [("hybrid", True), ("vector", False)])
+def test_legacy_segment_lexicon_is_built_at_load_only_for_hybrid(tmp_path, mode, built):
+    """Hybrid stores build a legacy segment's BM25 index on load, never on a query."""
+    path = str(tmp_path / "content")
+    _store(["cells", "atoms"]).save_local(path)
+    manager = IndexManager({"content": path})
+
+    with (
+        patch.object(settings, "retrieval_mode", mode),
+        patch("rag.index_manager.get_embeddings", return_value=FAKE_EMBEDDINGS),
+    ):
+        [part] = manager.get("content").parts
+
+    assert (part._lexicon is not None) is built
+
+
+def test_index_manager_returns_none_for_missing_index(tmp_path):
+    """An index that was never saved should report as absent, not raise."""
+    manager = IndexManager({"feedback": str(tmp_path / "missing")})
+    assert manager.get("feedback") is None
+    assert manager.stats()[0]["loaded"] is False
+
+
+def test_retrieve_pedagogy_returns_empty_for_store_directory_without_index(tmp_path):
+    """An empty pedagogy directory is not rebuilt over, and must not fail the search."""
+    path = tmp_path / "pedagogy"
+    path.mkdir()
+    with (
+        patch.object(settings, "faiss_pedagogy_path", str(path)),
+        patch("rag.pedagogy_store.index_manager", IndexManager({"pedagogy": str(path)})),
+    ):
+        assert retrieve_pedagogy("gravity", embedding=[0.0] * 16) == []
+
+
+# ---------------------------------------------------------------------------
+# Semantic response cache
+# ---------------------------------------------------------------------------
+
+SCOPE = ("dyslexia", 7, "Science", "Nutrition in Plants", "simplified")
+
+
+def _vectors(mapping):
+    return lambda text: mapping[text]
+
+
+def test_response_cache_matches_near_duplicate_query():
+    """A query above the similarity threshold should reuse the cached answer."""
+    cache = ResponseCache(
+        enabled=True, max_entries=8, ttl_seconds=60, similarity=0.9,
+        embed=_vectors(
+            {
+                "explain photosynthesis": [1.0, 0.0],
+                "explain photosynthesis please": [0.99, 0.05],
+                "explain gravity": [0.0, 1.0],
+            }
+        ),
+    )
+    cache.store(SCOPE, "Explain photosynthesis", "Plants make food.", ["bio.pdf"])
+
+    hit = cache.lookup(SCOPE, "explain photosynthesis please")
+    assert hit is not None and hit.text == "Plants make food."
+    assert cache.lookup(SCOPE, "explain gravity") is None
+    assert cache.lookup(SCOPE[:4] + ("tts_script",), "explain photosynthesis") is None
+
+
+def test_response_cache_expires_and_invalidates_by_chapter():
+    """Entries vanish after the TTL and when their chapter is invalidated."""
+    cache = ResponseCache(enabled=True, max_entries=8, ttl_seconds=60, similarity=1.0)
+    cache.store(SCOPE, "q", "answer", [])
+    assert cache.invalidate(chapter="Nutrition in Plants") == 1
+    assert cache.lookup(SCOPE, "q") is None
+
+    cache.store(SCOPE, "q", "answer", [])
+    with patch("rag.response_cache.time.time", return_value=time.time() + 120):
+        assert cache.lookup(SCOPE, "q") is None
+
+
+def test_response_cache_chapter_invalidation_drops_unfiltered_entries():
+    """New content for a chapter also stales answers that retrieved across chapters."""
+    cache = ResponseCache(enabled=True, max_entries=8, ttl_seconds=60, similarity=1.0)
+    unfiltered = ("adhd", 7, "Science", None, "simplified")
+    unscoped = ("adhd", None, None, None, "simplified")
+    other_subject = ("adhd", 7, "Maths", None, "simplified")
+    other_chapter = SCOPE[:3] + ("Respiration", "simplified")
+    for scope in (SCOPE, unfiltered, unscoped, other_subject, other_chapter):
+        cache.store(scope, "q", "answer", [])
+
+    assert cache.invalidate(grade=7, subject="Science", chapter="Nutrition in Plants") == 3
+    assert cache.lookup(other_subject, "q") is not None
+    assert cache.lookup(other_chapter, "q") is not None
+
+
+def test_response_cache_persists_to_disk(tmp_path):
+    """A cache with a backing file should reload its entries on construction."""
+    path = str(tmp_path / "cache.json")
+    ResponseCache(enabled=True, max_entries=8, ttl_seconds=60, similarity=1.0, path=path).store(
+        SCOPE, "q", "answer", ["bio.pdf"]
+    )
+    reloaded = ResponseCache(enabled=True, max_entries=8, ttl_seconds=60, similarity=1.0, path=path)
+    hit = reloaded.lookup(SCOPE, "q")
+    assert hit is not None and hit.sources == ["bio.pdf"]
+
+
+async def test_response_cache_batches_writes_off_the_event_loop(tmp_path):
+    """Stores on the event loop are written once, after the persist delay."""
+    path = tmp_path / "cache.json"
+    cache = ResponseCache(
+        enabled=True, max_entries=8, ttl_seconds=60, similarity=1.0,
+        path=str(path), persist_seconds=0.05,
+    )
+    with patch("rag.response_cache.os.replace", wraps=os.replace) as replace:
+        for n in range(5):
+            cache.store(SCOPE, f"q{n}", "answer", [])
+        assert not path.exists()
+        await asyncio.sleep(0.3)
+
+    assert replace.call_count == 1
+    assert len(json.loads(path.read_text())) == 5
+    assert list(tmp_path.iterdir()) == [path]
+
+
+# ---------------------------------------------------------------------------
+# Segmented store
+# ---------------------------------------------------------------------------
+
+def test_segmented_search_merges_hits_across_segments(tmp_path):
+    """Searches should return the global top-k across base and delta segments."""
+    path = str(tmp_path / "content")
+    append_segment(path, _store(["cells", "atoms"]))
+    append_segment(path, _store(["forces", "energy"]))
+    index = SegmentedIndex.load(path, read_manifest(path), FAKE_EMBEDDINGS)
+
+    hits = index.similarity_search_by_vector(FAKE_EMBEDDINGS.embed_query("energy"), k=1)
+    assert [doc.page_content for doc in hits] == ["energy"]
+    assert index.ntotal == 4
+
+
+def test_segments_load_sqlite_docstore_without_pickle(tmp_path):
+    """New segments should be served from the SQLite docstore, reading only the hits."""
+    path = str(tmp_path / "content")
+    name = append_segment(path, _store(["cells", "atoms"], chapter="Cells"))
+    assert "index.pkl" not in os.listdir(os.path.join(path, name))
+    index = SegmentedIndex.load(path, read_manifest(path), FAKE_EMBEDDINGS)
+    store = index.parts[0].store
+
+    assert isinstance(store.docstore, SqliteDocstore)
+    [hit] = index.similarity_search_by_vector(FAKE_EMBEDDINGS.embed_query("atoms"), k=1)
+    assert hit.page_content == "atoms"
+    assert hit.metadata == {"chapter": "Cells"}
+    assert hit.id is not None and hit.id != 1
+
+
+def test_concurrent_appends_and_compaction_lose_no_vectors(tmp_path):
+    """Writers racing a compaction should all land, and a held compaction lock is respected."""
+    path = str(tmp_path / "feedback")
+    append_segment(path, _store(["seed"]))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for i in range(12):
+            pool.submit(append_segment, path, _store([f"rating {i}"]))
+            if i % 4 == 0:
+                pool.submit(compact, path, FAKE_EMBEDDINGS)
+    compact(path, FAKE_EMBEDDINGS)
+
+    index = SegmentedIndex.load(path, read_manifest(path), FAKE_EMBEDDINGS)
+    assert index.ntotal == 13
+    assert read_manifest(path)["generation"] > 13
+    append_segment(path, _store(["late"]))
+    with file_lock(os.path.join(path, COMPACT_LOCK)):
+        assert compact(path, FAKE_EMBEDDINGS) is False
+
+
+def test_migrating_pickled_store_writes_sqlite_docstore(tmp_path):
+    """Compacting a legacy pickled store should move its documents into SQLite."""
+    path = str(tmp_path / "content")
+    store = _store(["cells", "tissues"], grade=9, subject="Science", chapter="Cells")
+    store.merge_from(_store(["motion"], grade=9, subject="Science", chapter="Motion"))
+    store.save_local(path)
+
+    assert compact(path, FAKE_EMBEDDINGS, min_segments=0) is True
+    assert "index.pkl" not in os.listdir(path)
+    index = SegmentedIndex.load(path, read_manifest(path), FAKE_EMBEDDINGS)
+    assert isinstance(index.parts[0].store.docstore, SqliteDocstore)
+    assert index.curriculum(grade=9) == {(9, "Science", "Cells"): 2, (9, "Science", "Motion"): 1}
+    assert index.curriculum(grade=10) == {}
+
+
+def test_compact_merges_segments_into_new_base(tmp_path):
+    """Compaction should fold every segment into one base without losing vectors."""
+    path = str(tmp_path / "feedback")
+    for text in ("a", "b", "c"):
+        append_segment(path, _store([text]))
+
+    assert compact(path, FAKE_EMBEDDINGS, min_segments=2) is True
+    manifest = read_manifest(path)
+    assert manifest["segments"] == []
+    assert manifest["base"] == "base-00000004"
+    assert sorted(n for n in os.listdir(path) if not n.startswith(".")) == [
+        "base-00000004",
+        "manifest.json",
+    ]
+    index = SegmentedIndex.load(path, manifest, FAKE_EMBEDDINGS)
+    assert index.ntotal == 3
+
+
+def test_chapter_filter_returns_exact_top_k_when_other_chapters_dominate(tmp_path):
+    """A chapter filter should find its chunks even when 20+ closer chunks belong elsewhere."""
+    path = str(tmp_path / "content")
+    store = _store(["energy"] * 30, chapter="Motion")
+    store.merge_from(_store(["cells", "tissues"], chapter="Cells"))
+    append_segment(path, store)
+    append_segment(path, _store(["organs"], chapter="Cells", grade=9))
+    index = SegmentedIndex.load(path, read_manifest(path), FAKE_EMBEDDINGS)
+    query = FAKE_EMBEDDINGS.embed_query("energy")
+
+    hits = index.similarity_search_by_vector(query, k=5, filter={"chapter": "Cells"})
+    assert sorted(doc.page_content for doc in hits) == ["cells", "organs", "tissues"]
+
+    hits = index.similarity_search_by_vector(query, k=5, filter={"chapter": "Cells", "grade": 9})
+    assert [doc.page_content for doc in hits] == ["organs"]
+
+
+def test_compact_trains_configured_index_type_and_keeps_partitions(tmp_path):
+    """A base past the training threshold should become IVF and still filter by chapter."""
+    path = str(tmp_path / "content")
+    append_segment(path, _store([f"motion {i}" for i in range(120)], chapter="Motion"))
+    append_segment(path, _store([f"cells {i}" for i in range(40)], chapter="Cells"))
+
+    with patch("rag.index_types.settings.index_min_train_vectors", 100):
+        assert compact(path, FAKE_EMBEDDINGS, index_type="ivf_flat") is True
+        append_segment(path, _store(["cells extra"], chapter="Cells"))
+        assert compact(path, FAKE_EMBEDDINGS, index_type="ivf_flat") is True
+
+    index = SegmentedIndex.load(path, read_manifest(path), FAKE_EMBEDDINGS)
+    assert index_type_of(index.parts[0].store.index) == "ivf_flat"
+    assert index.ntotal == 161
+    query = FAKE_EMBEDDINGS.embed_query("cells extra")
+    hits = index.similarity_search_by_vector(query, k=3, filter={"chapter": "Cells"})
+    assert hits[0].page_content == "cells extra"
+    assert {doc.metadata["chapter"] for doc in hits} == {"Cells"}
+
+
+def test_recall_report_measures_each_index_type_against_exact_search():
+    """The report should give exact search full recall and cover each trainable type."""
+    vectors = np.random.default_rng(0).normal(size=(400, 16)).astype(np.float32)
+    with patch("rag.index_types.settings.index_min_train_vectors", 100):
+        rows = recall_report(vectors, vectors[:20], k=5, sweep=(1, 64))
+
+    assert rows[0] == {**rows[0], "index_type": "flat", "recall_at_k": 1.0}
+    assert {row["index_type"] for row in rows} == {"flat", "ivf_flat", "ivf_pq", "hnsw"}
+    assert all(0.0 <= row["recall_at_k"] <= 1.0 and row["memory_bytes"] > 0 for row in rows)
+
+
+# ---------------------------------------------------------------------------
+# Ingestion deduplication
+# ---------------------------------------------------------------------------
+
+def _chunks(*texts, chapter="Motion"):
+    return [
+        Document(page_content=text, metadata={"source": "physics.pdf", "chapter": chapter})
+        for text in texts
+    ]
+
+
+def test_ingest_skips_exact_reupload_and_duplicate_chunks(tmp_path):
+    """Re-uploads should not be parsed again and repeated chunks should not be embedded."""
+    registry = HashRegistry(str(tmp_path / "hashes.json"))
+    indexed = []
+    progress = MagicMock()
+    with (
+        patch("rag.ingestor.ingest_registry", registry),
+        patch("rag.ingestor._parse_and_split", return_value=(1, _chunks("speed", "speed  ", "force"))),
+        patch(
+            "rag.ingestor._index_chunks",
+            side_effect=lambda chunks, digests, _: indexed.extend(chunks) or chunks,
+        ),
+    ):
+        assert ingest_pdf(b"%PDF-1", "physics.pdf", chapter="Motion", progress=progress) == 2
+        assert ingest_pdf(b"%PDF-1", "physics.pdf", chapter="Motion", progress=progress) == 0
+        progress.assert_called_with(stage="done", files_skipped=1)
+        assert ingest_pdf(b"%PDF-2", "physics.pdf", chapter="Motion") == 0
+
+    assert [chunk.page_content for chunk in indexed] == ["speed", "force"]
+    assert HashRegistry(registry.path).stats() == {"files": 2, "chunks": 2}
+
+
+def test_hash_registry_releases_chunks_of_failed_ingestion(tmp_path):
+    """Chunks whose index write failed should be accepted by the next ingestion."""
+    registry = HashRegistry(str(tmp_path / "hashes.json"), seed=lambda: _chunks("speed"))
+    fresh, digests = registry.reserve(_chunks("speed", "force", "force"))
+    assert [chunk.page_content for chunk in fresh] == ["force"]
+    assert registry.reserve(_chunks("force"))[0] == []
+
+    registry.release(digests)
+    assert [chunk.page_content for chunk in registry.reserve(_chunks("force"))[0]] == ["force"]
+    assert registry.reserve(_chunks("force", chapter="Gravitation"))[0] != []
+
+
+def test_ingest_drops_chunks_another_worker_indexed_while_embedding(tmp_path):
+    """A chunk committed by another process after reservation is not appended twice."""
+    path = str(tmp_path / "hashes.json")
+    ours, theirs = HashRegistry(path), HashRegistry(path)  # one per worker process
+    written = []
+
+    def embed_while_other_worker_commits(texts, report):
+        theirs.commit(theirs.reserve(_chunks("speed"))[1])
+        return [[0.0]] * len(texts)
+
+    with (
+        patch.object(settings, "faiss_index_path", str(tmp_path)),
+        patch("rag.ingestor.ingest_registry", ours),
+        patch("rag.ingestor._embed_in_batches", side_effect=embed_while_other_worker_commits),
+        patch(
+            "rag.ingestor._add_to_content_index",
+            side_effect=lambda texts, vectors, metadatas: written.extend(texts),
+        ),
+    ):
+        counts = _index_new_chunks(_chunks("speed", "force"), {"digest": "physics.pdf"}, MagicMock())
+
+    assert written == ["force"]
+    assert counts == {"physics.pdf": 1}
+    assert HashRegistry(path).stats() == {"files": 1, "chunks": 2}
+
+
+# ---------------------------------------------------------------------------
+# Hybrid retrieval
+# ---------------------------------------------------------------------------
+
+PHYSICS = [
+    "Hooke's law: the extension of a spring is proportional to the force applied.",
+    "Friction opposes the relative motion between two surfaces in contact.",
+    "Pressure is the force acting per unit area of a surface.",
+]
+
+
+def test_bm25_search_spans_legacy_base_and_new_segments(tmp_path):
+    """Keyword search should rank exact terms first across pickled and SQLite parts."""
+    path = str(tmp_path / "content")
+    _store(PHYSICS[1:], chapter="Force").save_local(path)
+    append_segment(path, _store(PHYSICS[:1], chapter="Force"))
+    append_segment(path, _store(["Plants make food by photosynthesis."], chapter="Nutrition"))
+    index = SegmentedIndex.load(path, read_manifest(path), FAKE_EMBEDDINGS)
+
+    hits = index.bm25_search("What is Hooke's law?", k=2)
+    assert hits[0][0].page_content == PHYSICS[0]
+    assert [doc.page_content for doc, _ in index.bm25_search("force", k=5)] != []
+    assert index.bm25_search("force", k=5, filter={"chapter": "Nutrition"}) == []
+
+
+def test_hybrid_retrieve_fuses_keyword_and_vector_rankings(tmp_path):
+    """Hybrid mode should surface the exact-term chunk even when vectors disagree."""
+    path = str(tmp_path / "content")
+    append_segment(path, _store(PHYSICS, chapter="Force"))
+    query = "explain hooke's law"
+    embedding = FAKE_EMBEDDINGS.embed_query(query)
+
+    with (
+        patch("rag.retriever.index_manager", IndexManager({"content": path})),
+        patch("rag.index_manager.get_embeddings", return_value=FAKE_EMBEDDINGS),
+    ):
+        [vector_doc] = retrieve(query, k=1, embedding=embedding, mode="vector")
+        [hybrid_doc] = retrieve(query, k=1, chapter="Force", embedding=embedding, mode="hybrid")
+
+    assert vector_doc.page_content != PHYSICS[0]
+    assert hybrid_doc.page_content == PHYSICS[0]
+
+
+# ---------------------------------------------------------------------------
+# Context packing
+# ---------------------------------------------------------------------------
+
+def test_pack_context_trims_splitter_overlap_and_respects_budget():
+    """Adjacent chunks should not repeat their shared text, and the budget is a hard cap."""
+    page = " ".join(f"Sentence {i} explains one more idea about magnetism." for i in range(30))
+    first, second = page[:600], page[450:1100]
+    meta = {"source": "physics.pdf", "page": 3}
+    docs = [
+        Document(page_content=first, metadata=meta),
+        Document(page_content=second, metadata=meta),
+        Document(page_content=PHYSICS[0], metadata={"source": "force.pdf", "page": 1}),
+    ]
+
+    packed = pack_context(docs, budget=10_000, overlap_limit=200)
+    assert packed.chunks_used == 3
+    assert packed.overlap_trimmed > 0
+    assert packed.text.count(page[450:600]) == 1
+
+    small = pack_context(docs, budget=120, overlap_limit=200)
+    assert small.tokens <= 120
+    assert count_tokens(small.text) <= small.tokens
+    assert first.startswith(small.text) and small.text.endswith("magnetism.")
+    assert small.chunks_used < 3 and small.chunks_retrieved == 3
+
+
+# ---------------------------------------------------------------------------
+# Reranking
+# ---------------------------------------------------------------------------
+
+async def test_lexical_reranker_keeps_the_precise_chunks_of_an_overfetch():
+    """The chunks naming the query's rare terms should be kept, best first."""
+    docs = [Document(page_content=text) for text in PHYSICS[1:] + PHYSICS[:1]]
+    reranker = Reranker(mode="lexical", fetch_k=3, top_k=1, timeout_ms=1000)
+
+    [kept] = await reranker.rerank("explain hooke's law", docs)
+
+    assert kept.page_content == PHYSICS[0]
+    stats = reranker.stats()
+    assert (stats["reranked"], stats["chunks_fetched"], stats["chunks_kept"]) == (1, 3, 1)
+
+
+async def test_reranker_keeps_retrieval_order_when_over_time_budget():
+    """A slow scorer is skipped without blocking the loop, and does not hold up the next call."""
+    def slow(query, docs):
+        time.sleep(0.5)
+        return list(range(len(docs)))
+
+    docs = [Document(page_content=text) for text in PHYSICS]
+    reranker = Reranker(mode="lexical", fetch_k=3, top_k=2, timeout_ms=20, scorers={"lexical": slow})
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        for _ in range(5):
+            await asyncio.sleep(0.002)
+            ticks += 1
+
+    started = time.perf_counter()
+    kept, _ = await asyncio.gather(reranker.rerank("friction", docs), ticker())
+    second = await reranker.rerank("friction", docs)
+
+    assert time.perf_counter() - started < 0.2
+    assert ticks == 5
+    assert kept == second == docs[:2]
+    assert (reranker.stats()["timeouts"], reranker.stats()["busy"]) == (1, 1)
+
+
+def test_unknown_rerank_mode_turns_reranking_off():
+    """A mistyped RERANK_MODE must not stop the app from starting."""
+    reranker = Reranker(mode="crossencoder", fetch_k=3, top_k=2, timeout_ms=20)
+    assert reranker.mode == "off" and not reranker.enabled
+
+
+# ---------------------------------------------------------------------------
+# LLM scheduler
+# ---------------------------------------------------------------------------
+
+def _scheduler(**overrides) -> LLMScheduler:
+    options = dict(
+        requests_per_minute=600,
+        tokens_per_minute=60_000,
+        max_concurrency=1,
+        max_retries=2,
+        backoff_seconds=0.01,
+        backoff_max_seconds=0.02,
+        queue_timeout_seconds=5,
+    )
+    options.update(overrides)
+    return LLMScheduler(**options)
+
+
+async def test_scheduler_admits_interactive_calls_ahead_of_bulk():
+    """With one slot busy, a later interactive call should run before queued bulk calls."""
+    scheduler = _scheduler()
+    order = []
+    gate = asyncio.Event()
+
+    async def call(name, wait=None):
+        if wait is not None:
+            await wait.wait()
+        order.append(name)
+        return name
+
+    first = asyncio.create_task(scheduler.run(lambda: call("first", gate)))
+    await asyncio.sleep(0.01)
+    bulk = [asyncio.create_task(scheduler.run(lambda i=i: call(f"bulk{i}"), priority="bulk")) for i in range(2)]
+    await asyncio.sleep(0.01)
+    interactive = asyncio.create_task(scheduler.run(lambda: call("interactive")))
+    await asyncio.sleep(0.01)
+    assert scheduler.stats()["queue_depth"] == {"interactive": 1, "bulk": 2}
+
+    gate.set()
+    await asyncio.gather(first, interactive, *bulk)
+    assert order == ["first", "interactive", "bulk0", "bulk1"]
+
+
+async def test_scheduler_retries_rate_limited_calls_then_gives_up():
+    """429s should be retried with backoff; the error surfaces once retries run out."""
+    class RateLimited(Exception):
+        status_code = 429
+        response = None
+
+    scheduler = _scheduler()
+    attempts = 0
+
+    async def flaky():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise RateLimited()
+        return "ok"
+
+    assert await scheduler.run(flaky) == "ok"
+    assert (attempts, scheduler.stats()["retries"], scheduler.stats()["rate_limited"]) == (3, 2, 2)
+
+    async def always_limited():
+        raise RateLimited()
+
+    with pytest.raises(RateLimited):
+        await scheduler.run(always_limited)
+    assert scheduler.stats()["failures"] == 1
+
+
+def test_retry_after_covers_only_quota_exhaustion():
+    """Queue timeouts and 429s map to a client wait; other failures do not."""
+    class RateLimited(Exception):
+        status_code = 429
+        response = MagicMock(headers={"retry-after": "7.5"})
+
+    class ServerError(Exception):
+        status_code = 500
+
+    assert retry_after(QueueTimeout("busy", retry_after=0.2)) == 1
+    assert retry_after(RateLimited()) == 8
+    assert retry_after(ServerError()) is None
+    assert retry_after(ValueError()) is None
+
+
+async def test_scheduler_paces_calls_to_the_requests_per_minute_bucket():
+    """Once the bucket is empty, calls wait for it to refill."""
+    scheduler = _scheduler(requests_per_minute=60, max_concurrency=4)
+    scheduler.requests._level = 1  # one request left; refills at 1/s
+
+    async def call():
+        return time.monotonic()
+
+    started = time.monotonic()
+    first, second = await asyncio.gather(scheduler.run(call), scheduler.run(call))
+    assert first - started < 0.2
+    assert second - started >= 0.9
+
+
+# ---------------------------------------------------------------------------
+# Request coalescing
+# ---------------------------------------------------------------------------
+
+async def test_single_flight_shares_result_and_error_then_forgets_key():
+    """Concurrent callers of one key share a call; a finished key starts afresh."""
+    flight = SingleFlight()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    results = await asyncio.gather(
+        flight.do("k", failing), flight.do("k", failing), return_exceptions=True
+    )
+    assert [type(r) for r in results] == [ValueError, ValueError]
+    assert calls == 1
+
+    async def ok():
+        return "fresh"
+
+    assert await flight.do("k", ok) == "fresh"
+    assert flight.stats() == {"calls": 2, "coalesced": 1, "in_flight": 0}
+
+
+# ---------------------------------------------------------------------------
+# Chapter precompute store
+# ---------------------------------------------------------------------------
+
+def test_chapter_store_matches_opening_query_and_survives_restart(tmp_path):
+    """Only the chapter-opening query is served; invalidation drops the chapter on disk."""
+    path = str(tmp_path / "chapters.json")
+    store = ChapterStore(path)
+    query = chapter_query("adhd", 8, "Science", "Light")
+    store.put_adapt(8, "Science", "Light", "adhd", query, {"simplified": "stored"})
+    store.put_artifact("quiz", 8, "Science", "Light", {"questions": []})
+
+    reopened = ChapterStore(path)
+    assert reopened.get_adapt(8, "Science", "Light", "adhd", "  " + query.upper()) == {
+        "simplified": "stored"
+    }
+    assert reopened.get_adapt(8, "Science", "Light", "adhd", "What is refraction?") is None
+    assert reopened.get_adapt(8, "Science", "Light", "dyslexia", query) is None
+    assert reopened.get_artifact("quiz", 8, "Science", "Light") == {"questions": []}
+
+    assert store.invalidate(grade=8, subject="Science") == 1
+    assert reopened.get_artifact("quiz", 8, "Science", "Light") is None
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def test_synthetic_chapter_pdf_parses_into_tagged_chunks():
+    """The benchmark's generated PDF goes through the real parse and split steps."""
+    corpus = SyntheticCorpus(seed=1)
+    grade, subject, title, topics = corpus.chapter(3)
+    pages = [corpus.text(topics, words=300) for _ in range(3)]
+
+    parsed = _parse(PdfUpload(synthetic_pdf(pages), "bench.pdf", grade=grade, chapter=title))
+    chunks = _split(parsed)
+
+    assert len(parsed) == 3
+    assert topics[0] in " ".join(doc.page_content for doc in parsed).lower()
+    assert len(chunks) > 3 and all(c.metadata["chapter"] == title for c in chunks)
+
+
+def test_bench_compare_flags_only_material_slowdowns():
+    """Regressions must exceed both the relative threshold and the absolute floor."""
+
+    def document(retrieve_ms, parse_s, pedagogy_ms):
+        return {
+            "meta": {},
+            "results": {
+                "1000": {
+                    "ingest": {"parse_s": parse_s, "chunks": 200},
+                    "retrieval": {
+                        "retrieve": {"p50_ms": retrieve_ms},
+                        "retrieve_pedagogy": {"p50_ms": pedagogy_ms},
+                    },
+                }
+            },
+        }
+
+    rows = compare(document(10.0, 0.5, 0.2), document(20.0, 0.2, 0.6), threshold=0.25)
+    status = {row["metric"]: row["status"] for row in rows}
+
+    assert status == {
+        "ingest.parse_ms": "improvement",
+        "retrieval.retrieve.p50_ms": "regression",
+        # Tripled, but by less than the 1 ms floor.
+        "retrieval.retrieve_pedagogy.p50_ms": "ok",
+    }
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+def test_histogram_renders_cumulative_prometheus_buckets():
+    """Buckets are cumulative, labels are escaped and unknown labels are rejected."""
+    histogram = Histogram("t_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, stage='say "hi"')
+    tokens = Counter("t_tokens_total", "Test.", ("chain",))
+    tokens.inc(5, chain="quiz")
+    tokens.inc(2, chain="quiz")
+
+    lines = histogram.render() + tokens.render()
+
+    assert 't_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{stage="say \\"hi\\"",le="1"} 3' in lines
+    assert 't_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 4' in lines
+    assert 't_seconds_count{stage="say \\"hi\\""} 4' in lines
+    assert 't_tokens_total{chain="quiz"} 7' in lines
+    assert "# TYPE t_seconds histogram" in lines
+    with pytest.raises(ValueError):
+        histogram.observe(1.0, chain="quiz")
+
+
+def test_stages_are_collected_for_server_timing_only_inside_a_request():
+    """Repeated stages are summed in the header; outside collection nothing is kept."""
+    with stage("outside"):
+        pass
+    with collect_timings() as timings:
+        for _ in range(2):
+            with stage("pedagogy_search"):
+                time.sleep(0.001)
+        with stage("context_packing"):
+            pass
+
+    assert [name for name, _ in timings] == ["pedagogy_search"] * 2 + ["context_packing"]
+    header = server_timing_header(timings)
+    assert header.startswith("pedagogy_search;dur=")
+    assert 'desc="x2"' in header and ", context_packing;dur=" in header
+
+
+# ---------------------------------------------------------------------------
+# Tracing
+# ---------------------------------------------------------------------------
+
+def test_trace_exporter_rotates_and_keeps_only_slow_traces(tmp_path):
+    """Old traces move to numbered backups; the oldest beyond TRACE_BACKUPS are dropped."""
+    def finished(name, ms):
+        trace = Trace(name)
+        trace.finish(status=200)
+        trace.root.duration_ms = ms
+        return trace
+
+    exporter = TraceExporter()
+    path = tmp_path / "traces.jsonl"
+    with (
+        patch.object(settings, "trace_path", str(path)),
+        patch.object(settings, "trace_max_bytes", 600),
+        patch.object(settings, "trace_backups", 2),
+        patch.object(settings, "trace_min_duration_ms", 5),
+    ):
+        exporter.export(finished("GET /fast", 1))
+        for n in range(12):
+            exporter.export(finished(f"POST /adapt{n}", 10 + n))
+
+        assert path.exists() and (tmp_path / "traces.jsonl.2").exists()
+        assert not (tmp_path / "traces.jsonl.3").exists()
+        kept = [t["name"] for t in exporter.traces()]
+        slowest = exporter.slowest(limit=2)
+
+    assert "GET /fast" not in kept and "POST /adapt0" not in kept
+    assert kept[0] == "POST /adapt11"
+    assert [t["name"] for t in slowest] == ["POST /adapt11", "POST /adapt10"]
+
+
+async def test_gathered_tasks_record_sibling_spans_under_their_parent():
+    """Spans opened in asyncio.gather tasks nest under the span that started them."""
+    from rag import tracing
+
+    trace = Trace("test")
+    token = tracing._trace.set(trace)
+    parent_token = tracing._parent.set(trace.root.span_id)
+    try:
+        async def chain(name):
+            with span("chain", chain=name):
+                await asyncio.sleep(0)
+                with stage("llm_upstream"):
+                    await asyncio.sleep(0)
+
+        with span("adapt") as adapt:
+            await asyncio.gather(chain("a"), chain("b"))
+    finally:
+        tracing._parent.reset(parent_token)
+        tracing._trace.reset(token)
+
+    by_name = {}
+    for s in trace.spans:
+        by_name.setdefault(s.name, []).append(s)
+    assert adapt.parent_id == trace.root.span_id
+    assert {s.parent_id for s in by_name["chain"]} == {adapt.span_id}
+    assert {s.parent_id for s in by_name["llm_upstream"]} == {s.span_id for s in by_name["chain"]}
+    assert all(s.duration_ms is not None for s in trace.spans[1:])